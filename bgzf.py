@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+'''
+Reading and writing BGZF (bgzip) compressed files, with multithreaded
+(de)compression and random access.
+
+BGZF is the blocked gzip format used by bgzip, samtools and tabix.  A BGZF file
+is a series of gzip members, each holding at most 64KB of uncompressed data and
+recording its own compressed size in a 'BC' extra subfield.  Since every block
+can be found without decompressing the blocks before it, blocks can be
+decompressed in parallel and a seek only needs to decompress one block.  A BGZF
+file is a valid gzip file, so gzip and zcat can read it too.
+
+A .gzi index (as written by `bgzip -i` or `samtools faidx`) maps the
+uncompressed offset of every block to its compressed offset.  Random access
+uses the .gzi index next to the file if there is one, or otherwise builds the
+index by scanning the block headers, which does not require decompression.
+
+Usage:
+
+    with BgzfWriter('genome.fa.gz', gziPath='genome.fa.gz.gzi') as fh:
+        fh.write(data)
+
+    with BgzfReader('genome.fa.gz') as fh:
+        fh.seek(1000000)
+        data = fh.read(100)
+'''
+
+import bisect
+import itertools
+import multiprocessing.pool
+import os
+import struct
+import zlib
+
+
+# the fixed part of the header of a BGZF block: gzip magic, deflate, FEXTRA flag, mtime, xfl, os, xlen.
+_HEADER = struct.Struct('<4BI2BH')
+# the number of blocks each decompression thread is given at a time.
+BLOCKS_PER_THREAD = 16
+# the maximum number of uncompressed bytes in a block, as in htslib.
+MAX_BLOCK_DATA = 0xff00
+
+
+def isBgzf(header):
+    '''
+    header: the first bytes (at least 16) of a file.
+    returns: True if the file starts with a BGZF block.
+    '''
+    if len(header) < 16 or header[:4] != '\x1f\x8b\x08\x04':
+        return False
+    xlen = _HEADER.unpack(header[:12])[-1]
+    return _blockSize(header[:12 + xlen]) is not None
+
+
+def readBlock(fh):
+    '''
+    fh: a file object positioned at the start of a BGZF block.
+    returns: the compressed block, or '' at the end of the file.
+    '''
+    header = fh.read(12)
+    if not header:
+        return ''
+    if len(header) < 12 or header[:4] != '\x1f\x8b\x08\x04':
+        raise Exception('BGZF error: invalid block header.', header)
+    extra = fh.read(_HEADER.unpack(header)[-1])
+    size = _blockSize(header + extra)
+    if size is None:
+        raise Exception('BGZF error: block header has no BC subfield.', header + extra)
+    rest = fh.read(size - len(header) - len(extra))
+    if len(rest) != size - len(header) - len(extra):
+        raise Exception('BGZF error: truncated block.')
+    return header + extra + rest
+
+
+def decompressBlock(block):
+    '''
+    block: a compressed BGZF block.
+    returns: the uncompressed data in the block.
+    '''
+    xlen = _HEADER.unpack(block[:12])[-1]
+    data = zlib.decompress(block[12 + xlen:-8], -15)
+    crc, size = struct.unpack('<iI', block[-8:])
+    if size != len(data) or crc != zlib.crc32(data):
+        raise Exception('BGZF error: block failed integrity check.')
+    return data
+
+
+def compressBlock(data, level=6):
+    '''
+    data: at most MAX_BLOCK_DATA bytes of data.
+    returns: a BGZF block containing data.  compressBlock('') is the empty
+    block bgzip writes to mark the end of a file.
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = _HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6)
+    extra = struct.pack('<2BHH', 66, 67, 2, 18 + len(cdata) + 8 - 1)
+    return header + extra + cdata + struct.pack('<iI', zlib.crc32(data), len(data))
+
+
+def buildGzi(path):
+    '''
+    path: path to a BGZF file.
+    Reads the header and footer of every block, without decompressing them.
+    returns: a list of (compressedOffset, uncompressedOffset) tuples, one for
+    the start of every block, starting with (0, 0).
+    '''
+    index = []
+    coffset = uoffset = 0
+    with open(path, 'rb') as fh:
+        while True:
+            header = fh.read(12)
+            if not header:
+                break
+            extra = fh.read(_HEADER.unpack(header)[-1])
+            size = _blockSize(header + extra)
+            if size is None:
+                raise Exception('BGZF error: block header has no BC subfield.', coffset)
+            fh.seek(coffset + size - 4)
+            index.append((coffset, uoffset))
+            coffset += size
+            uoffset += struct.unpack('<I', fh.read(4))[0]
+    return index
+
+
+def writeGzi(index, gziPath):
+    '''
+    index: a list of (compressedOffset, uncompressedOffset) tuples, as
+    returned by buildGzi().
+    gziPath: where to write the index in the .gzi format of bgzip.  As in
+    bgzip, the (0, 0) entry for the first block is implied, not written.
+    '''
+    entries = [entry for entry in index if entry != (0, 0)]
+    with open(gziPath, 'wb') as fh:
+        fh.write(struct.pack('<Q', len(entries)))
+        for entry in entries:
+            fh.write(struct.pack('<QQ', *entry))
+
+
+def readGzi(gziPath):
+    '''
+    returns: the list of (compressedOffset, uncompressedOffset) tuples in the
+    .gzi file at gziPath, including the implied (0, 0).
+    '''
+    with open(gziPath, 'rb') as fh:
+        n = struct.unpack('<Q', fh.read(8))[0]
+        data = fh.read(16 * n)
+    values = struct.unpack('<%sQ' % (2 * n), data)
+    return [(0, 0)] + zip(values[0::2], values[1::2])
+
+
+class BgzfReader(object):
+    '''
+    A read-only file-like object over the uncompressed contents of a BGZF
+    file.  Sequential reads decompress batches of blocks in a pool of threads,
+    since zlib releases the GIL while decompressing.  seek() and tell() use
+    uncompressed offsets.
+    '''
+    def __init__(self, path, numThreads=None, gziPath=None):
+        '''
+        path: path to a BGZF file.
+        numThreads: the number of decompression threads.  Defaults to the
+        number of cpus.  Use 1 to decompress in the calling thread.
+        gziPath: path to the .gzi index of the file.  Defaults to path +
+        '.gzi'.  If it does not exist, the index is built when first needed.
+        '''
+        self.path = path
+        self.gziPath = gziPath if gziPath is not None else path + '.gzi'
+        self.numThreads = numThreads or multiprocessing.cpu_count()
+        self.fh = open(path, 'rb')
+        self.pool = None
+        self.index = None
+        self.uoffsets = None
+        self._seekTo(0, 0, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        '''
+        yields: lines of the uncompressed data.
+        '''
+        pending = ''
+        while True:
+            block = self.read(65536)
+            if not block:
+                break
+            lines = (pending + block).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if pending:
+            yield pending
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.fh.close()
+
+    def tell(self):
+        return self.offset
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        '''
+        Seek to an uncompressed offset.  Seeking relative to the end of the
+        file is not supported.
+        '''
+        if whence == os.SEEK_CUR:
+            offset += self.offset
+        elif whence != os.SEEK_SET:
+            raise IOError('BgzfReader only supports seeking from the start or current position.')
+        if self.index is None:
+            if os.path.exists(self.gziPath):
+                self.index = readGzi(self.gziPath)
+            else:
+                self.index = buildGzi(self.path)
+            self.uoffsets = [uoffset for coffset, uoffset in self.index]
+        # the last block starting at or before offset
+        i = max(bisect.bisect_right(self.uoffsets, offset) - 1, 0)
+        coffset, uoffset = self.index[i]
+        self._seekTo(coffset, uoffset, offset)
+
+    def read(self, size=-1):
+        '''
+        returns: up to size bytes of uncompressed data, or all the remaining
+        data if size is negative.
+        '''
+        chunks = []
+        while size != 0:
+            if self.pos >= len(self.data):
+                self.data = next(self.blocks, '')
+                self.pos = 0
+                if not self.data:
+                    break
+            chunk = self.data[self.pos:self.pos + size] if size > 0 else self.data[self.pos:]
+            self.pos += len(chunk)
+            if size > 0:
+                size -= len(chunk)
+            chunks.append(chunk)
+        data = ''.join(chunks)
+        self.offset += len(data)
+        return data
+
+    def _seekTo(self, coffset, uoffset, offset):
+        '''
+        Position the reader at uncompressed offset, which is in the block
+        starting at coffset and uoffset.
+        '''
+        self.fh.seek(coffset)
+        self.blocks = self._decompressedBlocks()
+        self.data = next(self.blocks, '')
+        self.pos = offset - uoffset
+        self.offset = offset
+
+    def _decompressedBlocks(self):
+        '''
+        yields: the uncompressed data of each block from the current position
+        of the compressed file, decompressing batches of blocks in parallel.
+        '''
+        blocks = iter(lambda: readBlock(self.fh), '')
+        # start with a single block, so a seek followed by a short read only decompresses one block, and double the
+        # batch size up to the maximum as reading continues.
+        batchSize = 1
+        while True:
+            batch = list(itertools.islice(blocks, batchSize))
+            batchSize = min(2 * batchSize, self.numThreads * BLOCKS_PER_THREAD)
+            if not batch:
+                break
+            if self.numThreads > 1 and len(batch) > 1:
+                if self.pool is None:
+                    self.pool = multiprocessing.pool.ThreadPool(self.numThreads)
+                data = self.pool.map(decompressBlock, batch)
+            else:
+                data = map(decompressBlock, batch)
+            for block in data:
+                yield block
+
+
+class BgzfWriter(object):
+    '''
+    A write-only file-like object that compresses what is written to it into
+    a BGZF file.  Batches of blocks are compressed in a pool of threads.
+    '''
+    def __init__(self, path, numThreads=None, level=6, gziPath=None):
+        '''
+        path: where to write the BGZF file.
+        numThreads: the number of compression threads.  Defaults to the
+        number of cpus.  Use 1 to compress in the calling thread.
+        level: the zlib compression level.
+        gziPath: if not None, a .gzi index of the file is written here when
+        the writer is closed.
+        '''
+        self.path = path
+        self.numThreads = numThreads or multiprocessing.cpu_count()
+        self.level = level
+        self.gziPath = gziPath
+        self.fh = open(path, 'wb')
+        self.pool = None
+        self.pending = [] # data not yet compressed
+        self.pendingSize = 0
+        self.index = []
+        self.coffset = self.uoffset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, data):
+        self.pending.append(data)
+        self.pendingSize += len(data)
+        if self.pendingSize >= self.numThreads * BLOCKS_PER_THREAD * MAX_BLOCK_DATA:
+            self._compress(final=False)
+
+    def close(self):
+        if self.fh.closed:
+            return
+        self._compress(final=True)
+        self.index.append((self.coffset, self.uoffset))
+        self.fh.write(compressBlock(''))
+        self.fh.close()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.gziPath is not None:
+            writeGzi(self.index, self.gziPath)
+
+    def _compress(self, final):
+        '''
+        Compress and write the pending data in full blocks, and, if final is
+        True, the last partial block too.
+        '''
+        data = ''.join(self.pending)
+        end = len(data) if final else len(data) - len(data) % MAX_BLOCK_DATA
+        chunks = [data[i:i + MAX_BLOCK_DATA] for i in xrange(0, end, MAX_BLOCK_DATA)]
+        self.pending = [data[end:]]
+        self.pendingSize = len(data) - end
+        if self.numThreads > 1 and len(chunks) > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.pool.ThreadPool(self.numThreads)
+            blocks = self.pool.map(lambda chunk: compressBlock(chunk, self.level), chunks)
+        else:
+            blocks = [compressBlock(chunk, self.level) for chunk in chunks]
+        for chunk, block in zip(chunks, blocks):
+            self.index.append((self.coffset, self.uoffset))
+            self.coffset += len(block)
+            self.uoffset += len(chunk)
+        self.fh.write(''.join(blocks))
+
+
+def _blockSize(header):
+    '''
+    header: the header of a BGZF block, including the extra subfields.
+    returns: the total size of the block in bytes, from its BC subfield, or
+    None if there is no BC subfield.
+    '''
+    pos = 12
+    while pos + 4 <= len(header):
+        si1, si2, slen = struct.unpack('<2BH', header[pos:pos + 4])
+        if si1 == 66 and si2 == 67 and slen == 2:
+            return struct.unpack('<H', header[pos + 4:pos + 6])[0] + 1
+        pos += 4 + slen
+    return None
+
+
@@ -5,9 +5,21 @@
 Algorithms for clustering edges into connected components
 http://en.wikipedia.org/wiki/Connected_component_(graph_theory)
 Handles undirected edges with or without edge weights.  
+UnionFindClusterer scales to graphs with hundreds of millions of edges.
+clusterEdgeFiles() clusters sharded edge files in parallel, and
+clusterEdgeFilesOutOfCore() clusters graphs whose nodes do not fit in memory.
+numpy is only imported by the functions that use it, so SimpleEdgeClusterer
+and EdgeClusterer.cluster() work without it.
 '''
 
 
+import contextlib
+import gc
+import itertools
+import os
+import struct
+
+import temps
 import util
 
 
@@ -96,6 +108,7 @@ class EdgeClusterer:
         self.classifyNode = classifyNodeFunc
         self.storeEdges = storeEdges
         self.clusterIdToEdges = {}
+        self.unionFind = None # the UnionFindClusterer kept by clusterMany()
 
     def cluster(self, edge):
         '''
@@ -127,6 +140,8 @@ class EdgeClusterer:
         
         # self.numEdges += 1
         (fromNodeId, toNodeId, distance) = edge
+        if self.unionFind is not None:
+            self.unionFind.cluster(edge)
         
         # get cluster ids of the nodes
         fromNodeClusterId = None
@@ -188,6 +203,525 @@ class EdgeClusterer:
             if self.storeEdges:
                 self.clusterIdToEdges[largerClusterId].extend(self.clusterIdToEdges[smallerClusterId])
 
+    def clusterMany(self, fromNodes, toNodes, distances, nodeIds=None):
+        '''
+        fromNodes, toNodes: sequences of the node ids of the ends of edges, or, if nodeIds is given, integer arrays of
+          indices into nodeIds.
+        distances: a sequence or array of the distance of every edge.
+        nodeIds: an optional sequence of node ids, e.g. the node id dictionary of an edge file.
+        Clusters a batch of edges, leaving the same clusters and statistics as calling cluster() on every edge, except
+        that cluster ids may differ and distance sums may differ by rounding.  Instead of updating the clusters and
+        statistics edge by edge, the components are computed in bulk with a UnionFindClusterer, which is kept for later
+        batches, the edge counts and distance sums of every component are summed with numpy.bincount, and the clusters
+        and statistics are updated once per changed cluster and once per new node.  Apart from merging existing
+        clusters, the work done is proportional to the size of the batch.
+        returns: nothing.
+        '''
+        np = _numpy()
+        distances = np.asarray(distances, dtype=np.float64)
+        uf = self._unionFindClusterer()
+        if nodeIds is None:
+            a = uf.internMany(fromNodes)
+            b = uf.internMany(toNodes)
+        else:
+            # only intern the node ids the edges use.
+            used, inverse = np.unique(np.concatenate((np.asarray(fromNodes, dtype=np.int64),
+                                                      np.asarray(toNodes, dtype=np.int64))), return_inverse=True)
+            indices = uf.internMany([nodeIds[i] for i in used.tolist()])[inverse]
+            a, b = indices[:len(indices) // 2], indices[len(indices) // 2:]
+        if not len(a):
+            return
+        # the distinct nodes of the batch and the cluster they were in before the batch, or 0 for new nodes.
+        ends, endInverse = np.unique(np.concatenate((a, b)), return_inverse=True)
+        endNodeIds = [uf.nodeIds[i] for i in ends.tolist()]
+        oldIds = np.array([self.nodeIdToClusterId.get(nodeId, 0) for nodeId in endNodeIds], dtype=np.int64)
+        uf.clusterMany(np.column_stack((a, b)))
+        roots, endComponents = np.unique(uf._findMany(ends), return_inverse=True) # the component of every end
+        numComponents = len(roots)
+        edgeComponents = endComponents[endInverse[:len(a)]]
+        numEdges = np.bincount(edgeComponents, minlength=numComponents)
+        sumDistances = np.bincount(edgeComponents, weights=distances, minlength=numComponents)
+
+        # each component keeps the id of its largest existing cluster, or gets a new id.
+        componentIds = np.zeros(numComponents, dtype=np.int64)
+        isOld = oldIds > 0
+        oldClusterIds, first = np.unique(oldIds[isOld], return_index=True)
+        oldComponents = endComponents[isOld][first]
+        if len(oldClusterIds):
+            sizes = np.array([len(self.clusterIdToNodes[clusterId]) for clusterId in oldClusterIds.tolist()])
+            order = np.lexsort((sizes, oldComponents))
+            last = np.concatenate((oldComponents[order][1:] != oldComponents[order][:-1], [True]))
+            componentIds[oldComponents[order][last]] = oldClusterIds[order][last]
+        for component in np.flatnonzero(componentIds == 0).tolist():
+            componentIds[component] = clusterId = self.nextClusterId
+            self.nextClusterId += 1
+            self.clusterIdToNodes[clusterId] = set()
+            self.clusterIdToNodeClasses[clusterId] = set()
+            self.clusterIdToSumDistances[clusterId] = 0
+            self.clusterIdToNumEdges[clusterId] = 0
+            if self.storeEdges:
+                self.clusterIdToEdges[clusterId] = []
+
+        # merge the other existing clusters of each component into the cluster keeping its id.
+        targetIds = componentIds[oldComponents]
+        for oldClusterId, clusterId in itertools.izip(oldClusterIds.tolist(), targetIds.tolist()):
+            if oldClusterId != clusterId:
+                nodes = self.clusterIdToNodes.pop(oldClusterId)
+                for nodeId in nodes:
+                    self.nodeIdToClusterId[nodeId] = clusterId
+                self.clusterIdToNodes[clusterId].update(nodes)
+                self.clusterIdToNodeClasses[clusterId].update(self.clusterIdToNodeClasses.pop(oldClusterId))
+                self.clusterIdToSumDistances[clusterId] += self.clusterIdToSumDistances.pop(oldClusterId)
+                self.clusterIdToNumEdges[clusterId] += self.clusterIdToNumEdges.pop(oldClusterId)
+                if self.storeEdges:
+                    self.clusterIdToEdges[clusterId].extend(self.clusterIdToEdges.pop(oldClusterId))
+
+        # add the new nodes, classifying each one once and adding each distinct class once per cluster.
+        newEnds = np.flatnonzero(~isOld)
+        newIds = componentIds[endComponents[newEnds]]
+        classIndex = {}
+        classes = np.fromiter((classIndex.setdefault(self.classifyNode(endNodeIds[end]), len(classIndex))
+                               for end in newEnds.tolist()), dtype=np.int64, count=len(newEnds))
+        for end, clusterId in itertools.izip(newEnds.tolist(), newIds.tolist()):
+            nodeId = endNodeIds[end]
+            self.nodeIdToClusterId[nodeId] = clusterId
+            self.clusterIdToNodes[clusterId].add(nodeId)
+        classNames = [None] * len(classIndex)
+        for nodeClass, index in classIndex.iteritems():
+            classNames[index] = nodeClass
+        for key in np.unique(newIds * len(classIndex) + classes).tolist():
+            self.clusterIdToNodeClasses[key // len(classIndex)].add(classNames[key % len(classIndex)])
+
+        # add the edge statistics of every component.
+        for component in xrange(numComponents):
+            clusterId = int(componentIds[component])
+            self.clusterIdToSumDistances[clusterId] += float(sumDistances[component])
+            self.clusterIdToNumEdges[clusterId] += int(numEdges[component])
+        if self.storeEdges:
+            distanceList = distances.tolist()
+            order = np.argsort(edgeComponents, kind='mergesort')
+            starts = np.flatnonzero(np.concatenate(([True], edgeComponents[order][1:] != edgeComponents[order][:-1])))
+            for edges in np.split(order, starts[1:]):
+                self.clusterIdToEdges[int(componentIds[edgeComponents[edges[0]]])].extend(
+                    (uf.nodeIds[a[i]], uf.nodeIds[b[i]], distanceList[i]) for i in edges.tolist())
+
+    def _unionFindClusterer(self):
+        '''
+        returns: the UnionFindClusterer of the nodes used by clusterMany().  The first call makes it from the existing
+        clusters.  Afterwards, cluster() and clusterMany() keep it up to date.
+        '''
+        np = _numpy()
+        if self.unionFind is None:
+            uf = UnionFindClusterer(nodeIds=list(self.nodeIdToClusterId))
+            oldIds = np.array([self.nodeIdToClusterId[nodeId] for nodeId in uf.nodeIds], dtype=np.int64)
+            oldClusterIds, firstNodes, oldClusters = np.unique(oldIds, return_index=True, return_inverse=True)
+            uf.clusterMany(np.column_stack((np.arange(len(oldIds)), firstNodes[oldClusters])))
+            self.unionFind = uf
+        return self.unionFind
+
+
+class UnionFindClusterer(object):
+    '''
+    Clusters nodes based on undirected edges into connected components, like SimpleEdgeClusterer, using much less
+    memory and time for graphs with hundreds of millions of edges.
+    Node ids are interned to dense integer indices, and the components are kept as a forest in numpy arrays of the
+    parent and size of every node, merged by weighted union-find with path compression.  No set of nodes is kept per
+    cluster, so merging clusters costs nearly constant time, and memory is about 16 bytes per node plus the interning
+    dict.
+    Edges can be clustered one at a time with cluster(), or in bulk with clusterMany(), which merges whole arrays of
+    edges at once with numpy.
+    Use components() to get the clusterIdToNodes and nodeIdToClusterId dicts of the other clusterers.
+    '''
+    def __init__(self, nodeIds=None, capacity=1024):
+        '''
+        nodeIds: an optional sequence of node ids, which are interned in order, so the id at position i has index i.
+          Useful with edge arrays that already refer to nodes by index.
+        capacity: the initial number of nodes the arrays have room for.  The arrays grow as needed.
+        '''
+        np = _numpy()
+        self.nodeIds = [] # node index => node id
+        self.nodeIndex = {} # node id => node index
+        self.parent = np.arange(max(1, capacity), dtype=np.int32)
+        self.size = np.ones(max(1, capacity), dtype=np.int32) # the number of nodes in the tree of every root
+        if nodeIds is not None:
+            self.internMany(nodeIds)
+
+    def intern(self, nodeId):
+        '''
+        returns: the index of nodeId, adding nodeId as a new node in a cluster of its own if it is new.
+        '''
+        index = self.nodeIndex.get(nodeId)
+        if index is None:
+            index = self.nodeIndex[nodeId] = len(self.nodeIds)
+            self.nodeIds.append(nodeId)
+            if index >= len(self.parent):
+                self._grow(index + 1)
+        return index
+
+    def internMany(self, nodeIds):
+        '''
+        nodeIds: an iterable of node ids.
+        returns: an integer array of the index of every node id.  See intern().
+        '''
+        np = _numpy()
+        if not isinstance(nodeIds, list):
+            nodeIds = list(nodeIds)
+        if not self.nodeIds:
+            self.nodeIndex = dict(itertools.izip(nodeIds, itertools.count()))
+            if len(self.nodeIndex) == len(nodeIds): # all the node ids are distinct
+                self.nodeIds = nodeIds[:]
+                if len(self.nodeIds) > len(self.parent):
+                    self._grow(len(self.nodeIds))
+                return np.arange(len(nodeIds), dtype=np.int64)
+            self.nodeIndex = {}
+        # look up all the node ids with one map() call, and intern the new ones in order.
+        indices = map(self.nodeIndex.get, nodeIds)
+        if None in indices:
+            get = self.nodeIndex.get
+            for i in [i for i, index in enumerate(indices) if index is None]:
+                nodeId = nodeIds[i]
+                index = get(nodeId)
+                if index is None:
+                    index = self.nodeIndex[nodeId] = len(self.nodeIds)
+                    self.nodeIds.append(nodeId)
+                indices[i] = index
+            if len(self.nodeIds) > len(self.parent):
+                self._grow(len(self.nodeIds))
+        return np.array(indices, dtype=np.int64)
+
+    def cluster(self, edge):
+        '''
+        edge: seq of (fromNodeId, toNodeId, ...)
+        returns: nothing.
+        '''
+        self._union(self._find(self.intern(edge[0])), self._find(self.intern(edge[1])))
+
+    def clusterMany(self, edges):
+        '''
+        edges: an integer array of shape (numEdges, 2) (or more columns, which are ignored) of the (fromIndex, toIndex)
+          node indices of edges.  Node indices come from intern(), internMany() or the nodeIds given to the
+          constructor, and indices not interned yet are not allowed.
+        Merges the clusters of the nodes of all the edges at once, in vectorized rounds of union-find.  See
+        _unionRounds().
+        returns: nothing.
+        '''
+        np = _numpy()
+        edges = np.asarray(edges)
+        if not len(edges):
+            return
+        if edges[:, :2].min() < 0 or edges[:, :2].max() >= len(self.nodeIds):
+            raise Exception('UnionFindClusterer error: edges refer to nodes that are not interned.')
+        slot = np.empty(len(self.nodeIds), dtype=np.int64)
+        _unionRounds(self.parent, self.size, slot, edges[:, 0].astype(self.parent.dtype),
+                     edges[:, 1].astype(self.parent.dtype))
+
+    def roots(self):
+        '''
+        Compresses every path in the forest.
+        returns: an array of the index of the root of the cluster of every node.
+        '''
+        n = len(self.nodeIds)
+        parent = self.parent[:n]
+        grandparent = parent[parent]
+        while (grandparent != parent).any():
+            parent[:] = grandparent
+            grandparent = parent[parent]
+        return parent.copy()
+
+    def labels(self):
+        '''
+        returns: a tuple of (numClusters, labels), where labels is an array of the cluster id of every node.  Cluster
+        ids are numbered from 1 in order of the first interned node of each cluster.
+        '''
+        np = _numpy()
+        roots, first, labels = np.unique(self.roots(), return_index=True, return_inverse=True)
+        # number the clusters in the order their first node was interned
+        rank = np.empty(len(roots), dtype=np.int64)
+        rank[np.argsort(first, kind='mergesort')] = np.arange(1, len(roots) + 1)
+        return len(roots), rank[labels]
+
+    def components(self):
+        '''
+        returns: a tuple of (clusterIdToNodes, nodeIdToClusterId) dicts, like the attributes of EdgeClusterer, except
+        that cluster ids are numbered as in labels().
+        '''
+        np = _numpy()
+        numClusters, labels = self.labels()
+        nodeIdToClusterId = dict(itertools.izip(self.nodeIds, labels.tolist()))
+        # slice the nodes sorted by cluster id into the nodes of each cluster.
+        order = np.argsort(labels, kind='mergesort')
+        nodeIds = np.empty(len(self.nodeIds), dtype=object)
+        nodeIds[:] = self.nodeIds
+        nodeIds = nodeIds[order].tolist()
+        ends = np.cumsum(np.bincount(labels, minlength=numClusters + 1)[1:]).tolist()
+        with _gcPaused():
+            clusterIdToNodes = dict((clusterId, set(nodeIds[start:end])) for clusterId, start, end in
+                                    itertools.izip(xrange(1, numClusters + 1), [0] + ends, ends))
+        return clusterIdToNodes, nodeIdToClusterId
+
+    def _find(self, index):
+        parent = self.parent
+        root = index
+        while parent[root] != root:
+            root = parent[root]
+        while parent[index] != root:
+            parent[index], index = root, parent[index]
+        return root
+
+    def _findMany(self, indices):
+        return _findRoots(self.parent, indices)
+
+    def _union(self, rootA, rootB):
+        if rootA == rootB:
+            return
+        if self.size[rootA] < self.size[rootB]:
+            rootA, rootB = rootB, rootA
+        self.parent[rootB] = rootA
+        self.size[rootA] += self.size[rootB]
+
+    def _grow(self, capacity):
+        np = _numpy()
+        capacity = max(capacity, 2 * len(self.parent))
+        dtype = self.parent.dtype if capacity <= np.iinfo(np.int32).max else np.int64
+        parent = np.arange(capacity, dtype=dtype)
+        parent[:len(self.parent)] = self.parent
+        size = np.ones(capacity, dtype=dtype)
+        size[:len(self.size)] = self.size
+        self.parent, self.size = parent, size
+
+
+########################
+# OUT-OF-CORE CLUSTERING
+########################
+
+def clusterEdgeFilesOutOfCore(paths, out, numBuckets=64, batchSize=2**22, tmpDir=temps.TEMPS_DIR):
+    '''
+    paths: edge files, each a text edge file (see readEdgeChunks()) or a binary edge file (see writeEdgeFile()).  The
+      node id dictionary of each binary edge file is read into memory while that file is read.
+    out: a path or file-like object to write the cluster of every node to, one tab-separated line of the node id and
+      cluster id per node.  The cluster id of a cluster is one more than the node index of one of its nodes.
+    numBuckets: the number of parts the node ids are hashed into.  The distinct node ids of one part are held in memory
+      at a time, so use more buckets for more nodes.
+    batchSize: the number of edges, edge ends or nodes processed at a time.
+    tmpDir: where the node id dictionary and memory-mapped arrays are kept while clustering.
+    Finds the connected components of graphs whose nodes do not fit in memory, like clusterEdgeFiles(), keeping only
+    batches of edges and the distinct node ids of one bucket in memory:
+    1. The node ids of the edges are hashed into bucket files, with the position of every edge end.
+    2. The node ids of each bucket are interned in turn and appended to an on-disk node id dictionary, and the node
+      index of every edge end is written to a memory-mapped array.
+    3. The edges are unioned in batches into a forest kept in memory-mapped parent and size arrays.
+    4. The node id dictionary is read alongside the roots of the forest to write the cluster of every node.
+    returns: a tuple of the number of nodes and the number of clusters.
+    '''
+    np = _numpy()
+    with temps.tmpdir(root=tmpDir) as workDir:
+        bucketPaths = [os.path.join(workDir, 'bucket%s' % i) for i in xrange(numBuckets)]
+        numEdges = _bucketEdgeEnds(paths, bucketPaths, batchSize)
+        ends = _memmap(os.path.join(workDir, 'ends'), np.int64, 2 * numEdges)
+        dictionaryPath = os.path.join(workDir, 'nodes')
+        numNodes = _internBuckets(bucketPaths, ends, dictionaryPath, batchSize)
+        parent = _memmap(os.path.join(workDir, 'parent'), np.int64, numNodes)
+        size = _memmap(os.path.join(workDir, 'size'), np.int64, numNodes)
+        slot = _memmap(os.path.join(workDir, 'slot'), np.int64, numNodes)
+        for start in xrange(0, numNodes, batchSize):
+            end = min(start + batchSize, numNodes)
+            parent[start:end] = np.arange(start, end)
+            size[start:end] = 1
+        for start in xrange(0, 2 * numEdges, 2 * batchSize):
+            batch = np.array(ends[start:start + 2 * batchSize])
+            _unionRounds(parent, size, slot, batch[0::2], batch[1::2])
+        with util.openOut(out) as fh:
+            numClusters = _writeAssignments(parent, dictionaryPath, fh, batchSize)
+        del ends, parent, size, slot
+    return numNodes, numClusters
+
+
+def readAssignments(path):
+    '''
+    path: a file of the clusters of nodes, as written by clusterEdgeFilesOutOfCore().
+    yields: a tuple of (nodeId, clusterId) for every node.
+    '''
+    with open(path) as fh:
+        for line in fh:
+            # node ids from binary edge files can contain whitespace, but not newlines.
+            nodeId, clusterId = line.rsplit('\t', 1)
+            yield nodeId, int(clusterId)
+
+
+def _edgeEnds(path, batchSize):
+    '''
+    yields: a list of the node ids of the ends of every batch of edges in an edge file, with the from and to node ids of
+    each edge next to each other.
+    '''
+    np = _numpy()
+    if isEdgeFile(path):
+        nodeIds, fromIndices, toIndices, distances = readEdgeFile(path)
+        for start in xrange(0, len(fromIndices), batchSize):
+            indices = np.empty(2 * len(fromIndices[start:start + batchSize]), dtype=np.int64)
+            indices[0::2] = fromIndices[start:start + batchSize]
+            indices[1::2] = toIndices[start:start + batchSize]
+            yield map(nodeIds.__getitem__, indices.tolist())
+    else:
+        for tokens in _edgeTokenBlocks(path):
+            del tokens[2::3]
+            yield tokens
+
+
+def _bucketEdgeEnds(paths, bucketPaths, batchSize):
+    '''
+    Writes the node id and position of every edge end to the bucket file of the hash of the node id, one
+    tab-separated line per edge end.  The position of the ends of edge i are 2 * i and 2 * i + 1.
+    returns: the number of edges.
+    '''
+    numBuckets = len(bucketPaths)
+    files = [open(path, 'w') for path in bucketPaths]
+    try:
+        position = 0
+        for path in paths:
+            for ends in _edgeEnds(path, batchSize):
+                lines = [[] for i in xrange(numBuckets)]
+                for i, nodeId in enumerate(ends, position):
+                    lines[hash(nodeId) % numBuckets].append('%s\t%s\n' % (nodeId, i))
+                for fh, bucketLines in itertools.izip(files, lines):
+                    fh.write(''.join(bucketLines))
+                position += len(ends)
+    finally:
+        for fh in files:
+            fh.close()
+    return position // 2
+
+
+def _internBuckets(bucketPaths, ends, dictionaryPath, batchSize):
+    '''
+    Interns the node ids of each bucket file in turn, appending them to the node id dictionary at dictionaryPath, one
+    node id per line in node index order, and writing the node index of every edge end into ends.  Each bucket file is
+    read batchSize lines at a time, so only the distinct node ids of the bucket and one batch of lines are held in
+    memory.  Bucket files are removed once they are interned.
+    returns: the number of nodes.
+    '''
+    np = _numpy()
+    numNodes = 0
+    with open(dictionaryPath, 'w') as dictionary:
+        for path in bucketPaths:
+            nodeIndex = {}
+            with open(path) as fh:
+                while True:
+                    lines = list(itertools.islice(fh, batchSize))
+                    if not lines:
+                        break
+                    # split off the position only, since node ids can contain whitespace.
+                    nodeIds, positions = zip(*[line.rsplit('\t', 1) for line in lines])
+                    newIds = sorted(set(nodeIds).difference(nodeIndex))
+                    nodeIndex.update(itertools.izip(newIds, itertools.count(numNodes + len(nodeIndex))))
+                    dictionary.write(''.join('%s\n' % nodeId for nodeId in newIds))
+                    positions = np.array(map(int, positions), dtype=np.int64)
+                    ends[positions] = np.fromiter(itertools.imap(nodeIndex.__getitem__, nodeIds), dtype=np.int64,
+                                                  count=len(nodeIds))
+            os.remove(path)
+            numNodes += len(nodeIndex)
+    return numNodes
+
+
+def _writeAssignments(parent, dictionaryPath, out, batchSize):
+    '''
+    Writes the node id and cluster id of every node to out, reading the node id dictionary alongside the roots of
+    batches of nodes.
+    returns: the number of clusters.
+    '''
+    np = _numpy()
+    numClusters = 0
+    with open(dictionaryPath) as dictionary:
+        for start in xrange(0, len(parent), batchSize):
+            end = min(start + batchSize, len(parent))
+            indices = np.arange(start, end)
+            roots = _findRoots(parent, indices)
+            parent[start:end] = roots
+            numClusters += int((roots == indices).sum())
+            nodeIds = [dictionary.readline().rstrip('\n') for i in xrange(len(indices))]
+            out.write(''.join('%s\t%s\n' % line for line in itertools.izip(nodeIds, (roots + 1).tolist())))
+    return numClusters
+
+
+def _memmap(path, dtype, length):
+    '''
+    returns: a writable memory-mapped array of length items of dtype, backed by a new file at path.
+    '''
+    np = _numpy()
+    if not length:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='w+', shape=(length,))
+
+
+def _findRoots(parent, indices):
+    '''
+    parent: an array of the parent of every node of a union-find forest.
+    returns: an array of the root of every node in indices.
+    '''
+    roots = parent[indices]
+    grandparents = parent[roots]
+    while (grandparents != roots).any():
+        roots = grandparents
+        grandparents = parent[roots]
+    return roots
+
+
+def _unionRounds(parent, size, slot, a, b):
+    '''
+    parent, size: arrays (or memory-maps) of the parent of every node and the size of the tree of every root of a
+      union-find forest, which are updated.
+    slot: an int64 array (or memory-map) with room for every node, used to choose one link per root.
+    a, b: arrays of the nodes of the edges to union.
+    Unions the edges in rounds.  Each round finds the roots of the nodes of every edge still joining two trees and
+    links one root of each such edge under the other, smaller trees under larger ones.  A root joined to several other
+    roots is linked under only one of them, and its other edges are retried in the next round.  The memory used is
+    proportional to the number of edges, not nodes.
+    '''
+    np = _numpy()
+    while True:
+        rootA = _findRoots(parent, a)
+        rootB = _findRoots(parent, b)
+        # compress the paths of the nodes of the edges straight to their roots.
+        parent[a] = rootA
+        parent[b] = rootB
+        pending = rootA != rootB
+        a, b, rootA, rootB = a[pending], b[pending], rootA[pending], rootB[pending]
+        if not len(a):
+            break
+        # order the roots of each edge by (size, index) and link the lesser one under the greater one, so the links can
+        # not form a cycle.
+        sizeA = size[rootA]
+        sizeB = size[rootB]
+        aFirst = (sizeA < sizeB) | ((sizeA == sizeB) & (rootA < rootB))
+        child = np.where(aFirst, rootA, rootB)
+        target = np.where(aFirst, rootB, rootA)
+        links = np.arange(len(child))
+        slot[child] = links
+        once = slot[child] == links
+        child, target = child[once], target[once]
+        parent[child] = target
+        # the linked roots may form chains, so add the size of every linked tree to the root at the end of its chain.
+        roots, inverse = np.unique(_findRoots(parent, child), return_inverse=True)
+        size[roots] += np.bincount(inverse, weights=size[child]).astype(size.dtype)
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
+@contextlib.contextmanager
+def _gcPaused():
+    '''
+    Pauses the cyclic garbage collector, which otherwise runs over and over while millions of sets are created.
+    '''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
 
 def fileEdgeGen(path):
     ''' iterate over a file of edges '''
@@ -205,6 +739,262 @@ def linesEdgeGen(lines):
         yield id1, id2, float(distance)
 
 
+#############
+# EDGE ARRAYS
+#############
+
+# A binary edge file holds the edges of a graph as fixed-size records that can be memory-mapped, followed by a node id
+# dictionary.  It has:
+#   a header of the magic string, the number of nodes, the number of edges and the size in bytes of node indices.
+#   a record per edge of the little-endian (from, to, distance) of the edge, where from and to are int32 or int64
+#   indices into the node id dictionary and distance is a float32.
+#   the node id dictionary: the node ids, in index order, each followed by a newline.
+EDGE_FILE_MAGIC = 'EDGEBIN1'
+_EDGE_HEADER = struct.Struct('<8sQQQ')
+# the number of bytes of an edge text file parsed at a time.
+EDGE_BLOCK_SIZE = 2**24
+# the bytes str.split() splits on.
+_EDGE_WHITESPACE = ' \t\n\r\x0b\x0c'
+
+
+def edgeDtype(indexDtype='int32'):
+    '''
+    returns: the numpy dtype of the edge records of a binary edge file with node indices of type indexDtype.
+    '''
+    np = _numpy()
+    indexDtype = np.dtype(indexDtype).newbyteorder('<')
+    return np.dtype([('from', indexDtype), ('to', indexDtype), ('distance', '<f4')])
+
+
+def readEdgeChunks(path, nodeIndex=None, blockSize=EDGE_BLOCK_SIZE):
+    '''
+    path: a text file of edges, one whitespace-separated line of (fromNodeId, toNodeId, distance) per edge, like
+      fileEdgeGen() reads.  Blank lines and lines starting with '#' are skipped.
+    nodeIndex: a dict from node id to node index, which is updated with the indices of new nodes.  New nodes get the
+      next indices in sorted order of their ids within each chunk.
+    blockSize: the number of bytes parsed at a time.
+    Parses the file in large blocks, splitting whole blocks into tokens with one str.split() and interning the node ids
+    of a block with set and dict operations instead of parsing and interning line by line.
+    yields: a tuple of (fromIndices, toIndices, distances), int64 arrays of node indices and a float32 array of
+    distances, for the edges of every block.
+    '''
+    np = _numpy()
+    if nodeIndex is None:
+        nodeIndex = {}
+    for tokens in _edgeTokenBlocks(path, blockSize):
+        ends = tokens[:]
+        del ends[2::3]
+        new = set(ends).difference(nodeIndex)
+        nodeIndex.update(itertools.izip(sorted(new), itertools.count(len(nodeIndex))))
+        indices = np.fromiter(itertools.imap(nodeIndex.__getitem__, ends), dtype=np.int64, count=len(ends))
+        yield indices[0::2], indices[1::2], np.array(tokens[2::3], dtype=np.float32)
+
+
+def _edgeTokenBlocks(path, blockSize=EDGE_BLOCK_SIZE):
+    '''
+    path: a text file of edges.  See readEdgeChunks().
+    yields: a list of the (fromNodeId, toNodeId, distance) tokens of the edges of every block of the file, where
+    distances are strings or floats.
+    '''
+    with open(path) as fh:
+        partial = '' # the start of a line continuing into the next block
+        while True:
+            data = fh.read(blockSize)
+            block = partial + data
+            end = block.rfind('\n') + 1 if data else len(block)
+            block, partial = block[:end], block[end:]
+            if block:
+                if '#' in block or not _threeTokenLines(block):
+                    # comments, blank lines or lines of the wrong length
+                    tokens = [token for edge in linesEdgeGen(block.splitlines()) for token in edge]
+                else:
+                    tokens = block.split()
+                yield tokens
+            if not data:
+                break
+
+
+def _threeTokenLines(block):
+    '''
+    block: lines of text.
+    returns: True if every line of block has exactly 3 whitespace-separated tokens.  The tokens of every line are
+    counted at once with numpy, by counting the bytes that start a token on each line.
+    '''
+    np = _numpy()
+    data = np.frombuffer(block, dtype=np.uint8)
+    isSpace = np.zeros(256, dtype=bool)
+    isSpace[[ord(c) for c in _EDGE_WHITESPACE]] = True
+    space = isSpace[data]
+    starts = ~space & np.concatenate(([True], space[:-1]))
+    lines = np.cumsum(data == ord('\n'))
+    numLines = block.count('\n') + (not block.endswith('\n'))
+    return bool((np.bincount(lines[starts], minlength=numLines)[:numLines] == 3).all())
+
+
+def loadEdges(path, blockSize=EDGE_BLOCK_SIZE):
+    '''
+    path: a text file of edges.  See readEdgeChunks().
+    returns: a tuple of (nodeIds, fromIndices, toIndices, distances) of a list of the node ids, int32 arrays (int64 for
+    more than 2**31 - 1 nodes) of the indices in nodeIds of the nodes of each edge, and a float32 array of the distance
+    of each edge.  They can be clustered with EdgeClusterer.clusterMany(fromIndices, toIndices, distances, nodeIds),
+    or with UnionFindClusterer(nodeIds).clusterMany(numpy.column_stack((fromIndices, toIndices))).
+    '''
+    np = _numpy()
+    nodeIndex = {}
+    chunks = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))]
+    chunks.extend(readEdgeChunks(path, nodeIndex, blockSize))
+    fromIndices, toIndices, distances = [np.concatenate(arrays) for arrays in zip(*chunks)]
+    dtype = np.int32 if len(nodeIndex) <= np.iinfo(np.int32).max else np.int64
+    return _nodeIds(nodeIndex), fromIndices.astype(dtype), toIndices.astype(dtype), distances
+
+
+def writeEdgeFile(path, nodeIds, fromIndices, toIndices, distances, indexDtype='int32'):
+    '''
+    path: where to write a binary edge file.
+    nodeIds: a sequence of node ids, e.g. from loadEdges().  Node ids can not contain newlines.
+    fromIndices, toIndices: integer arrays of the indices in nodeIds of the nodes of each edge.
+    distances: an array of the distance of each edge.
+    indexDtype: the type of node indices in the file, 'int32' or 'int64' for more than 2**31 - 1 nodes.
+    '''
+    np = _numpy()
+    records = np.empty(len(distances), dtype=edgeDtype(indexDtype))
+    records['from'] = fromIndices
+    records['to'] = toIndices
+    records['distance'] = distances
+    _writeEdgeFile(path, nodeIds, [records], indexDtype)
+
+
+def convertEdgeFile(textPath, path, indexDtype='int32', blockSize=EDGE_BLOCK_SIZE):
+    '''
+    textPath: a text file of edges.  See readEdgeChunks().
+    path: where to write a binary edge file of the same edges.  See writeEdgeFile().
+    The edges are converted a block at a time, so only the node id dictionary is held in memory.
+    returns: the number of edges.
+    '''
+    np = _numpy()
+    nodeIndex = {}
+    dtype = edgeDtype(indexDtype)
+
+    def records():
+        for fromIndices, toIndices, distances in readEdgeChunks(textPath, nodeIndex, blockSize):
+            if len(nodeIndex) - 1 > np.iinfo(indexDtype).max:
+                raise Exception('Edge file error: too many nodes for the node index type.', len(nodeIndex), indexDtype)
+            chunk = np.empty(len(distances), dtype=dtype)
+            chunk['from'] = fromIndices
+            chunk['to'] = toIndices
+            chunk['distance'] = distances
+            yield chunk
+    return _writeEdgeFile(path, nodeIndex, records(), indexDtype)
+
+
+def readEdgeFile(path):
+    '''
+    path: a binary edge file.  See writeEdgeFile().
+    returns: a tuple of (nodeIds, fromIndices, toIndices, distances), like loadEdges(), except that the arrays are
+    read-only views of a memory-map of the edge records, so they are read from disk as they are used.
+    '''
+    np = _numpy()
+    with open(path, 'rb') as fh:
+        magic, numNodes, numEdges, indexSize = _EDGE_HEADER.unpack(fh.read(_EDGE_HEADER.size))
+        if magic != EDGE_FILE_MAGIC:
+            raise Exception('Edge file error: not a binary edge file.', path)
+        dtype = edgeDtype(np.int32 if indexSize == 4 else np.int64)
+        fh.seek(_EDGE_HEADER.size + numEdges * dtype.itemsize)
+        nodeIds = fh.read().split('\n')[:numNodes]
+    if numEdges:
+        records = np.memmap(path, dtype=dtype, mode='r', offset=_EDGE_HEADER.size, shape=(numEdges,))
+    else:
+        records = np.zeros(0, dtype=dtype)
+    return nodeIds, records['from'], records['to'], records['distance']
+
+
+def _writeEdgeFile(path, nodeIds, chunks, indexDtype):
+    '''
+    nodeIds: a sequence of node ids, or a dict from node id to index, which is read after chunks is exhausted.
+    chunks: an iterable of arrays of edge records.
+    returns: the number of edges.
+    '''
+    np = _numpy()
+    numEdges = 0
+    with open(path, 'wb') as fh:
+        fh.write(_EDGE_HEADER.pack(EDGE_FILE_MAGIC, 0, 0, 0))
+        for chunk in chunks:
+            fh.write(chunk.tostring())
+            numEdges += len(chunk)
+        if isinstance(nodeIds, dict):
+            nodeIds = _nodeIds(nodeIds)
+        for nodeId in nodeIds:
+            fh.write('%s\n' % nodeId)
+        fh.seek(0)
+        fh.write(_EDGE_HEADER.pack(EDGE_FILE_MAGIC, len(nodeIds), numEdges, np.dtype(indexDtype).itemsize))
+    return numEdges
+
+
+def _nodeIds(nodeIndex):
+    '''
+    returns: a list of the node ids of the nodeIndex dict, in index order.
+    '''
+    nodeIds = [None] * len(nodeIndex)
+    for nodeId, index in nodeIndex.iteritems():
+        nodeIds[index] = nodeId
+    return nodeIds
+
+
+#####################
+# PARALLEL CLUSTERING
+#####################
+
+def clusterEdgeFiles(paths, numProcs=None):
+    '''
+    paths: edge files, e.g. one per genome pair, each a text edge file (see readEdgeChunks()) or a binary edge file
+      (see writeEdgeFile()).  Edges are undirected, and nodes can occur in any number of files.
+    numProcs: the number of worker processes.  Defaults to the number of cpus.
+    The connected components of every file are computed by a UnionFindClusterer in a pool of processes.  Each file is
+    reduced to a forest, the root in that file of every node of that file, and the forests are merged as they arrive by
+    clustering every node with its root.
+    returns: a tuple of (clusterIdToNodes, nodeIdToClusterId) dicts of the components of all the edges, like the
+    attributes of an EdgeClusterer that clustered all the edges.  Cluster ids are numbered as in
+    UnionFindClusterer.labels().
+    '''
+    return _mergeForests(util.poolMap(_edgeFileForest, paths, numProcs, ordered=False)).components()
+
+
+def isEdgeFile(path):
+    '''
+    returns: True if path is a binary edge file, False if it is a text edge file.
+    '''
+    with open(path, 'rb') as fh:
+        return fh.read(len(EDGE_FILE_MAGIC)) == EDGE_FILE_MAGIC
+
+
+def _edgeFileForest(path):
+    '''
+    returns: a tuple of (nodeIds, roots) of the node ids of an edge file and an array of the index in nodeIds of the
+    root of the component of every node.
+    '''
+    np = _numpy()
+    if isEdgeFile(path):
+        nodeIds, fromIndices, toIndices, distances = readEdgeFile(path)
+    else:
+        nodeIds, fromIndices, toIndices, distances = loadEdges(path)
+    clusterer = UnionFindClusterer(nodeIds, capacity=len(nodeIds))
+    clusterer.clusterMany(np.column_stack((fromIndices, toIndices)))
+    return nodeIds, clusterer.roots()
+
+
+def _mergeForests(forests):
+    '''
+    forests: an iterable of (nodeIds, roots) tuples, as returned by _edgeFileForest().
+    returns: a UnionFindClusterer of the components of all the forests.
+    '''
+    np = _numpy()
+    clusterer = UnionFindClusterer()
+    for nodeIds, roots in forests:
+        indices = clusterer.internMany(nodeIds)
+        clusterer.clusterMany(np.column_stack((indices, indices[roots])))
+    return clusterer
+
+
 def test():
 
     input = '''
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+'''
+Find identical sequences in one or more fasta databases, without holding the
+sequences in memory.
+
+Each sequence is hashed once to a 16 byte md5 digest.  The digests, tagged
+with the position of their sequence, are sorted in memory in batches using
+numpy and spilled to disk as sorted runs when they exceed a memory budget.
+Merging the runs brings identical sequences together, and the first
+occurrence of each sequence becomes the representative of its duplicates.
+A final pass over the databases writes the representatives and a mapping
+from each duplicate to its representative.
+
+Usage:
+
+    dedupe(['release1.fa', 'release2.fa'], 'nr.fa', 'nr.dups')
+'''
+
+import hashlib
+import heapq
+import os
+import struct
+import uuid
+
+import numpy as np
+
+import fasta
+import temps
+import util
+
+
+# the number of bytes of sorted entries kept in memory before a run is spilled to disk.
+MEMORY_LIMIT = 256 * 1024 * 1024
+
+# the maximum number of sorted runs merged at once, which bounds the number of open run files.
+FAN_IN = 64
+
+# a sequence is identified by the index of its database and its ordinal in that database.  Packed big-endian, keys
+# sort in the order the sequences are read.
+_KEY = struct.Struct('>HQ')
+_DIGEST_SIZE = 16
+_COUNT = struct.Struct('>Q')
+
+
+def seqDigest(seq):
+    '''
+    returns: the 16 byte digest used to compare sequences.
+    '''
+    return hashlib.md5(seq).digest()
+
+
+def duplicateGroups(fastaPaths, memoryLimit=MEMORY_LIMIT, tmpDir=temps.TEMPS_DIR, strict=True):
+    '''
+    fastaPaths: a list of paths to fasta files, which may be compressed.
+    memoryLimit: the number of bytes of digests to sort in memory at a time.
+    tmpDir: where sorted runs are written.
+    yields: for every sequence that occurs more than once, a sorted list of the (dbIndex, ordinal) tuples of its
+    occurrences, where dbIndex is the index of a fasta file in fastaPaths and ordinal is the index of the sequence in
+    that file.  The groups are in no particular order.
+    '''
+    with temps.tmpdir(root=tmpDir) as workDir:
+        for group in _keyGroups(fastaPaths, memoryLimit, workDir, strict):
+            yield [_KEY.unpack(key) for key in group]
+
+
+def dedupe(fastaPaths, out, mappingFile, idRule=fasta.idFromName, memoryLimit=MEMORY_LIMIT, tmpDir=temps.TEMPS_DIR,
+           width=60, strict=True):
+    '''
+    fastaPaths: a list of paths to fasta files, which may be compressed.
+    out: a path or file-like object to write the representative sequences to, i.e. the first occurrence of every
+      distinct sequence, in the order they are read.
+    mappingFile: a path or file-like object to write the duplicates to, one tab-separated line of the duplicate id and
+      the id of its representative per duplicate sequence.
+    idRule: how ids are parsed from namelines.  See fasta.getIdRule().
+    memoryLimit: the number of bytes of digests to sort in memory at a time.  Roughly this much memory is used on top
+      of the ids of representatives whose duplicates have not been read yet.
+    tmpDir: where sorted runs are written.
+    width: the width of sequence lines in out.
+    returns: a tuple of the number of sequences read and the number of representative sequences written.
+    '''
+    idRule = fasta.getIdRule(idRule)
+    with temps.tmpdir(root=tmpDir) as workDir:
+        # sort the (duplicate, representative) key pairs by duplicate and the representatives by key, so both can be
+        # joined with the sequences in a second pass.
+        dups = _RunSorter(2 * _KEY.size, memoryLimit // 2, workDir)
+        reps = _RunSorter(_KEY.size + _COUNT.size, memoryLimit // 2, workDir)
+        for group in _keyGroups(fastaPaths, memoryLimit, workDir, strict):
+            for key in group[1:]:
+                dups.add(key + group[0])
+            reps.add(group[0] + _COUNT.pack(len(group) - 1))
+        dups = iter(dups)
+        reps = iter(reps)
+        nextDup = next(dups, None)
+        nextRep = next(reps, None)
+        repIds = {} # the id and number of unread duplicates of representatives with unread duplicates
+        numSeqs = numReps = 0
+        with fasta.FastaWriter(out, width=width) as writer:
+            with util.openOut(mappingFile) as mapping:
+                for key, nameline, seq in _readKeyedSeqs(fastaPaths, strict):
+                    numSeqs += 1
+                    if nextRep is not None and nextRep[:_KEY.size] == key:
+                        repIds[key] = [idRule(nameline), _COUNT.unpack(nextRep[_KEY.size:])[0]]
+                        nextRep = next(reps, None)
+                    if nextDup is not None and nextDup[:_KEY.size] == key:
+                        rep = repIds[nextDup[_KEY.size:]]
+                        mapping.write('%s\t%s\n' % (idRule(nameline), rep[0]))
+                        rep[1] -= 1
+                        if not rep[1]:
+                            del repIds[nextDup[_KEY.size:]]
+                        nextDup = next(dups, None)
+                    else:
+                        numReps += 1
+                        writer.write(nameline, seq)
+    return numSeqs, numReps
+
+
+def _keyGroups(fastaPaths, memoryLimit, workDir, strict):
+    '''
+    yields: a sorted list of the packed keys of the occurrences of each sequence that occurs more than once.
+    '''
+    digests = _RunSorter(_DIGEST_SIZE + _KEY.size, memoryLimit, workDir)
+    for key, nameline, seq in _readKeyedSeqs(fastaPaths, strict):
+        digests.add(seqDigest(seq) + key)
+    group = []
+    digest = None
+    for entry in digests:
+        if entry[:_DIGEST_SIZE] != digest:
+            if len(group) > 1:
+                yield group
+            group = []
+            digest = entry[:_DIGEST_SIZE]
+        group.append(entry[_DIGEST_SIZE:])
+    if len(group) > 1:
+        yield group
+
+
+def _readKeyedSeqs(fastaPaths, strict):
+    '''
+    yields: a tuple of (key, nameline, seq) for every sequence in the fasta files, where key is the packed
+    (dbIndex, ordinal) of the sequence.
+    '''
+    for dbIndex, path in enumerate(fastaPaths):
+        for ordinal, (nameline, seq) in enumerate(fasta.readFasta(path, strict)):
+            yield _KEY.pack(dbIndex, ordinal), nameline, seq
+
+
+class _RunSorter(object):
+    '''
+    Sorts fixed-size byte strings that may not fit in memory.  Added entries are collected in a buffer, which is
+    sorted with numpy and written to a run file in workDir whenever it exceeds memoryLimit bytes.  Iterating over the
+    sorter merges the runs with a heap, first merging runs fanIn at a time into bigger runs until no more than fanIn
+    are left.  Run files are left for the caller to remove with workDir.
+    '''
+    def __init__(self, size, memoryLimit, workDir, fanIn=FAN_IN):
+        if fanIn < 2:
+            raise Exception('dedupe error: fanIn must be at least 2.', fanIn)
+        self.size = size
+        self.memoryLimit = max(memoryLimit, size)
+        self.workDir = workDir
+        self.fanIn = fanIn
+        self.buffer = bytearray()
+        self.runs = []
+
+    def add(self, entry):
+        self.buffer += entry
+        if len(self.buffer) >= self.memoryLimit:
+            self._spill()
+
+    def __iter__(self):
+        '''
+        yields: the entries in sorted order.
+        '''
+        if not self.runs:
+            for entry in self._sortedEntries(self._sortBuffer()):
+                yield entry
+            return
+        if self.buffer:
+            self._spill()
+        while len(self.runs) > self.fanIn:
+            # merge the oldest runs first, so every entry is merged about log(numRuns, fanIn) times.
+            merging = self.runs[:self.fanIn]
+            del self.runs[:self.fanIn]
+            path = self._newRunPath()
+            with open(path, 'wb') as fh:
+                for entries in util.groupsOfN(self._mergedRuns(merging), fasta.BLOCK_SIZE // self.size):
+                    fh.write(''.join(entries))
+            self.runs.append(path)
+            for run in merging:
+                os.remove(run)
+        for entry in self._mergedRuns(self.runs):
+            yield entry
+
+    def _mergedRuns(self, runs):
+        '''
+        yields: the entries of the run files at the paths in runs, in sorted order.
+        '''
+        files = [open(path, 'rb') for path in runs]
+        try:
+            for entry in heapq.merge(*[self._readRun(fh) for fh in files]):
+                yield entry
+        finally:
+            for fh in files:
+                fh.close()
+
+    def _sortBuffer(self):
+        data = np.sort(np.frombuffer(self.buffer, dtype='S%s' % self.size)).tostring()
+        self.buffer = bytearray()
+        return data
+
+    def _sortedEntries(self, data):
+        for i in xrange(0, len(data), self.size):
+            yield data[i:i + self.size]
+
+    def _spill(self):
+        path = self._newRunPath()
+        with open(path, 'wb') as fh:
+            fh.write(self._sortBuffer())
+        self.runs.append(path)
+
+    def _newRunPath(self):
+        return os.path.join(self.workDir, uuid.uuid4().hex)
+
+    def _readRun(self, fh):
+        blockSize = self.size * (fasta.BLOCK_SIZE // self.size)
+        while True:
+            data = fh.read(blockSize)
+            if not data:
+                break
+            for entry in self._sortedEntries(data):
+                yield entry
+
+
@@ -5,9 +5,40 @@ What is a FASTA format file/string?
 This module follows the NCBI conventions: http://blast.ncbi.nlm.nih.gov/blastcgihelp.shtml
 '''
 
+import Queue
+import bz2
+import contextlib
+import copy
+import cPickle
 import cStringIO
+import gzip
+import hashlib
+import heapq
+import mmap
+import multiprocessing
+import multiprocessing.pool
+import os
 import re
-import math
+import sys
+import threading
+
+import bgzf
+import nested
+import temps
+import util
+
+
+# number of bytes read at a time by the fasta parsing engine, _readRecords().
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# the number of bytes of sequences and namelines sort() holds in memory before writing a sorted run to disk.
+SORT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# the maximum number of sorted runs sort() merges at once.
+SORT_FAN_IN = 64
+
+# the characters str.strip() removes.
+_WHITESPACE = ' \t\n\r\x0b\x0c'
 
 
 TEST_FASTA = {'GOOD_TEST': '''>ns|id|a long description
@@ -88,7 +119,7 @@ def idFromName(line):
     ns|id| => id
     ns|id|desc => id
     ns|id blah|desc => id
-    Example namelines not covered:
+    Example namelines not covered (see the 'jgi' rule in ID_RULES):
     JGI-PSF GENOMES ftp://ftp.jgi-psf.org/pub/JGI_data/Nematostella_vectensis/v1.0/annotation/proteins.Nemve1FilteredModels1.fasta.gz
     >jgi|Nemve1|18|gw.48.1.1
     >jgi|Nemve1|248885|estExt_fgenesh1_pg.C_76820001
@@ -99,18 +130,52 @@ def idFromName(line):
     if line.startswith('>'):
         line = line[1:]
 
-    # keep only everything after the first pipe.  will keep everything if there is no first pipe.
-    pipe = line.find('|')
-    if pipe > -1:
-        line = line[line.find('|')+1:]
-
-    # keep everything before the second pipe.  will keep everything if there is no second pipe.
-    pipe = line.find('|')
-    if pipe > -1:
-        line = line[:pipe]
+    # keep only everything after the first pipe and before the second pipe.  will keep everything if there is no
+    # first pipe, and everything after the first pipe if there is no second pipe.
+    fields = line.split('|', 2)
+    if len(fields) > 1:
+        line = fields[1]
 
     # return the first token as the id.
-    return line.split()[0]
+    return line.split(None, 1)[0]
+
+
+def regexIdRule(pattern):
+    '''
+    pattern: a regular expression matched against the start of a nameline, including the '>'.  The id is the group
+    named 'id' if there is one, otherwise the first group.
+    returns: a function that parses an id from a nameline, like idFromName(), using the compiled pattern.  The function
+    raises an exception if a nameline does not match.
+    '''
+    regex = re.compile(pattern)
+    group = 'id' if 'id' in regex.groupindex else 1
+    def idRule(nameline):
+        match = regex.match(nameline)
+        if match is None:
+            raise Exception('FASTA error: nameline does not match id rule.', nameline, pattern)
+        return match.group(group)
+    return idRule
+
+
+# Id rules are functions that parse an id from a nameline.  They can be passed to readIds(), readIdOffsets(), etc.
+# ncbi: the default rule, idFromName().
+# first: the first whitespace separated token, e.g. '>sp|P12345|NAME desc' => 'sp|P12345|NAME'.
+# jgi: the protein id of JGI namelines, e.g. '>jgi|Nemve1|248885|estExt_fgenesh1_pg.C_76820001' => '248885'.
+ID_RULES = {
+    'ncbi': idFromName,
+    'first': regexIdRule(r'>?\s*(?P<id>\S+)'),
+    'jgi': regexIdRule(r'>?jgi\|[^|]*\|(?P<id>[^|\s]+)'),
+}
+
+
+def getIdRule(idRule):
+    '''
+    idRule: the name of a rule in ID_RULES or a function that parses an id from a nameline.
+    returns: the id rule function.
+    '''
+    if isinstance(idRule, basestring):
+        return ID_RULES[idRule]
+    return idRule
 
 
 def prettySeq(seq, n=60):
@@ -122,49 +187,167 @@ def prettySeq(seq, n=60):
     if len(seq) == 0:
         raise Exception('zero-length sequence', seq)
     seq = ''.join(seq.strip().split())
-    chunks = int(math.ceil(len(seq)/float(n)))
-    pretty = ''
-    for i in range(chunks):
-        pretty += seq[i*n:(i+1)*n] + '\n'
-    return pretty
+    return ''.join([seq[i:i+n] + '\n' for i in xrange(0, len(seq), n)])
 
 
 def numSeqsInFastaDb(path):
+    '''
+    path: path to fasta formatted db, which may be compressed (see openFasta()).
+    returns: the number of namelines in the db.  The file is scanned a block at a time, so no string is created per
+    line.
+    '''
     num = 0
-    with open(path) as fh:
-        for line in fh:
-            if line.startswith('>'):
-                num += 1
+    lineStart = True # the next block starts at the start of a line
+    with openFasta(path) as fh:
+        for block in _readBlocks(fh):
+            num += block.count('\n>') + (lineStart and block[0] == '>')
+            lineStart = block[-1] == '\n'
     return num
 
 
-def readIds(fastaFile, strict=True):
+def dbSizeInPath(path):
+    '''
+    path: path to fasta formatted db, which may be compressed (see openFasta()).
+    returns: the number of sequence characters in the db, counted the same way as dbSize().  The sequence lines of
+    each record are counted in bulk.
+    '''
+    size = 0
+    with openFasta(path) as fh:
+        for record in _readRecords(fh):
+            if record[0] == '>':
+                record = record[record.find('\n') + 1 or len(record):]
+            size += _seqSize(record)
+    return size
+
+
+def openFasta(path, numThreads=None):
+    '''
+    path: path to a fasta file, which may be compressed with gzip, bgzip, bzip2 or xz.  The compression is detected
+    from the magic bytes at the start of the file, not from the file name.  Reading xz files requires the lzma module
+    (or backports.lzma).
+    numThreads: the number of decompression threads of a BGZF file.  See bgzf.BgzfReader.
+    returns: a file object for reading the uncompressed contents of the file.  BGZF files are read using a
+    bgzf.BgzfReader, which decompresses blocks in parallel threads and supports seeking.
+    '''
+    compression = _compression(path)
+    if compression == 'bgzf':
+        return bgzf.BgzfReader(path, numThreads)
+    elif compression == 'gzip':
+        return gzip.GzipFile(path, 'rb')
+    elif compression == 'bz2':
+        return bz2.BZ2File(path, 'rb')
+    elif compression == 'xz':
+        return _lzma().LZMAFile(path, 'rb')
+    else:
+        return open(path, 'rb')
+
+
+def _lzma():
+    '''
+    returns: the lzma module, which is only in the standard library from python 3.3, or its backport.
+    '''
+    try:
+        import lzma
+    except ImportError:
+        from backports import lzma
+    return lzma
+
+
+def _compression(path):
+    '''
+    returns: the compression format of the file at path, detected from its magic bytes: 'bgzf', 'gzip', 'bz2', 'xz', or
+    None for an uncompressed file.
+    '''
+    with open(path, 'rb') as fh:
+        header = fh.read(512)
+    if bgzf.isBgzf(header):
+        return 'bgzf'
+    elif header.startswith('\x1f\x8b'):
+        return 'gzip'
+    elif header.startswith('BZh'):
+        return 'bz2'
+    elif header.startswith('\xfd7zXZ\x00'):
+        return 'xz'
+    return None
+
+
+def readIds(fastaFile, strict=True, useMmap=False, idRule=idFromName):
     '''
     fastaFile: a file-like object or a path to a fasta file
+    useMmap: see readFasta()
+    idRule: a function that parses an id from a nameline or the name of one in ID_RULES.
     yields: id in each nameline.
     '''
-    for nameline in readNamelines(fastaFile, strict):
-        yield idFromName(nameline)
+    idRule = getIdRule(idRule)
+    for nameline in readNamelines(fastaFile, strict, useMmap):
+        yield idRule(nameline)
+
+
+def readIdOffsets(fastaFile, idRule=idFromName):
+    '''
+    fastaFile: a file-like object or a path to a fasta file, which may be compressed.
+    idRule: a function that parses an id from a nameline or the name of one in ID_RULES.
+    Scans only the namelines, skipping over sequence data without splitting it into lines or joining it.  Unlike
+    readIds(), sequences are not checked for being well-formed: every line starting with '>' is a nameline.
+    yields: a tuple of (id, offset) for every nameline, where offset is the byte offset of the start of the nameline in
+    the (uncompressed) file.
+    '''
+    idRule = getIdRule(idRule)
+    if isinstance(fastaFile, basestring):
+        with openFasta(fastaFile) as fh:
+            for offset, nameline in _scanNamelines(fh):
+                yield idRule(nameline), offset
+    else:
+        for offset, nameline in _scanNamelines(fastaFile):
+            yield idRule(nameline), offset
+
+
+def idOffsetTable(fastaFile, idRule=idFromName):
+    '''
+    returns: a dict from the id of every nameline in fastaFile to the byte offset of the nameline.  Raises an exception
+    if an id occurs more than once.  See readIdOffsets().
+    '''
+    table = {}
+    for id, offset in readIdOffsets(fastaFile, idRule):
+        if table.setdefault(id, offset) != offset:
+            raise Exception('FASTA error: duplicate id.', id)
+    return table
 
 
-def readNamelines(fastaFile, strict=True):
+def readNamelines(fastaFile, strict=True, useMmap=False):
     '''
     fastaFile: a file-like object or a path to a fasta file
+    useMmap: see readFasta()
     yields: each nameline
     '''
-    for nameline, seq in readFasta(fastaFile, strict):
+    for nameline, seq in readFasta(fastaFile, strict, useMmap):
         yield nameline
         
 
-def readFasta(fastaFile, strict=True):
+def readFasta(fastaFile, strict=True, useMmap=False):
     '''
     fastaFile: a file-like object or a path to a fasta file
+    useMmap: if True, fastaFile must be a path or a real file object, which is mmapped instead of read.  A sequence
+      that is on a single line is yielded as a read-only buffer object pointing into the mmap, so it is never copied.
+      Use str(seq) to get a string.  Sequences spanning several lines are yielded as strings.  The mmap is closed when
+      the iteration finishes or the generator is closed, after which the yielded buffers can not be read, so copy any
+      sequences that are kept with str(seq).  Compressed files can not be mmapped, so they are read as usual.
+    Paths to compressed fasta files are decompressed transparently (see openFasta()).
     yields: a tuple of (nameline, sequence) for each sequence in the fasta file.
     '''
-    for lines in readFastaLines(fastaFile, strict):
-        nameline = lines[0].strip()
-        seq = ''.join((l.strip() for l in lines[1:]))
-        yield nameline, seq
+    if useMmap and not (isinstance(fastaFile, basestring) and _compression(fastaFile)):
+        mm = _mmapFasta(fastaFile)
+        if mm is not None:
+            with contextlib.closing(mm):
+                for nameline, seq in _mmapRecordIter(mm, strict):
+                    yield nameline, seq
+    elif isinstance(fastaFile, basestring):
+        with openFasta(fastaFile) as fh:
+            for nameline, seq in _fastaRecordIter(fh, strict):
+                yield nameline, seq
+    else:
+        for nameline, seq in _fastaRecordIter(fastaFile, strict):
+            yield nameline, seq
 
 
 def readFastaLines(fastaFile, strict=True, goodOnly=True, filterBlankLines=False):
@@ -172,16 +355,120 @@ def readFastaLines(fastaFile, strict=True, goodOnly=True, filterBlankLines=False
     fastaFile: a file-like object or a path to a fasta file
     yields: a seq of fasta sequence lines for each sequence in the fasta file.
     the first line is the nameline.  the other lines are the sequence data lines.  lines include newlines.
+    Paths to compressed fasta files are decompressed transparently (see openFasta()).
     '''
     if isinstance(fastaFile, basestring):
-        with open(fastaFile) as fh:
+        with openFasta(fastaFile) as fh:
             for lines in _fastaSeqIter(fh, strict, goodOnly, filterBlankLines):
                 yield lines
     else:
         for lines in _fastaSeqIter(fastaFile, strict, goodOnly, filterBlankLines):
             yield lines
 
-    
+
+def readFastaRecords(fastaFile, strict=True, idRule=idFromName):
+    '''
+    fastaFile: a file-like object or a path to a fasta file, which may be compressed.
+    strict: if True, raise an exception for text before the first nameline and for namelines without sequence lines.
+      Other problems, like blank lines within a sequence, are only found when the seq of a record is used, which raises
+      the same exception readFasta() would.  If False, all malformed records are skipped, like readFasta() does.
+    idRule: a function that parses an id from a nameline or the name of one in ID_RULES.
+    yields: a FastaRecord for each sequence in the fasta file.  The sequence lines of a record are not joined until
+    its seq is used, so skipping records after looking at their namelines or lengths is cheap.
+    '''
+    idRule = getIdRule(idRule)
+    if isinstance(fastaFile, basestring):
+        with openFasta(fastaFile) as fh:
+            for record in readFastaRecords(fh, strict, idRule):
+                yield record
+        return
+    for offset, record in _readOffsetRecords(fastaFile):
+        start = record.find('\n') + 1
+        if record[0] != '>' or start == 0 or start == len(record):
+            # the text before the first nameline or a nameline without sequence lines.
+            _parseRecord(record, strict)
+            continue
+        if not strict and ('\n\n' in record or _hasOtherWhitespace(record, start)) and _splitRecord(record) is None:
+            # a blank line within the sequence
+            continue
+        yield FastaRecord(record, start, offset, idRule, strict)
+
+
+class FastaRecord(object):
+    '''
+    A fasta record read by readFastaRecords().  The nameline and offset are set when the record is read.  The id,
+    length and seq are computed from the text of the record when first used and cached.  Iterating over a record
+    yields its nameline and seq, so it can be unpacked like the tuples readFasta() yields.
+    '''
+    __slots__ = ('nameline', 'offset', '_text', '_seqStart', '_idRule', '_strict', '_id', '_length', '_seq')
+
+    def __init__(self, text, seqStart, offset, idRule=idFromName, strict=True):
+        '''
+        text: the text of the record, as yielded by _readRecords().
+        seqStart: the position in text of the first sequence line.
+        offset: the byte offset of the record in the (uncompressed) fasta file.
+        strict: the strict flag of the reader, used when parsing the seq.
+        '''
+        self.nameline = text[:seqStart].strip()
+        self.offset = offset
+        self._text = text
+        self._seqStart = seqStart
+        self._idRule = idRule
+        self._strict = strict
+        self._id = None
+        self._length = None
+        self._seq = None
+
+    def __iter__(self):
+        yield self.nameline
+        yield self.seq
+
+    def __repr__(self):
+        return 'FastaRecord(%r, offset=%r)' % (self.nameline, self.offset)
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._id = self._idRule(self.nameline)
+        return self._id
+
+    @property
+    def length(self):
+        '''
+        The number of sequence characters, counted without joining the sequence lines.
+        '''
+        if self._length is None:
+            if self._seq is not None:
+                self._length = len(self._seq)
+            else:
+                text, start = self._text, self._seqStart
+                self._length = len(text) - start - text.count('\n', start)
+                if _hasOtherWhitespace(text, start):
+                    self._length = _seqSize(text[start:])
+        return self._length
+
+    @property
+    def seq(self):
+        '''
+        The sequence, joined from the sequence lines on first use.  Raises an exception if the record is malformed.
+        '''
+        if self._seq is None:
+            nameline_seq = _splitRecord(self._text)
+            if nameline_seq is None:
+                _parseRecord(self._text, self._strict)
+                raise Exception('FASTA error: malformed record.', self.nameline)
+            self._seq = nameline_seq[1]
+            self._text = None # the sequence replaces the text of the record
+        return self._seq
+
+
+def _hasOtherWhitespace(text, start):
+    '''
+    returns: True if text contains whitespace other than newlines after position start.
+    '''
+    return any(text.find(c, start) != -1 for c in _WHITESPACE if c != '\n')
+
+
 def splitSeq(seq):
     '''
     seq: a well-formed fasta sequence string containing a single nameline, including '>' and sequence data lines.
@@ -194,6 +481,141 @@ def splitSeq(seq):
     return [name, chars]
     
 
+class FastaWriter(object):
+    '''
+    Writes sequences, e.g. the (nameline, seq) tuples yielded by readFasta(), to a fasta file.  Sequence lines are
+    wrapped in one pass per sequence and output is collected in a large buffer that is written in big chunks.
+
+    Usage:
+
+        with FastaWriter('filtered.fa.gz', compression='bgzf') as writer:
+            for nameline, seq in readFasta('db.fa'):
+                if len(seq) > 100:
+                    writer.write(nameline, seq)
+    '''
+    def __init__(self, fastaFile, width=60, bufferSize=BLOCK_SIZE, compression=None):
+        '''
+        fastaFile: a file-like object or a path to a fasta file.  A path is opened for writing and closed by close().
+        width: the maximum length of sequence lines.  If None, each sequence is written on a single line.
+        bufferSize: the number of bytes collected before they are written to the file.
+        compression: how to compress a path on the fly: None, 'gzip', 'bgzf', 'bz2' or 'xz'.  A bgzf file gets a .gzi
+          index too, so it can be indexed with buildIndex() without rescanning its blocks.
+        '''
+        self.width = width
+        self.bufferSize = bufferSize
+        self.buffer = []
+        self.bufferedSize = 0
+        self.closeFile = isinstance(fastaFile, basestring)
+        if not self.closeFile:
+            self.fh = fastaFile
+        elif compression is None:
+            self.fh = open(fastaFile, 'wb')
+        elif compression == 'gzip':
+            self.fh = gzip.GzipFile(fastaFile, 'wb')
+        elif compression == 'bgzf':
+            self.fh = bgzf.BgzfWriter(fastaFile, gziPath=fastaFile + '.gzi')
+        elif compression == 'bz2':
+            self.fh = bz2.BZ2File(fastaFile, 'wb')
+        elif compression == 'xz':
+            self.fh = _lzma().LZMAFile(fastaFile, 'wb')
+        else:
+            raise Exception('FASTA error: unknown compression.', compression)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, nameline, seq):
+        '''
+        nameline: a fasta nameline, with or without the '>' and newline.
+        seq: a non-empty sequence, without newlines.
+        '''
+        if len(seq) == 0:
+            raise Exception('zero-length sequence', nameline)
+        if not nameline.startswith('>'):
+            self.buffer.append('>')
+        self.buffer.append(nameline.rstrip('\n'))
+        self.buffer.append('\n')
+        if self.width is None or len(seq) <= self.width:
+            self.buffer.append(seq)
+        else:
+            self.buffer.append('\n'.join([seq[i:i+self.width] for i in xrange(0, len(seq), self.width)]))
+        self.buffer.append('\n')
+        self.bufferedSize += len(nameline) + len(seq)
+        if self.bufferedSize >= self.bufferSize:
+            self.flush()
+
+    def writeAll(self, seqs):
+        '''
+        seqs: an iterable of (nameline, seq) tuples.
+        '''
+        for nameline, seq in seqs:
+            self.write(nameline, seq)
+
+    def flush(self):
+        '''
+        Write the buffered output to the file.
+        '''
+        if self.buffer:
+            self.fh.write(''.join(self.buffer))
+        self.buffer = []
+        self.bufferedSize = 0
+
+    def close(self):
+        '''
+        Flush the buffer, and close the file if the writer opened it.
+        '''
+        self.flush()
+        if self.closeFile:
+            self.fh.close()
+
+
+def writeFasta(seqs, fastaFile, width=60, compression=None):
+    '''
+    seqs: an iterable of (nameline, seq) tuples, like readFasta() yields.
+    fastaFile: a file-like object or a path to a fasta file.
+    See FastaWriter for the other parameters.
+    '''
+    with FastaWriter(fastaFile, width=width, compression=compression) as writer:
+        writer.writeAll(seqs)
+
+
+def extract(fastaFile, ids, out, idRule=idFromName, useIndex=None):
+    '''
+    Copy the records whose ids are in ids from fastaFile to out, in the order they occur in fastaFile.  Records are
+    copied as raw text, without parsing or rewrapping their sequences.
+    fastaFile: a file-like object or a path to a fasta file, which may be compressed.
+    ids: an iterable of ids.
+    out: a file-like object or a path to write the records to.
+    idRule: a function that parses an id from a nameline or the name of one in ID_RULES.
+    useIndex: if True, seek to each record using the fasta index of fastaFile, which is built if it does not exist.
+      If False, scan the whole file once, parsing only the namelines.  If None, the index is used if fastaFile is a
+      path with an existing index and idRule is idFromName(), the rule the index is built with.  When the index is
+      used, blank lines after a record are not copied.  Raises an exception if useIndex is True and idRule is not
+      idFromName(), since the ids in the index would not match the ids of idRule.
+    returns: the number of records copied.
+    '''
+    idRule = getIdRule(idRule)
+    ids = set(ids)
+    if useIndex and idRule is not idFromName:
+        raise Exception('FASTA error: the fasta index can only be used with the idFromName id rule.', idRule)
+    if useIndex is None:
+        useIndex = (isinstance(fastaFile, basestring) and os.path.exists(indexPath(fastaFile)) and
+                    idRule is idFromName)
+    if isinstance(out, basestring):
+        with open(out, 'wb') as fh:
+            return extract(fastaFile, ids, fh, idRule, useIndex)
+    if useIndex:
+        with FastaIndex(fastaFile) as index:
+            return _extractIndexed(index, ids, out)
+    if isinstance(fastaFile, basestring):
+        with openFasta(fastaFile) as fh:
+            return _extractRecords(fh, lambda nameline: idRule(nameline) in ids, out)
+    return _extractRecords(fastaFile, lambda nameline: idRule(nameline) in ids, out)
+
+
 def _fastaSeqIter(filehandle, strict=True, goodOnly=True, filterBlankLines=False):
     '''
     filehandle: file object containing fasta-formatted sequences.
@@ -234,18 +656,301 @@ def _splitOnNamelines(filehandle, filterBlankLines=False):
     Said another way, the seq of lines will always contain at least one line.  only the first line will ever be a nameline.
     filterBlankLines: if True, no blank lines (lines only containing whitespace) will be yielded.
     '''
-    lines = []
-    for line in filehandle:
-        if line and line[0] == '>': # a nameline
-            if lines:
-                yield lines # yield last sequence
-            lines = [line] # start new sequence
-        elif not filterBlankLines:
-            lines.append(line)
-        elif line.strip():
-            lines.append(line)
-    if lines:
-        yield lines
+    for record in _readRecords(filehandle):
+        lines = _recordLines(record)
+        if filterBlankLines:
+            lines = [line for line in lines if line.strip()]
+        if lines:
+            yield lines
+
+
+def _fastaRecordIter(filehandle, strict=True):
+    '''
+    filehandle: file object containing fasta-formatted sequences.
+    strict: if True, raise an exception when a malformed fasta sequence is encountered, exactly like _fastaSeqIter().
+    Parses the filehandle a record at a time without ever splitting well-formed records into lines.  Only well-formed
+    sequences are yielded, as with _fastaSeqIter(filehandle, strict, goodOnly=True).
+    yields: a tuple of (nameline, sequence) for each well-formed sequence.
+    '''
+    for record in _readRecords(filehandle):
+        nameline_seq = _parseRecord(record, strict)
+        if nameline_seq is not None:
+            yield nameline_seq
+
+
+def _mmapRecordIter(mm, strict=True):
+    '''
+    mm: an mmap of a fasta file.
+    Like _fastaRecordIter(), except that a sequence on a single line with no whitespace at either end is yielded as a
+    buffer object pointing into mm instead of as a string.
+    yields: a tuple of (nameline, sequence) for each well-formed sequence.
+    '''
+    for start, end in _mmapRecordBounds(mm):
+        eol = mm.find('\n', start, end)
+        seqEnd = end - 1 if mm[end-1] == '\n' else end
+        if (mm[start] == '>' and eol != -1 and eol + 1 < seqEnd and mm.find('\n', eol + 1, seqEnd) == -1 and
+            mm[eol+1] not in _WHITESPACE and mm[seqEnd-1] not in _WHITESPACE):
+            yield mm[start:eol].strip(), buffer(mm, eol + 1, seqEnd - eol - 1)
+        else:
+            nameline_seq = _parseRecord(mm[start:end], strict)
+            if nameline_seq is not None:
+                yield nameline_seq
+
+
+def _mmapRecordBounds(mm):
+    '''
+    mm: an mmap of a fasta file.
+    yields: a tuple of (start, end) for each record in mm.  Records are split exactly as _readRecords() splits them.
+    '''
+    start = 0
+    pos = mm.find('\n>')
+    while pos != -1:
+        yield start, pos + 1
+        start = pos + 1
+        pos = mm.find('\n>', start)
+    if start < len(mm):
+        yield start, len(mm)
+
+
+def _mmapFasta(fastaFile):
+    '''
+    fastaFile: a path to an uncompressed fasta file or a file object with a fileno() method.
+    returns: a read-only mmap of the whole file, or None if the file is empty, since empty files can not be mmapped.
+    '''
+    if isinstance(fastaFile, basestring):
+        if _compression(fastaFile):
+            raise Exception('FASTA error: compressed fasta files can not be mmapped.', fastaFile)
+        with open(fastaFile, 'rb') as fh:
+            return _mmapFasta(fh)
+    if os.fstat(fastaFile.fileno()).st_size == 0:
+        return None
+    return mmap.mmap(fastaFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _parseRecord(record, strict=True):
+    '''
+    record: the text of a single fasta record, as yielded by _readRecords().
+    returns: a tuple of (nameline, sequence) if record is a well-formed fasta sequence, otherwise None, or, if strict is
+    True, raises the same exception readFastaLines() would.
+    '''
+    nameline_seq = _splitRecord(record)
+    if nameline_seq is None and strict:
+        # reparse the malformed record line by line to raise the same exception.
+        for lines in _fastaSeqIter(_recordLines(record), strict):
+            pass
+    return nameline_seq
+
+
+def _splitRecord(record):
+    '''
+    record: the text of a single fasta record, as yielded by _readRecords().
+    returns: a tuple of (nameline, sequence), stripped and joined the same way readFasta() always has, or None if record
+    is not a well-formed fasta sequence (see _fastaSeqIter()).
+    The common case, a record whose only whitespace is newlines, is handled by a few bulk string operations.  Records
+    containing other whitespace (e.g. '\r\n' line endings) are stripped line by line.
+    '''
+    if record[0] != '>':
+        return None
+    end = record.find('\n')
+    if end == -1 or end == len(record) - 1: # no sequence data lines
+        return None
+    body = record[end+1:]
+    seq = None
+    if isinstance(body, str):
+        seq = body.translate(None, _WHITESPACE)
+        if len(seq) != len(body) - body.count('\n'):
+            seq = None
+        elif body[0] == '\n' or '\n\n' in body: # contains a blank line
+            return None
+    if seq is None:
+        lines = [line.strip() for line in body.split('\n')]
+        if body.endswith('\n'):
+            lines.pop()
+        if '' in lines: # contains a blank line
+            return None
+        seq = ''.join(lines)
+    return record[:end].strip(), seq
+
+
+def _seqSize(lines):
+    '''
+    lines: sequence data lines joined together, including newlines.
+    returns: the number of sequence characters in lines, i.e. sum(len(line.strip()) for line in lines).
+    '''
+    size = len(lines) - lines.count('\n')
+    if len(lines.translate(None, _WHITESPACE)) != size: # whitespace other than newlines
+        size = sum(len(line.strip()) for line in lines.split('\n'))
+    return size
+
+
+def _recordLines(record):
+    '''
+    returns: the lines of record, including newlines, split the same way iterating over a file splits them.
+    '''
+    lines = record.split('\n')
+    last = lines.pop()
+    lines = [line + '\n' for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def _readRecords(filehandle, blockSize=BLOCK_SIZE):
+    '''
+    The block-oriented fasta parsing engine.  Reads filehandle in large blocks and splits the text on namelines using
+    str.find(), without iterating over the individual lines of the sequences.
+    filehandle: a file-like object, read using its read() method.  Objects without a read() method, like a list of
+    lines, are iterated over instead, each item being treated as a block.
+    yields: the text of each record, from the start of a nameline up to the start of the next nameline or the end of
+    the file, including newlines.  If the file does not start with a nameline, the first record is the text before
+    the first nameline.  Joining the yielded records together gives the original text.
+    '''
+    pieces = [] # the text of the current record read so far
+    lineStart = True # the next block starts at the start of a line
+    for block in _readBlocks(filehandle, blockSize):
+        if lineStart and block[0] == '>' and pieces:
+            yield ''.join(pieces)
+            pieces = []
+        start = 0
+        pos = block.find('\n>')
+        while pos != -1:
+            pieces.append(block[start:pos+1])
+            yield ''.join(pieces)
+            pieces = []
+            start = pos + 1
+            pos = block.find('\n>', start)
+        pieces.append(block[start:])
+        lineStart = block[-1] == '\n'
+    if pieces:
+        yield ''.join(pieces)
+
+
+def _scanNamelines(filehandle, blockSize=BLOCK_SIZE):
+    '''
+    Reads filehandle in large blocks like _readRecords(), but only extracts the namelines, jumping from one to the next
+    with str.find().
+    yields: a tuple of (offset, nameline) for every line starting with '>', where offset is the number of bytes read
+    from filehandle before the nameline.  The nameline is stripped, like in readFasta().
+    '''
+    offset = 0 # the offset of the current block
+    pending = None # the pieces of a nameline continuing into the next block
+    lineStart = True # the next block starts at the start of a line
+    for block in _readBlocks(filehandle, blockSize):
+        pos = 0
+        if pending is not None:
+            end = block.find('\n')
+            if end == -1:
+                pending.append(block)
+                offset += len(block)
+                continue
+            pending.append(block[:end])
+            yield pendingOffset, ''.join(pending).strip()
+            pending = None
+            pos = end
+        if lineStart and block[0] == '>':
+            start = 0
+        else:
+            start = block.find('\n>', pos)
+        while start != -1:
+            if block[start] == '\n':
+                start += 1
+            end = block.find('\n', start)
+            if end == -1:
+                pending = [block[start:]]
+                pendingOffset = offset + start
+                break
+            yield offset + start, block[start:end].strip()
+            start = block.find('\n>', end)
+        lineStart = block[-1] == '\n'
+        offset += len(block)
+    if pending is not None:
+        yield pendingOffset, ''.join(pending).strip()
+
+
+def _extractRecords(filehandle, isWanted, out, blockSize=BLOCK_SIZE):
+    '''
+    Reads filehandle in large blocks and jumps from nameline to nameline like _scanNamelines(), writing the text of
+    the records whose namelines are wanted to out.  Text before the first nameline is not written.  Like
+    _extractIndexed(), a newline is added after the last record of a file without a final newline.
+    isWanted: a function that is called with each stripped nameline and returns True if the record should be copied.
+    returns: the number of records copied.
+    '''
+    count = 0
+    copying = False # the current record is being copied
+    pending = None # the pieces of a nameline continuing into the next block
+    lineStart = True # the next block starts at the start of a line
+    for block in _readBlocks(filehandle, blockSize):
+        pos = 0 # the start of the text in block not written yet
+        start = 0 # where to look for the next nameline
+        if pending is not None:
+            end = block.find('\n')
+            if end == -1:
+                pending.append(block)
+                continue
+            pending.append(block[:end])
+            copying = isWanted(''.join(pending).strip())
+            if copying:
+                count += 1
+                out.write(''.join(pending[:-1]))
+            pending = None
+            start = end
+        if lineStart and block[0] == '>':
+            nameStart = 0
+        else:
+            nameStart = block.find('\n>', start)
+        while nameStart != -1:
+            if block[nameStart] == '\n':
+                nameStart += 1
+            if copying:
+                out.write(block[pos:nameStart])
+            pos = nameStart
+            end = block.find('\n', nameStart)
+            if end == -1:
+                pending = [block[nameStart:]]
+                copying = False
+                break
+            copying = isWanted(block[nameStart:end].strip())
+            if copying:
+                count += 1
+            nameStart = block.find('\n>', end)
+        if copying:
+            out.write(block[pos:])
+        lineStart = block[-1] == '\n'
+    if pending is not None and isWanted(''.join(pending).strip()):
+        count += 1
+        out.write(''.join(pending))
+        copying = True
+    if copying and not lineStart: # the last record in a file without a final newline
+        out.write('\n')
+    return count
+
+
+def _readOffsetRecords(filehandle, blockSize=BLOCK_SIZE):
+    '''
+    yields: a tuple of (offset, record) for each record yielded by _readRecords(), where offset is the number of bytes
+    read from filehandle before the start of the record.
+    '''
+    offset = 0
+    for record in _readRecords(filehandle, blockSize):
+        yield offset, record
+        offset += len(record)
+
+
+def _readBlocks(filehandle, blockSize=BLOCK_SIZE):
+    '''
+    yields: the non-empty blocks of text in filehandle, read blockSize bytes at a time if filehandle has a read()
+    method, or by iterating over filehandle otherwise.
+    '''
+    if hasattr(filehandle, 'read'):
+        while True:
+            block = filehandle.read(blockSize)
+            if not block:
+                break
+            yield block
+    else:
+        for block in filehandle:
+            if block:
+                yield block
 
 
 def isNameLine(line):
@@ -315,15 +1020,928 @@ def numSeqsInFile(file):
 
 def numSeqsInPath(path):
     '''
-    path: path to fasta formatted db
+    path: path to fasta formatted db, which may be compressed (see openFasta()).
     returns: number of sequences in fasta db
     '''
-    fh = open(path)
+    fh = openFasta(path)
     size = numSeqsInFile(fh)
     fh.close()
     return size
 
 
+#############
+# FASTA INDEX
+#############
+
+# A fasta index is a samtools faidx compatible (.fai) file.  It is a tab-separated file with one line per sequence and
+# these columns:
+#   NAME: the id of the sequence, as parsed from its nameline by idFromName().
+#   LENGTH: the number of characters in the sequence.
+#   OFFSET: the byte offset in the fasta file of the first character of the sequence.
+#   LINEBASES: the number of sequence characters on each line.
+#   LINEWIDTH: the number of bytes in each line, including the newline.
+# Every sequence line except the last of each sequence must have the same width.
+
+
+def indexPath(path):
+    '''
+    returns: the conventional path of the fasta index of the fasta file at path.
+    '''
+    return path + '.fai'
+
+
+def buildIndex(path, faiPath=None):
+    '''
+    path: path to a fasta file
+    faiPath: where to write the fasta index.  Defaults to indexPath(path).
+    Scans the fasta file once and writes a fasta index for it.  A fasta file compressed with bgzip can be indexed, in
+    which case offsets in the index are offsets into the uncompressed data, as with samtools faidx, and a .gzi index
+    of the compressed blocks is written too if there is none.
+    Raises an exception if the fasta file is malformed, contains duplicate ids, or contains a sequence whose lines are
+    not all the same width, or if it is compressed with anything other than bgzip.
+    returns: faiPath
+    '''
+    if faiPath is None:
+        faiPath = indexPath(path)
+    _checkIndexable(path)
+    if _compression(path) == 'bgzf' and not os.path.exists(path + '.gzi'):
+        bgzf.writeGzi(bgzf.buildGzi(path), path + '.gzi')
+    ids = set()
+    with openFasta(path) as fh:
+        with open(faiPath, 'w') as out:
+            for offset, record in _readOffsetRecords(fh):
+                entry = _indexEntry(offset, record)
+                if entry[0] in ids:
+                    raise Exception('FASTA index error: duplicate id.', entry[0])
+                ids.add(entry[0])
+                out.write('\t'.join(str(x) for x in entry) + '\n')
+    return faiPath
+
+
+def readIndex(faiPath):
+    '''
+    faiPath: path to a fasta index
+    yields: a tuple of (id, length, offset, lineBases, lineWidth) for each sequence in the index.
+    '''
+    with open(faiPath) as fh:
+        for line in fh:
+            fields = line.split('\t')
+            yield (fields[0],) + tuple(int(x) for x in fields[1:5])
+
+
+def _indexEntry(offset, record):
+    '''
+    offset: byte offset of record in the fasta file.
+    record: the text of a single fasta record, as yielded by _readRecords().
+    returns: the fasta index entry for the record, (id, length, offset, lineBases, lineWidth).
+    '''
+    nameline_seq = _splitRecord(record)
+    if nameline_seq is None:
+        raise Exception('FASTA index error: malformed sequence.', offset, _recordLines(record)[0])
+    nameline, seq = nameline_seq
+    start = record.find('\n') + 1
+    body = record[start:]
+    if len(seq) != len(body.translate(None, '\r\n')):
+        raise Exception('FASTA index error: sequence lines must not contain whitespace.', nameline)
+    lineWidth = body.find('\n') + 1
+    if lineWidth == 0: # a single sequence line without a newline
+        lineWidth = len(body) + 1
+    # apart from the one ending the last line, newlines must fall at the end of every multiple of lineWidth.
+    lines = body.rstrip('\r\n')
+    newlines = lines[lineWidth-1::lineWidth]
+    if newlines.count('\n') != len(newlines) or lines.count('\n') != len(newlines):
+        raise Exception('FASTA index error: sequence lines must all be the same width.', nameline)
+    lineBases = len(body[:lineWidth].rstrip(_WHITESPACE))
+    return idFromName(nameline), len(seq), offset + start, lineBases, lineWidth
+
+
+def _checkIndexable(path):
+    '''
+    Raise an exception if the fasta file at path is compressed in a format that does not support random access.
+    '''
+    compression = _compression(path)
+    if compression is not None and compression != 'bgzf':
+        raise Exception('FASTA index error: compressed fasta files must be compressed with bgzip to be indexed.', path)
+
+
+class FastaIndex(object):
+    '''
+    Random access by id to the sequences in a fasta file, using a fasta index.  Looking up a sequence is a dict lookup
+    and a single seek and read, no matter how large the fasta file is.  Fasta files compressed with bgzip are
+    supported, in which case a seek decompresses a single 64KB block.
+
+    Usage:
+
+        with FastaIndex(path) as index:
+            seq = index.fetch('id1')
+            subseq = index.fetch('id1', 100, 200)
+            seqs = index.fetchMany(['id3', 'id1', 'id2'])
+    '''
+    def __init__(self, path, faiPath=None):
+        '''
+        path: path to a fasta file.
+        faiPath: path to the fasta index of the fasta file.  Defaults to indexPath(path).  The index is built if it does
+        not exist.
+        '''
+        if faiPath is None:
+            faiPath = indexPath(path)
+        _checkIndexable(path)
+        if not os.path.exists(faiPath):
+            buildIndex(path, faiPath)
+        self.path = path
+        self.faiPath = faiPath
+        self.ids = []
+        self.idToEntry = {}
+        for entry in readIndex(faiPath):
+            self.ids.append(entry[0])
+            self.idToEntry[entry[0]] = entry[1:]
+        self.fh = None
+        self.numThreads = None # the decompression threads of a bgzipped fasta file, see openFasta().
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.idToEntry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def length(self, id):
+        '''
+        returns: the length of the sequence with the given id.
+        '''
+        return self.idToEntry[id][0]
+
+    def fetch(self, id, start=None, end=None):
+        '''
+        id: the id of a sequence in the fasta file.  Raises a KeyError if the id is not in the index.
+        start: the 0-based start of the subsequence to fetch.  Defaults to the start of the sequence.
+        end: the 0-based end (exclusive) of the subsequence to fetch.  Defaults to the end of the sequence.
+        start and end work like slice indices, so fetch(id, start, end) == fetch(id)[start:end].
+        returns: the sequence, or subsequence, without newlines.
+        '''
+        length, offset, lineBases, lineWidth = self.idToEntry[id]
+        start, end, step = slice(start, end).indices(length)
+        if start >= end:
+            return ''
+        # byte positions of the first char and after the last char of the subsequence.
+        first = offset + (start // lineBases) * lineWidth + start % lineBases
+        last = offset + ((end - 1) // lineBases) * lineWidth + (end - 1) % lineBases + 1
+        if self.fh is None:
+            self.fh = openFasta(self.path, self.numThreads)
+        self.fh.seek(first)
+        return self.fh.read(last - first).translate(None, _WHITESPACE)
+
+    def fetchMany(self, ids):
+        '''
+        ids: a seq of ids of sequences in the fasta file.
+        Sequences are read in the order they occur in the fasta file, to minimize seeking.
+        returns: a list of (id, sequence) tuples, in the same order as ids.
+        '''
+        order = sorted(xrange(len(ids)), key=lambda i: self.idToEntry[ids[i]][1])
+        seqs = [None] * len(ids)
+        for i in order:
+            seqs[i] = self.fetch(ids[i])
+        return zip(ids, seqs)
+
+
+class AsyncFastaIndex(object):
+    '''
+    Non-blocking random access to the sequences of an indexed fasta file, e.g. for serving sequences from a web
+    application.  Reads are done by a bounded pool of threads, each with its own file handle, so the caller is not
+    blocked by disk reads, and the sequences requested by fetchMany() are read concurrently.  File reads and bgzip
+    decompression release the GIL, so the threads do overlap.
+
+    Results are multiprocessing AsyncResult objects, with get(), wait() and ready() methods, and can also be passed
+    to a callback, which is called in a pool thread.
+
+    Usage:
+
+        with AsyncFastaIndex('db.fa', numThreads=16) as index:
+            result = index.fetchManyAsync(ids)
+            ...
+            seqs = result.get(timeout=10)
+    '''
+    def __init__(self, path, faiPath=None, numThreads=8):
+        '''
+        path, faiPath: see FastaIndex.
+        numThreads: the maximum number of concurrent reads.
+        '''
+        self.index = FastaIndex(path, faiPath)
+        self.numThreads = numThreads
+        self.pool = multiprocessing.pool.ThreadPool(numThreads)
+        self.local = threading.local()
+        self.threadIndexes = [] # the FastaIndex of each pool thread, which have their own file handles
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        '''
+        Wait for pending reads to finish, then stop the threads and close the files.
+        '''
+        self.pool.close()
+        self.pool.join()
+        for index in self.threadIndexes + [self.index]:
+            index.close()
+
+    def length(self, id):
+        return self.index.length(id)
+
+    def fetchAsync(self, id, start=None, end=None, callback=None):
+        '''
+        Start reading the sequence, or subsequence, with the given id.  See FastaIndex.fetch().
+        callback: if not None, called with the sequence when it has been read.
+        returns: an AsyncResult whose get() method returns the sequence.
+        '''
+        return self.pool.apply_async(self._fetch, (id, start, end), callback=callback)
+
+    def fetchManyAsync(self, ids, callback=None):
+        '''
+        Start reading the sequences with the given ids.  The ids are sorted by their position in the fasta file and
+        split into one run of neighbouring sequences per thread, which are read concurrently.
+        callback: if not None, called with the list of (id, sequence) tuples when all have been read.
+        returns: an AsyncResult-like object whose get() method returns a list of (id, sequence) tuples, in the same
+        order as ids.  Raises a KeyError if an id is not in the index.
+        '''
+        ids = list(ids)
+        order = sorted(xrange(len(ids)), key=lambda i: self.index.idToEntry[ids[i]][1])
+        size = -(-len(ids) // self.numThreads)
+        runs = [[(i, ids[i]) for i in order[start:start + size]] for start in xrange(0, len(ids), size or 1)]
+        wrapped = None if callback is None else lambda results: callback(_orderedFetches(results))
+        return _FetchManyResult(self.pool.map_async(self._fetchRun, runs, chunksize=1, callback=wrapped))
+
+    def fetchMany(self, ids):
+        '''
+        returns: a list of (id, sequence) tuples, in the same order as ids, read concurrently.
+        '''
+        return self.fetchManyAsync(ids).get()
+
+    def _threadIndex(self):
+        '''
+        returns: the FastaIndex of the current thread, which shares the entries of self.index but has its own file.
+        '''
+        index = getattr(self.local, 'index', None)
+        if index is None:
+            index = self.local.index = copy.copy(self.index)
+            index.fh = None
+            # the pool threads already read concurrently, so each decompresses in its own thread.
+            index.numThreads = 1
+            with self.lock:
+                self.threadIndexes.append(index)
+        return index
+
+    def _fetch(self, id, start, end):
+        return self._threadIndex().fetch(id, start, end)
+
+    def _fetchRun(self, run):
+        index = self._threadIndex()
+        return [(i, id, index.fetch(id)) for i, id in run]
+
+
+class _FetchManyResult(object):
+    '''
+    Wraps the AsyncResult of the runs read by AsyncFastaIndex.fetchManyAsync() to return the sequences in request order.
+    '''
+    def __init__(self, result):
+        self.result = result
+
+    def get(self, timeout=None):
+        return _orderedFetches(self.result.get(timeout))
+
+    def wait(self, timeout=None):
+        self.result.wait(timeout)
+
+    def ready(self):
+        return self.result.ready()
+
+    def successful(self):
+        return self.result.successful()
+
+
+def _orderedFetches(runs):
+    '''
+    runs: lists of (i, id, seq) tuples.
+    returns: a list of the (id, seq) tuples ordered by i.
+    '''
+    fetches = [fetch for run in runs for fetch in run]
+    fetches.sort()
+    return [(id, seq) for i, id, seq in fetches]
+
+
+def readFastaInBackground(fastaFile, strict=True, batchSize=1000, maxBatches=16):
+    '''
+    Like readFasta(), but the file is read and parsed by a background thread, which stays up to maxBatches batches of
+    batchSize sequences ahead of the caller, so the caller rarely blocks on reading and reading overlaps with whatever
+    the caller does with the sequences.  Exceptions raised while reading are raised in the caller.
+    yields: a tuple of (nameline, sequence) for each sequence in the fasta file.
+    '''
+    queue = Queue.Queue(maxBatches)
+    stop = threading.Event()
+
+    def put(item):
+        # give up if the caller stops iterating, instead of blocking forever on a full queue.
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            batch = []
+            for nameline_seq in readFasta(fastaFile, strict):
+                batch.append(nameline_seq)
+                if len(batch) >= batchSize:
+                    if not put((batch, None)):
+                        return
+                    batch = []
+            put((batch, None))
+            put((None, None))
+        except Exception:
+            put((None, sys.exc_info()))
+
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            batch, excInfo = queue.get()
+            if excInfo is not None:
+                raise excInfo[0], excInfo[1], excInfo[2]
+            if batch is None:
+                break
+            for nameline_seq in batch:
+                yield nameline_seq
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _extractIndexed(index, ids, out):
+    '''
+    index: a FastaIndex.
+    Copy the records in index whose ids are in ids to out, in the order they occur in the fasta file, by seeking to
+    each one.
+    returns: the number of records copied.
+    '''
+    entries = sorted((index.idToEntry[id] for id in ids if id in index.idToEntry), key=lambda entry: entry[1])
+    if not entries:
+        return 0
+    fh = openFasta(index.path)
+    try:
+        for length, offset, lineBases, lineWidth in entries:
+            start = _namelineStart(fh, offset)
+            end = offset + _seqBytes(length, lineBases, lineWidth)
+            fh.seek(start)
+            pos = start
+            data = ''
+            while pos < end:
+                data = fh.read(min(BLOCK_SIZE, end - pos))
+                if not data:
+                    break
+                out.write(data)
+                pos += len(data)
+            if not data.endswith('\n'): # the last record in a file without a final newline
+                out.write('\n')
+    finally:
+        fh.close()
+    return len(entries)
+
+
+def _seqBytes(length, lineBases, lineWidth):
+    '''
+    returns: the number of bytes of the lines of an indexed sequence, including the newline ending the last line.
+    '''
+    size = (length // lineBases) * lineWidth
+    if length % lineBases:
+        size += length % lineBases + lineWidth - lineBases
+    return size
+
+
+def _namelineStart(fh, offset, size=1024):
+    '''
+    fh: a seekable fasta file.
+    offset: the offset of the start of a sequence, just after its nameline.
+    returns: the offset of the start of the nameline, found by reading backwards from offset.
+    '''
+    while True:
+        start = max(0, offset - size)
+        fh.seek(start)
+        text = fh.read(offset - start)
+        newline = text.rfind('\n', 0, len(text) - 1)
+        if newline != -1:
+            return start + newline + 1
+        if start == 0:
+            return 0
+        size *= 2
+
+
+##########################
+# RESUMABLE FASTA READING
+##########################
+
+# A checkpoint is a tuple of (offset, ordinal): the byte offset in the (uncompressed) fasta file of the start of the
+# next record to read, and the number of sequences read before it.  A FastaReader started from a checkpoint continues
+# exactly where the reader that made the checkpoint left off.
+
+
+class FastaReader(object):
+    '''
+    An iterator over the (nameline, seq) tuples of a fasta file, like readFasta(), that keeps track of how far it has
+    read, so reading can be resumed from a checkpoint, e.g. after a long-running job crashes.
+
+    Usage:
+
+        with FastaReader('db.fa', checkpoint=loadCheckpoint('db.ckpt')) as reader:
+            for nameline, seq in reader:
+                process(nameline, seq)
+                if reader.ordinal % 10000 == 0:
+                    saveCheckpoint(reader.checkpoint(), 'db.ckpt')
+    '''
+    def __init__(self, fastaFile, strict=True, checkpoint=None):
+        '''
+        fastaFile: a path to a fasta file, which may be compressed, or a seekable file-like object.  A path is opened
+          and closed by close().
+        checkpoint: an (offset, ordinal) tuple returned by checkpoint() of an earlier reader of the same file.  Defaults
+          to the start of the file.
+        '''
+        self.offset, self.ordinal = (0, 0) if checkpoint is None else checkpoint
+        self.strict = strict
+        self.closeFile = isinstance(fastaFile, basestring)
+        self.fh = openFasta(fastaFile) if self.closeFile else fastaFile
+        if self.offset:
+            self.fh.seek(self.offset)
+        self.records = self._readRecords()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.records)
+
+    def close(self):
+        if self.closeFile:
+            self.fh.close()
+
+    def checkpoint(self):
+        '''
+        returns: an (offset, ordinal) tuple for resuming reading after the last sequence yielded.
+        '''
+        return self.offset, self.ordinal
+
+    def _readRecords(self):
+        start = self.offset
+        for offset, record in _readOffsetRecords(self.fh):
+            nameline_seq = _parseRecord(record, self.strict)
+            self.offset = start + offset + len(record)
+            if nameline_seq is not None:
+                self.ordinal += 1
+                yield nameline_seq
+
+
+def saveCheckpoint(checkpoint, path):
+    '''
+    Write checkpoint, an (offset, ordinal) tuple, to path.  The checkpoint is written to a temp file next to path that
+    is renamed to path, so path always contains a complete checkpoint, even if the process dies while writing.
+    '''
+    with temps.tmpfile(root=os.path.dirname(os.path.abspath(path))) as tmpPath:
+        with open(tmpPath, 'w') as fh:
+            fh.write('%s\t%s\n' % tuple(checkpoint))
+        os.rename(tmpPath, path)
+
+
+def loadCheckpoint(path):
+    '''
+    returns: the (offset, ordinal) checkpoint saved at path, or None if path does not exist.
+    '''
+    if not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        offset, ordinal = fh.read().split()
+    return int(offset), int(ordinal)
+
+
+def readFastaCheckpointed(fastaFile, checkpointPath, every=10000, strict=True):
+    '''
+    fastaFile: a path to a fasta file, which may be compressed.
+    checkpointPath: where the checkpoint is saved.  If a checkpoint exists, reading resumes from it.
+    every: save a checkpoint after this many sequences have been processed.
+    A sequence counts as processed when the next one is requested, so after a crash the job resumes with the first
+    sequence that might not have been completely processed.  A checkpoint is saved at the end of the file too, so
+    rerunning a finished job yields nothing.  Remove checkpointPath to start over.
+    yields: a tuple of (nameline, sequence) for each sequence not processed yet.
+    '''
+    with FastaReader(fastaFile, strict, loadCheckpoint(checkpointPath)) as reader:
+        for nameline_seq in reader:
+            yield nameline_seq
+            if reader.ordinal % every == 0:
+                saveCheckpoint(reader.checkpoint(), checkpointPath)
+        saveCheckpoint(reader.checkpoint(), checkpointPath)
+
+
+##################
+# EXTERNAL SORTING
+##################
+
+# sort() can sort fasta files much larger than memory.  Records are read in batches of about memoryLimit bytes, each
+# batch is sorted and written (pickled) to a nested temp file, and the sorted runs are merged with a heap.  Whenever
+# fanIn runs of the same size accumulate, they are merged into one bigger run, so no more than fanIn runs are merged at
+# once, fewer than fanIn runs of each size are kept open, and each record is rewritten once per level of merging.
+# Sorted fasta files can be merged or compared with each other in a single streaming pass.
+
+
+def sort(fastaFile, out, key='id', memoryLimit=SORT_MEMORY_LIMIT, tmpDir=nested.DEFAULT_TMP_DIR, idRule=idFromName,
+         width=60, strict=True, fanIn=SORT_FAN_IN):
+    '''
+    fastaFile: a file-like object or a path to a fasta file, which may be compressed.
+    out: a file-like object or a path to write the sorted fasta file to.
+    key: what to sort the records by: 'id', 'length', 'hash' (the md5 digest of the sequence, which groups identical
+      sequences together), or a function that returns a key given a nameline and a sequence.  Keys must be picklable.
+      Records with equal keys stay in their original order.
+    memoryLimit: the number of bytes of namelines and sequences to sort in memory at a time.
+    tmpDir: the root of the nested temp files that sorted runs are written to.
+    idRule: how ids are parsed from namelines when sorting by id.  See getIdRule().
+    width: the width of sequence lines in out.
+    fanIn: the maximum number of sorted runs merged at once.  Must be at least 2.
+    returns: the number of records sorted.
+    '''
+    if fanIn < 2:
+        raise Exception('FASTA error: sort fanIn must be at least 2.', fanIn)
+    keyFunc = _sortKeyFunc(key, getIdRule(idRule))
+    runs = [] # (level, run) tuples, the runs of each level after the runs of higher levels.
+    try:
+        batch = []
+        batchSize = 0
+        for ordinal, (nameline, seq) in enumerate(readFasta(fastaFile, strict)):
+            batch.append((keyFunc(nameline, seq), ordinal, nameline, seq))
+            batchSize += len(nameline) + len(seq)
+            if batchSize >= memoryLimit:
+                batch.sort()
+                runs.append((0, _writeRun(batch, tmpDir)))
+                _mergeSortedRuns(runs, fanIn, tmpDir)
+                batch = []
+                batchSize = 0
+        batch.sort()
+        numRecords = ordinal + 1 if batch or runs else 0
+        # leave room for the batch in the final merge.
+        _mergeSortedRuns(runs, fanIn, tmpDir, final=True)
+        records = heapq.merge(batch, *[_readSortedRun(run) for level, run in runs])
+        with FastaWriter(out, width=width) as writer:
+            for key, ordinal, nameline, seq in records:
+                writer.write(nameline, seq)
+        return numRecords
+    finally:
+        _removeRuns(run for level, run in runs)
+
+
+def _sortKeyFunc(key, idRule):
+    if key == 'id':
+        return lambda nameline, seq: idRule(nameline)
+    if key == 'length':
+        return lambda nameline, seq: len(seq)
+    if key == 'hash':
+        return lambda nameline, seq: hashlib.md5(seq).digest()
+    if callable(key):
+        return key
+    raise Exception('FASTA error: unknown sort key.', key)
+
+
+def _mergeSortedRuns(runs, fanIn, tmpDir, final=False):
+    '''
+    Merge the last fanIn runs of runs into one while they are all of the same level.  If final is True, instead merge
+    the last (and smallest) runs until fewer than fanIn runs are left, so they can be merged with the last batch.
+    runs: a list of (level, run) tuples, which is modified in place.
+    '''
+    while len(runs) >= fanIn:
+        # a final merge only merges as many runs as needed to get down to fanIn - 1.
+        count = min(fanIn, len(runs) - fanIn + 2) if final else fanIn
+        if not final and any(level != runs[-1][0] for level, run in runs[-count:]):
+            break
+        level = max(level for level, run in runs[-count:]) + 1
+        merging = [run for level, run in runs[-count:]]
+        del runs[-count:]
+        try:
+            runs.append((level, _writeRun(heapq.merge(*[_readSortedRun(run) for run in merging]), tmpDir)))
+        finally:
+            _removeRuns(merging)
+
+
+def _removeRuns(runs):
+    for run in runs:
+        run.close()
+        os.remove(run.name)
+
+
+def _writeRun(records, tmpDir):
+    '''
+    records: an iterable of (key, ordinal, nameline, seq) tuples in sorted order.
+    returns: a nested temp file, open for reading, containing the tuples of records pickled in order.
+    '''
+    run = nested.makeTempFile(dir=tmpDir)
+    pickler = cPickle.Pickler(run, cPickle.HIGHEST_PROTOCOL)
+    for record in records:
+        pickler.dump(record)
+        # the pickler would otherwise remember every record it has written.
+        pickler.clear_memo()
+    run.flush()
+    run.seek(0)
+    return run
+
+
+def _readSortedRun(run):
+    '''
+    yields: the tuples pickled in run by _writeRun().
+    '''
+    unpickler = cPickle.Unpickler(run)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            break
+
+
+##########
+# SHARDING
+##########
+
+# shard() splits a fasta file into several files with about the same number of residues, records or bytes each, e.g.
+# for spreading a database over cluster jobs.  Records are assigned to shards greedily, each to the shard with the
+# smallest total so far, so shards are not contiguous pieces of the file, but none holds more than its fair share plus
+# one record.
+
+
+def shard(fastaFile, outPaths, by='residues', useIndex=None, strict=True):
+    '''
+    fastaFile: a file-like object or a path to a fasta file, which may be compressed.
+    outPaths: the paths of the shards to write.
+    by: what to balance: 'residues', 'records' or 'bytes'.
+    useIndex: if True, the sizes of all records are read from the fasta index of fastaFile, which is built if it does
+      not exist, and records are assigned largest first, which balances shards more evenly, especially when a few
+      records are much larger than the rest.  The bytes of a record are estimated from the offsets in the index.  If
+      False, records are assigned as they are read, in a single pass.  If None, the index is used if fastaFile is a
+      path with an existing index.
+    Records are copied as raw text.  Within each shard, records are in the order they occur in fastaFile.
+    returns: a list of the number of residues, records or bytes written to each shard.
+    '''
+    if by not in _SHARD_WEIGHTS:
+        raise Exception('FASTA error: unknown shard balance.', by)
+    weigh = _SHARD_WEIGHTS[by]
+    if useIndex is None:
+        useIndex = isinstance(fastaFile, basestring) and os.path.exists(indexPath(fastaFile))
+    assignments = iter(_assignShards(_indexWeights(fastaFile, by), len(outPaths))) if useIndex else None
+    heap = [(0, i) for i in xrange(len(outPaths))]
+    loads = [0] * len(outPaths)
+    files = [open(path, 'wb') for path in outPaths]
+    try:
+        for record, seq in _shardRecords(fastaFile, strict):
+            weight = weigh(record, seq)
+            if assignments is None:
+                load, i = heapq.heappop(heap)
+                heapq.heappush(heap, (load + weight, i))
+            else:
+                i = next(assignments, None)
+                if i is None:
+                    raise Exception('FASTA error: the fasta file has more records than its index.', fastaFile)
+            files[i].write(record if record.endswith('\n') else record + '\n')
+            loads[i] += weight
+    finally:
+        for fh in files:
+            fh.close()
+    return loads
+
+
+_SHARD_WEIGHTS = {
+    'residues': lambda record, seq: len(seq),
+    'records': lambda record, seq: 1,
+    'bytes': lambda record, seq: len(record),
+}
+
+
+def _shardRecords(fastaFile, strict):
+    '''
+    yields: a tuple of (record, seq) of the raw text and sequence of every well-formed record in fastaFile.
+    '''
+    if isinstance(fastaFile, basestring):
+        with openFasta(fastaFile) as fh:
+            for record_seq in _shardRecords(fh, strict):
+                yield record_seq
+    else:
+        for record in _readRecords(fastaFile):
+            nameline_seq = _parseRecord(record, strict)
+            if nameline_seq is not None:
+                yield record, nameline_seq[1]
+
+
+def _indexWeights(path, by):
+    '''
+    returns: a list of the number of residues, records or bytes of each record in the fasta file at path, in order,
+    according to its fasta index.
+    '''
+    with FastaIndex(path) as index:
+        entries = [index.idToEntry[id] for id in index.ids]
+    if by == 'residues':
+        return [length for length, offset, lineBases, lineWidth in entries]
+    if by == 'records':
+        return [1] * len(entries)
+    # the bytes from the start of one sequence to the start of the next one.
+    weights = [following[1] - entry[1] for entry, following in zip(entries, entries[1:])]
+    if entries:
+        weights.append(_seqBytes(entries[-1][0], entries[-1][2], entries[-1][3]))
+    return weights
+
+
+def _assignShards(weights, n):
+    '''
+    Assign items to n shards, largest first, each to the shard with the smallest total weight so far.
+    returns: a list of the shard of each item.
+    '''
+    shards = [0] * len(weights)
+    heap = [(0, i) for i in xrange(n)]
+    for item in sorted(xrange(len(weights)), key=weights.__getitem__, reverse=True):
+        load, i = heapq.heappop(heap)
+        heapq.heappush(heap, (load + weights[item], i))
+        shards[item] = i
+    return shards
+
+
+#########################
+# PARALLEL FASTA SCANNING
+#########################
+
+# A fasta file is split into byte ranges that start at record boundaries, and each range is scanned by a separate
+# process.  Functions passed to mapFasta() and mapFastaRanges() are sent to the worker processes, so they must be
+# picklable, i.e. defined at the top level of a module.
+
+
+def splitRanges(path, n):
+    '''
+    path: path to an uncompressed fasta file.  Unlike most functions in this module, which decompress files with
+      openFasta(), splitRanges() needs byte offsets into the file itself, so it raises an exception for compressed
+      (e.g. gzip or BGZF) files.
+    n: the number of ranges to split the file into.
+    Splits the file into byte ranges of roughly equal size.  Every range except the first starts at the '>' of a
+    nameline, so every record falls entirely within one range.
+    returns: a list of (start, end) byte ranges covering the whole file, in file order.  There are fewer than n ranges
+    if the file is small or contains records longer than the file size divided by n.
+    '''
+    if _compression(path):
+        raise Exception('splitRanges error: compressed input not supported', path)
+    mm = _mmapFasta(path)
+    if mm is None:
+        return []
+    size = len(mm)
+    bounds = [0]
+    with contextlib.closing(mm):
+        for i in xrange(1, n):
+            pos = mm.find('\n>', max(i * size // n - 1, bounds[-1]))
+            if pos == -1:
+                break
+            if pos + 1 > bounds[-1]:
+                bounds.append(pos + 1)
+    bounds.append(size)
+    return zip(bounds[:-1], bounds[1:])
+
+
+def mapFasta(func, path, numProcs=None, numRanges=None, ordered=True, strict=True):
+    '''
+    func: a picklable function called as func(nameline, seq) for every sequence in the fasta file.
+    path: path to an uncompressed fasta file.  Compressed (e.g. gzip or BGZF) files raise an exception, since the file
+      is split into byte ranges with splitRanges().
+    numProcs: the number of worker processes.  Defaults to the number of cpus.
+    numRanges: the number of ranges to split the file into.  Defaults to 4 * numProcs, to balance the load between
+      workers when sequences are unevenly distributed.
+    ordered: if True, results are yielded in file order.  If False, the results of each range are yielded as soon as
+      the range is done.
+    strict: see readFasta()
+    yields: the result of func for every sequence.
+    '''
+    for results in mapFastaRanges(_mapRecords, path, numProcs, numRanges, ordered, strict, args=(func,)):
+        for result in results:
+            yield result
+
+
+def mapFastaRanges(func, path, numProcs=None, numRanges=None, ordered=True, strict=True, args=()):
+    '''
+    func: a picklable function called as func(records, *args) for every range of the fasta file, where records
+      iterates over the (nameline, seq) tuples in the range, like readFasta().
+    args: extra arguments passed to func.
+    See mapFasta() for the other parameters.  Use this function to reduce each range to a single value in the worker,
+    e.g. sum(mapFastaRanges(countRecords, path)), where countRecords = lambda records: sum(1 for r in records), except
+    defined with def at the top level of a module.
+    yields: the result of func for each range.
+    '''
+    tasks = [(func, args, path, start, end, strict) for start, end in _ranges(path, numProcs, numRanges)]
+    return util.poolMap(_mapRange, tasks, numProcs, ordered)
+
+
+def parallelNumSeqs(path, numProcs=None):
+    '''
+    returns: the number of namelines in the fasta file, like numSeqsInFastaDb(), counted in parallel.
+    '''
+    tasks = [(path, start, end) for start, end in _ranges(path, numProcs)]
+    return sum(util.poolMap(_numSeqsRange, tasks, numProcs, ordered=False))
+
+
+def parallelDbSize(path, numProcs=None):
+    '''
+    returns: the number of sequence characters in the fasta file, like dbSizeInPath(), counted in parallel.
+    '''
+    tasks = [(path, start, end) for start, end in _ranges(path, numProcs)]
+    return sum(util.poolMap(_dbSizeRange, tasks, numProcs, ordered=False))
+
+
+def parallelIds(path, numProcs=None, strict=True):
+    '''
+    returns: a list of the ids of the sequences in the fasta file, in file order, like list(readIds(path)).
+    '''
+    return list(mapFasta(_idFromRecord, path, numProcs, strict=strict))
+
+
+def _ranges(path, numProcs=None, numRanges=None):
+    if numRanges is None:
+        numRanges = 4 * (numProcs or multiprocessing.cpu_count())
+    return splitRanges(path, numRanges)
+
+
+def _rangeRecords(path, start, end):
+    '''
+    yields: the text of each record in the byte range from start to end of the fasta file at path.
+    '''
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        for record in _readRecords(_readRangeBlocks(fh, end - start)):
+            yield record
+
+
+def _readRangeBlocks(filehandle, size, blockSize=BLOCK_SIZE):
+    '''
+    yields: the next size bytes of filehandle, blockSize bytes at a time.
+    '''
+    while size > 0:
+        block = filehandle.read(min(size, blockSize))
+        if not block:
+            break
+        size -= len(block)
+        yield block
+
+
+def _mapRange(task):
+    func, args, path, start, end, strict = task
+    records = (_parseRecord(record, strict) for record in _rangeRecords(path, start, end))
+    return func((record for record in records if record is not None), *args)
+
+
+def _mapRecords(records, func):
+    return [func(nameline, seq) for nameline, seq in records]
+
+
+def _idFromRecord(nameline, seq):
+    return idFromName(nameline)
+
+
+def _numSeqsRange(task):
+    path, start, end = task
+    return sum(1 for record in _rangeRecords(path, start, end) if record[0] == '>')
+
+
+def _dbSizeRange(task):
+    path, start, end = task
+    size = 0
+    for record in _rangeRecords(path, start, end):
+        if record[0] == '>':
+            record = record[record.find('\n') + 1 or len(record):]
+        size += _seqSize(record)
+    return size
+
+
 def main():
     pass
 
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks of the fasta parsing functions on synthetic fasta files.
+
+generateFasta() writes a random fasta file with a given size, line width,
+distribution of sequence lengths and rate of malformed records.
+runBenchmarks() times each function in BENCHMARKS on a file and reports
+the best of several runs in MB/s and records/s.  Results are plain dicts,
+saved as json, and compareToBaseline() lists the benchmarks that got slower
+than a saved baseline by more than a tolerance.
+
+Usage:
+
+    python fastabench.py --size 200 --out results.json
+    python fastabench.py --size 200 --baseline results.json
+
+The second command exits with status 1 if any benchmark regressed.
+'''
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+import fasta
+import temps
+
+
+# the kinds of malformed records generateFasta() writes: a blank line in the sequence and a nameline without a sequence.
+MALFORMATIONS = ('blankLine', 'noSequence')
+
+# the kinds of well-formed but unusual records generateFasta() writes: windows line endings, which take the slow path of
+# the parsers.
+VARIANTS = ('crlf',)
+
+LENGTH_DISTRIBUTIONS = ('fixed', 'uniform', 'lognormal')
+
+
+def _count(iterable):
+    n = 0
+    for item in iterable:
+        n += 1
+    return n
+
+
+def _recordLengths(path, strict):
+    return _count(record.length for record in fasta.readFastaRecords(path, strict))
+
+
+# (name, function) pairs.  Each function is called with the path of a fasta file and strict, and does a full pass over
+# the file.
+BENCHMARKS = [
+    ('readFasta', lambda path, strict: _count(fasta.readFasta(path, strict))),
+    ('readFasta.mmap', lambda path, strict: _count(fasta.readFasta(path, strict, useMmap=True))),
+    ('readFastaLines', lambda path, strict: _count(fasta.readFastaLines(path, strict))),
+    ('readFastaRecords.length', _recordLengths),
+    ('readIds', lambda path, strict: _count(fasta.readIds(path, strict))),
+    ('readIdOffsets', lambda path, strict: _count(fasta.readIdOffsets(path))),
+    ('numSeqsInPath', lambda path, strict: fasta.numSeqsInPath(path)),
+    ('numSeqsInFastaDb', lambda path, strict: fasta.numSeqsInFastaDb(path)),
+    ('dbSizeInPath', lambda path, strict: fasta.dbSizeInPath(path)),
+    ('parallelNumSeqs', lambda path, strict: fasta.parallelNumSeqs(path)),
+    ('parallelDbSize', lambda path, strict: fasta.parallelDbSize(path)),
+]
+
+
+def generateFasta(path, size, width=60, meanLength=400, distribution='lognormal', malformedRate=0.0, seed=0,
+                  alphabet='ACGT', variantRate=0.0):
+    '''
+    Write a random fasta file.
+    path: where to write the fasta file.
+    size: the approximate size of the file in bytes.  Records are written until the file is at least this big.
+    width: the length of sequence lines.
+    meanLength: the mean length of the sequences.
+    distribution: the distribution of sequence lengths: 'fixed', 'uniform' (between 1 and 2 * meanLength - 1), or
+      'lognormal' (with sigma 1, so a few sequences are much longer than the rest, like in real databases).
+    malformedRate: the fraction of records that are malformed in one of the ways in MALFORMATIONS.  Files with
+      malformed records must be read with strict=False.
+    seed: the seed of the random number generator, so the same arguments make the same file.
+    alphabet: the characters sequences are made of.
+    variantRate: the fraction of the well-formed records that are written in one of the ways in VARIANTS.
+    returns: a dict with the number of 'bytes', well-formed 'records' and 'malformed' records written, and the number
+    of well-formed records that are 'variants'.
+    '''
+    if distribution not in LENGTH_DISTRIBUTIONS:
+        raise Exception('fastabench error: unknown length distribution.', distribution)
+    rand = random.Random(seed)
+    # sequences are random slices of a pool of random characters, which is much faster than choosing each character.
+    poolSize = 2**16
+    pool = ''.join(rand.choice(alphabet) for i in xrange(poolSize))
+    pool += pool
+    stats = {'bytes': 0, 'records': 0, 'malformed': 0, 'variants': 0}
+    with open(path, 'wb') as fh:
+        while stats['bytes'] < size:
+            length = _seqLength(rand, meanLength, distribution)
+            starts = [rand.randrange(poolSize) for i in xrange(0, length, poolSize)]
+            seq = ''.join(pool[start:start + min(poolSize, length - i * poolSize)] for i, start in enumerate(starts))
+            text = '>gnl|bench|seq%s random sequence of length %s\n' % (stats['records'] + stats['malformed'], length)
+            lines = fasta.prettySeq(seq, width)
+            kind = rand.choice(MALFORMATIONS) if malformedRate and rand.random() < malformedRate else None
+            variant = rand.choice(VARIANTS) if not kind and variantRate and rand.random() < variantRate else None
+            if kind == 'blankLine':
+                lines = lines.replace('\n', '\n\n', 1)
+            elif kind == 'noSequence':
+                lines = ''
+            if variant == 'crlf':
+                text = text.replace('\n', '\r\n')
+                lines = lines.replace('\n', '\r\n')
+            text += lines
+            fh.write(text)
+            stats['bytes'] += len(text)
+            stats['malformed' if kind else 'records'] += 1
+            stats['variants'] += bool(variant)
+    return stats
+
+
+def _seqLength(rand, meanLength, distribution):
+    if distribution == 'fixed':
+        return meanLength
+    if distribution == 'uniform':
+        return rand.randint(1, max(1, 2 * meanLength - 1))
+    sigma = 1.0
+    return max(1, int(rand.lognormvariate(math.log(meanLength) - sigma**2 / 2, sigma)))
+
+
+def runBenchmarks(path, numRecords, names=None, repeat=3, strict=True):
+    '''
+    path: a fasta file, e.g. made by generateFasta().
+    numRecords: the number of records in the file, for computing records/s.
+    names: the names of the benchmarks in BENCHMARKS to run.  Defaults to all of them.
+    repeat: the number of times to run each benchmark.  The fastest run is reported.
+    strict: passed to the functions that take it.  Must be False for files with malformed records.
+    returns: a dict from benchmark name to a dict of 'seconds', 'mbPerSec' and 'recordsPerSec'.
+    '''
+    size = os.path.getsize(path)
+    results = {}
+    for name, func in BENCHMARKS:
+        if names is not None and name not in names:
+            continue
+        seconds = float('inf')
+        for i in xrange(repeat):
+            start = time.time()
+            func(path, strict)
+            seconds = min(seconds, time.time() - start)
+        seconds = max(seconds, 1e-9)
+        results[name] = {
+            'seconds': seconds,
+            'mbPerSec': size / seconds / 2**20,
+            'recordsPerSec': numRecords / seconds,
+        }
+    return results
+
+
+def compareToBaseline(results, baseline, tolerance=0.1):
+    '''
+    results, baseline: dicts returned by runBenchmarks().
+    tolerance: the fraction by which a benchmark can be slower than the baseline before it counts as a regression.
+    returns: a list of (name, baselineMbPerSec, mbPerSec) tuples for each benchmark in both results and baseline that
+    is slower than the baseline by more than the tolerance.
+    '''
+    regressions = []
+    for name in sorted(results):
+        if name in baseline:
+            old = baseline[name]['mbPerSec']
+            new = results[name]['mbPerSec']
+            if new < old * (1 - tolerance):
+                regressions.append((name, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark fasta parsing on a synthetic fasta file.')
+    parser.add_argument('--size', type=float, default=100, help='size of the fasta file in MB')
+    parser.add_argument('--width', type=int, default=60, help='length of sequence lines')
+    parser.add_argument('--mean-length', type=int, default=400, help='mean length of sequences')
+    parser.add_argument('--distribution', choices=LENGTH_DISTRIBUTIONS, default='lognormal',
+                        help='distribution of sequence lengths')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='fraction of malformed records')
+    parser.add_argument('--variant-rate', type=float, default=0.0,
+                        help='fraction of well-formed records with windows line endings')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the fasta file')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each benchmark')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--fasta', help='benchmark this fasta file instead of generating one')
+    parser.add_argument('--out', help='write the results as json to this file')
+    parser.add_argument('--baseline', help='compare the results to the results in this json file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fraction a benchmark can be slower than the baseline')
+    args = parser.parse_args()
+
+    with temps.tmpdir() as dirpath:
+        if args.fasta:
+            path = args.fasta
+            numRecords = fasta.numSeqsInFastaDb(path)
+            params = {'fasta': path}
+        else:
+            path = os.path.join(dirpath, 'bench.fa')
+            params = {'size': args.size, 'width': args.width, 'meanLength': args.mean_length,
+                      'distribution': args.distribution, 'malformedRate': args.malformed_rate, 'seed': args.seed,
+                      'variantRate': args.variant_rate}
+            numRecords = generateFasta(path, int(args.size * 2**20), args.width, args.mean_length, args.distribution,
+                                       args.malformed_rate, args.seed, variantRate=args.variant_rate)['records']
+        benchmarks = runBenchmarks(path, numRecords, args.only, args.repeat, strict=not args.malformed_rate)
+    report = {'params': params, 'python': platform.python_version(), 'benchmarks': benchmarks}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print text
+    if args.out:
+        with open(args.out, 'w') as fh:
+            fh.write(text + '\n')
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)['benchmarks']
+        regressions = compareToBaseline(benchmarks, baseline, args.tolerance)
+        for name, old, new in regressions:
+            sys.stderr.write('regression: %s %.1f MB/s -> %.1f MB/s\n' % (name, old, new))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
+
+
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+'''
+Summary statistics of fasta databases, computed in bulk with numpy.
+
+Instead of looping over every line or character in python, the sequences of
+many records are concatenated into one buffer, viewed as an array of bytes
+with numpy.frombuffer, and counted with a single numpy.bincount keyed by
+record and byte value, numbering only the byte values that occur in the
+batch, so the counts grow with the size of the alphabet, not with all 256
+byte values.  Everything else (lengths, GC content, ambiguous
+characters, composition) is derived from those counts.
+
+Usage:
+
+    stats = recordStats('assembly.fa.gz')
+    print stats['lengths'].max(), stats['gc'].mean()
+    print summarize('assembly.fa.gz')['n50']
+'''
+
+import numpy as np
+
+import fasta
+
+
+# the number of sequence characters counted in each batch.
+BATCH_SIZE = 2**24
+NUCLEOTIDES = 'ACGT'
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+
+
+def residueCounts(seqs, batchSize=BATCH_SIZE):
+    '''
+    seqs: an iterable of sequence strings.
+    batchSize: the number of sequence characters to count at a time.  Larger
+    batches mean fewer numpy calls, but use 8 bytes of memory per character.
+    yields: for each batch of sequences, an array of shape (numSeqs, 256),
+    where row i counts the occurrences of each byte value in sequence i of the
+    batch.
+    '''
+    for values, counts in _countBatches(seqs, batchSize):
+        full = np.zeros((len(counts), 256), dtype=np.int64)
+        full[:, values] = counts
+        yield full
+
+
+def recordStats(fastaFile, unambiguous=NUCLEOTIDES, numProcs=None, strict=True):
+    '''
+    fastaFile: a file-like object or a path to a fasta file, which may be
+    compressed.
+    unambiguous: the characters that are not ambiguous, e.g. NUCLEOTIDES or
+    AMINO_ACIDS.  Case is ignored.
+    numProcs: if not None, fastaFile must be a path to an uncompressed fasta
+    file, which is split into ranges that are counted by numProcs processes.
+    returns: a dict with these keys:
+      'lengths': an array of the length of each sequence.
+      'gc': an array of the fraction of the ACGT bases of each sequence that
+        are G or C, or nan for sequences without any.
+      'ambiguous': an array of the number of ambiguous characters in each
+        sequence.
+      'composition': an array counting each byte value in all the sequences.
+    '''
+    if numProcs is None:
+        return _stats(fasta.readFasta(fastaFile, strict), unambiguous)
+    parts = list(fasta.mapFastaRanges(_stats, fastaFile, numProcs, strict=strict, args=(unambiguous,)))
+    if not parts:
+        return _stats([], unambiguous)
+    stats = dict((key, np.concatenate([part[key] for part in parts])) for key in ('lengths', 'gc', 'ambiguous'))
+    stats['composition'] = np.sum([part['composition'] for part in parts], axis=0)
+    return stats
+
+
+def nx(lengths, x=50):
+    '''
+    lengths: an array of sequence lengths.
+    x: a percentage.
+    returns: (Nx, Lx), where Nx is the length of the shortest sequence such
+    that sequences at least that long contain x percent of all the residues,
+    and Lx is the number of sequences at least that long.  For example, nx(l,
+    50) returns the N50 and L50.  Returns (0, 0) if there are no residues.
+    '''
+    lengths = np.sort(np.asarray(lengths, dtype=np.int64))[::-1]
+    total = lengths.sum()
+    if total == 0:
+        return 0, 0
+    i = int(np.searchsorted(np.cumsum(lengths), total * x / 100.0))
+    return int(lengths[i]), i + 1
+
+
+def summarize(fastaFile, unambiguous=NUCLEOTIDES, numProcs=None, strict=True):
+    '''
+    returns: a dict of summary statistics of the whole fasta file: numSeqs,
+    totalLength, minLength, maxLength, meanLength, n50, l50, gc (the GC
+    fraction of all ACGT bases), ambiguous (the total number of ambiguous
+    characters) and composition (a dict from character to count).
+    See recordStats() for the parameters.
+    '''
+    stats = recordStats(fastaFile, unambiguous, numProcs, strict)
+    lengths = stats['lengths']
+    composition = stats['composition']
+    n50, l50 = nx(lengths, 50)
+    acgt = composition[_codes('ACGT')].sum()
+    return {
+        'numSeqs': len(lengths),
+        'totalLength': int(lengths.sum()),
+        'minLength': int(lengths.min()) if len(lengths) else 0,
+        'maxLength': int(lengths.max()) if len(lengths) else 0,
+        'meanLength': float(lengths.mean()) if len(lengths) else 0.0,
+        'n50': n50,
+        'l50': l50,
+        'gc': float(composition[_codes('GC')].sum()) / acgt if acgt else float('nan'),
+        'ambiguous': int(stats['ambiguous'].sum()),
+        'composition': dict((chr(i), int(n)) for i, n in enumerate(composition) if n),
+    }
+
+
+def _stats(records, unambiguous=NUCLEOTIDES):
+    '''
+    records: an iterable of (nameline, seq) tuples.
+    returns: the recordStats() dict for the records.
+    '''
+    lengths = []
+    gc = []
+    ambiguous = []
+    composition = np.zeros(256, dtype=np.int64)
+    gcCodes = _codes('GC')
+    acgtCodes = _codes('ACGT')
+    unambiguousCodes = _codes(unambiguous)
+    for values, counts in _countBatches(seq for nameline, seq in records):
+        batchLengths = counts.sum(axis=1)
+        acgt = counts[:, np.in1d(values, acgtCodes)].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gc.append(counts[:, np.in1d(values, gcCodes)].sum(axis=1) / acgt.astype(np.float64))
+        ambiguous.append(batchLengths - counts[:, np.in1d(values, unambiguousCodes)].sum(axis=1))
+        lengths.append(batchLengths)
+        composition[values] += counts.sum(axis=0)
+    return {
+        'lengths': np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64),
+        'gc': np.concatenate(gc) if gc else np.zeros(0, dtype=np.float64),
+        'ambiguous': np.concatenate(ambiguous) if ambiguous else np.zeros(0, dtype=np.int64),
+        'composition': composition,
+    }
+
+
+def _countBatches(seqs, batchSize=BATCH_SIZE):
+    '''
+    yields: the _counts() of each batch of about batchSize characters of seqs.
+    '''
+    batch = []
+    size = 0
+    for seq in seqs:
+        batch.append(seq)
+        size += len(seq)
+        if size >= batchSize:
+            yield _counts(batch)
+            batch = []
+            size = 0
+    if batch:
+        yield _counts(batch)
+
+
+def _counts(seqs):
+    '''
+    seqs: a list of sequence strings.
+    returns: a tuple of (values, counts), a sorted array of the distinct byte values in seqs and an array of shape
+    (len(seqs), len(values)) of the number of times each one occurs in each sequence.
+    '''
+    data = np.frombuffer(''.join(seqs), dtype=np.uint8)
+    total = np.bincount(data, minlength=256)
+    values = np.flatnonzero(total)
+    if len(seqs) == 1:
+        return values, total[values].reshape(1, len(values)).astype(np.int64)
+    codes = np.zeros(256, dtype=np.int64)
+    codes[values] = np.arange(len(values))
+    lengths = np.fromiter((len(seq) for seq in seqs), dtype=np.int64, count=len(seqs))
+    keys = np.repeat(np.arange(len(seqs), dtype=np.int64) * len(values), lengths) + codes[data]
+    counts = np.bincount(keys, minlength=len(values) * len(seqs))
+    return values, counts.reshape(len(seqs), len(values)).astype(np.int64)
+
+
+def _codes(chars):
+    '''
+    returns: an array of the byte values of chars, in upper and lower case.
+    '''
+    return np.array(sorted(set(ord(c) for c in chars.upper() + chars.lower())), dtype=np.intp)
+
+
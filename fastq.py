@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+'''
+Reading and writing FASTQ files of sequencing reads.
+
+A FASTQ record is four lines: a nameline starting with '@', the sequence, a
+line starting with '+' (optionally repeating the name), and the quality
+string, one character per base.  Sequences and qualities wrapped over several
+lines are not supported, as almost no tools write them.
+
+Like fasta.readFasta(), reading is done in large blocks that are split into
+lines with a single str.split() call, rather than reading line by line, so
+reading a record costs little more than creating its strings.  Paths to
+compressed files are decompressed transparently, see fasta.openFasta().
+
+Quality strings can be decoded into numpy uint8 arrays of phred scores.
+numpy is only imported when quality arrays are asked for.
+
+Usage:
+
+    for nameline, seq, qual in readFastq('reads.fq.gz', qualityArrays=True):
+        if qual.mean() >= 30:
+            ...
+    with FastqWriter('filtered.fq.gz', compression='gzip') as writer:
+        writer.write(nameline, seq, qual)
+'''
+
+import itertools
+
+import fasta
+
+
+# the offset of phred quality scores in quality strings, as used by Sanger and Illumina 1.8+.
+PHRED_OFFSET = 33
+
+
+def readFastq(fastqFile, strict=True, qualityArrays=False, offset=PHRED_OFFSET):
+    '''
+    fastqFile: a file-like object or a path to a fastq file, which may be compressed.
+    strict: if True, raise an exception for malformed records.  Otherwise malformed records are skipped.
+    qualityArrays: if True, qualities are yielded as numpy uint8 arrays of phred scores instead of strings.
+    offset: the phred offset of the quality strings, used when qualityArrays is True.
+    yields: a tuple of (nameline, seq, qual) for each record in the fastq file.  The nameline includes the '@'.
+    '''
+    if isinstance(fastqFile, basestring):
+        with fasta.openFasta(fastqFile) as fh:
+            for record in readFastq(fh, strict, qualityArrays, offset):
+                yield record
+    elif qualityArrays:
+        for nameline, seq, qual in _fastqRecordIter(fastqFile, strict):
+            yield nameline, seq, decodeQuality(qual, offset)
+    else:
+        for record in _fastqRecordIter(fastqFile, strict):
+            yield record
+
+
+def readFastqAsFasta(fastqFile, strict=True):
+    '''
+    yields: a tuple of (nameline, seq) for each record in the fastq file, with a fasta nameline starting with '>', so
+    reads can be passed to functions that take the output of fasta.readFasta().
+    '''
+    for nameline, seq, qual in readFastq(fastqFile, strict):
+        yield '>' + nameline[1:], seq
+
+
+def decodeQuality(qual, offset=PHRED_OFFSET):
+    '''
+    qual: a quality string.
+    returns: a numpy uint8 array of the phred score of each base.
+    '''
+    np = _numpy()
+    return np.frombuffer(qual, dtype=np.uint8) - np.uint8(offset)
+
+
+def encodeQuality(scores, offset=PHRED_OFFSET):
+    '''
+    scores: an array or sequence of phred scores.
+    returns: the quality string of the scores.
+    '''
+    np = _numpy()
+    return (np.asarray(scores, dtype=np.uint8) + np.uint8(offset)).tostring()
+
+
+class FastqWriter(fasta.FastaWriter):
+    '''
+    Writes (nameline, seq, qual) records, e.g. the tuples yielded by readFastq(), to a fastq file, with the same
+    buffering and compression as fasta.FastaWriter.
+    '''
+    def __init__(self, fastqFile, bufferSize=fasta.BLOCK_SIZE, compression=None, offset=PHRED_OFFSET):
+        '''
+        fastqFile: a file-like object or a path to a fastq file.  A path is opened for writing and closed by close().
+        compression: how to compress a path on the fly: None, 'gzip', 'bgzf', 'bz2' or 'xz'.
+        offset: the phred offset used to encode qualities given as arrays of scores.
+        '''
+        fasta.FastaWriter.__init__(self, fastqFile, width=None, bufferSize=bufferSize, compression=compression)
+        self.offset = offset
+
+    def write(self, nameline, seq, qual):
+        '''
+        nameline: a fastq nameline, with or without the '@' and newline.
+        seq: the sequence of the read.
+        qual: the quality string of the read, or an array of phred scores.  It must be as long as seq.
+        '''
+        if not isinstance(qual, basestring):
+            qual = encodeQuality(qual, self.offset)
+        if len(qual) != len(seq):
+            raise Exception('FASTQ error: sequence and quality lengths differ.', nameline)
+        if not nameline.startswith('@'):
+            self.buffer.append('@')
+        self.buffer.extend((nameline.rstrip('\n'), '\n', seq, '\n+\n', qual, '\n'))
+        self.bufferedSize += len(nameline) + 2 * len(seq)
+        if self.bufferedSize >= self.bufferSize:
+            self.flush()
+
+    def writeAll(self, reads):
+        '''
+        reads: an iterable of (nameline, seq, qual) tuples.
+        '''
+        for nameline, seq, qual in reads:
+            self.write(nameline, seq, qual)
+
+
+def writeFastq(reads, fastqFile, compression=None):
+    '''
+    reads: an iterable of (nameline, seq, qual) tuples, like readFastq() yields.
+    fastqFile: a file-like object or a path to a fastq file.
+    '''
+    with FastqWriter(fastqFile, compression=compression) as writer:
+        writer.writeAll(reads)
+
+
+def _fastqRecordIter(filehandle, strict=True, blockSize=fasta.BLOCK_SIZE):
+    '''
+    yields: a tuple of (nameline, seq, qual) for each record in filehandle.
+    '''
+    for lines in _readLineGroups(filehandle, strict, blockSize):
+        for nameline, seq, plus, qual in itertools.izip(lines[0::4], lines[1::4], lines[2::4], lines[3::4]):
+            if nameline[:1] == '@' and plus[:1] == '+' and len(seq) == len(qual):
+                yield nameline, seq, qual
+            elif strict:
+                raise Exception('FASTQ error: malformed record.', nameline)
+
+
+def _readLineGroups(filehandle, strict=True, blockSize=fasta.BLOCK_SIZE):
+    '''
+    Reads filehandle in large blocks and splits them into lines.
+    yields: a list of the lines, without line endings, of the complete records in each block.  Each list has a
+    multiple of 4 lines.  Blank lines at the end of the file are ignored.  If the last record is incomplete, it is
+    skipped, or if strict is True, an exception is raised.
+    '''
+    partial = '' # the start of a line continuing into the next block
+    crlf = False # the file has windows line endings
+    pending = [] # the lines of a record continuing into the next block
+    for block in fasta._readBlocks(filehandle, blockSize):
+        lines = block.split('\n')
+        lines[0] = partial + lines[0]
+        partial = lines.pop()
+        if pending:
+            lines = pending + lines
+        crlf = crlf or '\r' in block
+        if crlf:
+            lines = [line.rstrip('\r') for line in lines]
+        end = len(lines) - len(lines) % 4
+        pending = lines[end:]
+        del lines[end:]
+        if lines:
+            yield lines
+    lines = pending + [partial.rstrip('\r')]
+    while lines and not lines[-1]:
+        lines.pop()
+    if len(lines) % 4 and strict:
+        raise Exception('FASTQ error: incomplete record at the end of the file.', lines[0])
+    del lines[len(lines) - len(lines) % 4:]
+    if lines:
+        yield lines
+
+
+def _numpy():
+    import numpy
+    return numpy
+
+
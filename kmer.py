@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+'''
+Counting k-mers and sketching sequences with numpy.
+
+A k-mer is packed into an unsigned 64 bit integer key, with the first residue
+in the highest bits.  Nucleotides are packed into 2 bits each (A=0, C=1,
+G=2, T=3), so k can be up to 31, and amino acids into 5 bits each, so k can
+be up to 12.  The keys of all the k-mers of a sequence are computed at once
+with numpy, shifting and or-ing k offset views of the residue codes, instead
+of slicing substrings in a python loop.  K-mers containing characters not in
+the alphabet (e.g. N, X, *) are skipped.
+
+Counts are made by sorting the keys of large batches of k-mers, or, when
+there are few enough possible k-mers, by counting directly into a table
+indexed by key.
+
+Sketches summarize a sequence by a small set of hashed k-mers, for quickly
+estimating how similar sequences are before aligning them:
+- minHash() keeps the smallest hashes of all the k-mers (a bottom-k MinHash
+  sketch), and jaccard() estimates the k-mer Jaccard similarity of two
+  sequences from their sketches.
+- minimizers() keeps the k-mer with the smallest hash in every window of w
+  consecutive k-mers.
+
+Usage:
+
+    keys, counts = countKmers((seq for nameline, seq in fasta.readFasta('genome.fa')), 21, canonical=True)
+    print decodeKmer(keys[counts.argmax()], 21)
+    sketches = dict(minHashFasta('proteome.fa', 5, alphabet=AMINO_ACIDS))
+'''
+
+import numpy as np
+
+import fasta
+from fastastats import NUCLEOTIDES, AMINO_ACIDS
+
+
+# the number of k-mers counted in each batch.
+BATCH_SIZE = 2**24
+# count with a table indexed by key when there are at most this many possible k-mers.
+MAX_TABLE_SIZE = 2**24
+
+_UINT64_ZERO = np.zeros(0, dtype=np.uint64)
+_tables = {} # alphabet => lookup table from byte value to residue code, or -1
+
+
+def kmerKeys(seq, k, alphabet=NUCLEOTIDES, canonical=False):
+    '''
+    seq: a sequence string.
+    k: the length of the k-mers.
+    alphabet: the residues, in order of their codes, e.g. NUCLEOTIDES or AMINO_ACIDS.  Case is ignored.
+    canonical: if True, the key of a nucleotide k-mer is the smaller of the keys of the k-mer and its reverse
+      complement, so a k-mer and its reverse complement count as the same k-mer.
+    returns: a uint64 array of the keys of the k-mers of seq, in order, skipping k-mers that contain characters not in
+    the alphabet.
+    '''
+    return _kmerKeys(seq, k, alphabet, canonical)[0]
+
+
+def encodeKmer(kmer, alphabet=NUCLEOTIDES):
+    '''
+    returns: the key of the k-mer string kmer.
+    '''
+    keys = kmerKeys(kmer, len(kmer), alphabet)
+    if len(keys) != 1:
+        raise Exception('kmer error: k-mer contains characters not in the alphabet.', kmer)
+    return int(keys[0])
+
+
+def decodeKmer(key, k, alphabet=NUCLEOTIDES):
+    '''
+    returns: the k-mer string of key.
+    '''
+    bits = _bits(alphabet)
+    key = int(key)
+    return ''.join(alphabet[(key >> (bits * i)) & ((1 << bits) - 1)] for i in xrange(k - 1, -1, -1))
+
+
+def countKmers(seqs, k, alphabet=NUCLEOTIDES, canonical=False, batchSize=BATCH_SIZE):
+    '''
+    seqs: an iterable of sequence strings.
+    k, alphabet, canonical: see kmerKeys().
+    batchSize: the number of k-mers to count at a time.  Larger batches mean fewer numpy calls, but use 8 bytes of
+      memory per k-mer.
+    returns: a tuple of (keys, counts), a sorted uint64 array of the distinct k-mer keys in seqs and an int64 array of
+    the number of times each one occurs.
+    '''
+    _checkK(k, alphabet)
+    tableSize = 2 ** (_bits(alphabet) * k)
+    if tableSize <= MAX_TABLE_SIZE:
+        table = np.zeros(tableSize, dtype=np.int64)
+        for keys in _keyBatches(seqs, k, alphabet, canonical, batchSize):
+            table += np.bincount(keys.astype(np.intp), minlength=tableSize)
+        keys = np.flatnonzero(table)
+        return keys.astype(np.uint64), table[keys]
+    # count each batch, then merge the counts of all batches with one sort, instead of re-sorting the merged keys
+    # for every batch.
+    batchKeys = [_UINT64_ZERO]
+    batchCounts = [np.zeros(0, dtype=np.int64)]
+    for keys in _keyBatches(seqs, k, alphabet, canonical, batchSize):
+        keys, counts = np.unique(keys, return_counts=True)
+        batchKeys.append(keys)
+        batchCounts.append(counts)
+    return _mergeCounts(batchKeys, batchCounts)
+
+
+def countFastaKmers(fastaFile, k, alphabet=NUCLEOTIDES, canonical=False, strict=True):
+    '''
+    fastaFile: a file-like object or a path to a fasta file, which may be compressed.
+    returns: the (keys, counts) of the k-mers of all the sequences in fastaFile.  See countKmers().
+    '''
+    return countKmers((seq for nameline, seq in fasta.readFasta(fastaFile, strict)), k, alphabet, canonical)
+
+
+def minHash(seq, k, size=128, alphabet=NUCLEOTIDES, canonical=False, seed=0):
+    '''
+    seq: a sequence string.
+    size: the maximum number of hashes in the sketch.
+    seed: sketches made with different seeds use different hash functions.
+    returns: a sorted uint64 array of the smallest size distinct hashes of the k-mers of seq.
+    '''
+    return np.unique(hashKeys(kmerKeys(seq, k, alphabet, canonical), seed))[:size]
+
+
+def minHashFasta(fastaFile, k, size=128, alphabet=NUCLEOTIDES, canonical=False, seed=0, strict=True):
+    '''
+    yields: a tuple of (nameline, sketch) of the minHash() sketch of every sequence in fastaFile.
+    '''
+    for nameline, seq in fasta.readFasta(fastaFile, strict):
+        yield nameline, minHash(seq, k, size, alphabet, canonical, seed)
+
+
+def jaccard(sketch1, sketch2, size=None):
+    '''
+    sketch1, sketch2: minHash() sketches made with the same k and seed.
+    size: the sketch size.  Defaults to the size of the larger sketch.
+    returns: an estimate of the Jaccard similarity of the sets of k-mers of the two sequences, i.e. the number of
+    k-mers they share divided by the number of distinct k-mers in either one.
+    '''
+    if size is None:
+        size = max(len(sketch1), len(sketch2))
+    union = np.union1d(sketch1, sketch2)[:size]
+    if not len(union):
+        return 0.0
+    shared = np.intersect1d(np.intersect1d(sketch1, sketch2, assume_unique=True), union, assume_unique=True)
+    return len(shared) / float(len(union))
+
+
+def minimizers(seq, k, w, alphabet=NUCLEOTIDES, canonical=False, seed=0):
+    '''
+    seq: a sequence string.
+    w: the number of consecutive k-mers in each window.
+    returns: a tuple of (positions, hashes), int64 and uint64 arrays of the position in seq and the hash of the k-mer
+    with the smallest hash in each window of w consecutive k-mers, without repeating a k-mer that is the minimizer of
+    several windows.  Ties are broken by taking the leftmost k-mer.  Windows span w consecutive valid k-mers, skipping
+    over k-mers that contain characters not in the alphabet.
+    '''
+    keys, positions = _kmerKeys(seq, k, alphabet, canonical)
+    hashes = hashKeys(keys, seed)
+    if len(hashes) == 0:
+        return positions, hashes
+    w = min(w, len(hashes))
+    windows = np.lib.stride_tricks.as_strided(hashes, shape=(len(hashes) - w + 1, w),
+                                              strides=(hashes.strides[0], hashes.strides[0]))
+    chosen = np.unique(np.arange(len(windows)) + windows.argmin(axis=1))
+    return positions[chosen], hashes[chosen]
+
+
+def hashKeys(keys, seed=0):
+    '''
+    keys: a uint64 array of k-mer keys.
+    returns: a uint64 array of a hash of each key, using the splitmix64 finalizer, which spreads keys evenly over
+    all 64 bit values.
+    '''
+    x = keys ^ np.uint64(seed)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+def _kmerKeys(seq, k, alphabet, canonical):
+    '''
+    returns: a tuple of (keys, positions), the kmerKeys() of seq and an int64 array of the position of each k-mer.
+    '''
+    _checkK(k, alphabet)
+    if canonical and alphabet.upper() != NUCLEOTIDES:
+        raise Exception('kmer error: canonical k-mers need the nucleotide alphabet.', alphabet)
+    n = len(seq) - k + 1
+    if n <= 0:
+        return _UINT64_ZERO, np.zeros(0, dtype=np.int64)
+    bits = np.uint64(_bits(alphabet))
+    codes = _table(alphabet)[np.frombuffer(seq, dtype=np.uint8)]
+    invalid = codes < 0
+    codes = np.where(invalid, 0, codes).astype(np.uint64)
+    keys = np.zeros(n, dtype=np.uint64)
+    for i in xrange(k):
+        keys <<= bits
+        keys |= codes[i:i + n]
+    if canonical:
+        # the complement of code c is 3 - c, and the reverse complement puts the complement of residue i at position
+        # k - 1 - i.
+        reverse = np.zeros(n, dtype=np.uint64)
+        for i in xrange(k):
+            reverse |= (np.uint64(3) - codes[i:i + n]) << (bits * np.uint64(i))
+        keys = np.minimum(keys, reverse)
+    # a k-mer is valid if the number of invalid residues before its start and before its end are the same.
+    numInvalid = np.concatenate(([0], np.cumsum(invalid)))
+    valid = np.flatnonzero(numInvalid[k:] == numInvalid[:n])
+    return keys[valid], valid.astype(np.int64)
+
+
+def _keyBatches(seqs, k, alphabet, canonical, batchSize):
+    '''
+    yields: uint64 arrays of the keys of the k-mers of seqs, about batchSize at a time.
+    '''
+    batch = []
+    size = 0
+    for seq in seqs:
+        keys = kmerKeys(seq, k, alphabet, canonical)
+        batch.append(keys)
+        size += len(keys)
+        if size >= batchSize:
+            yield np.concatenate(batch)
+            batch = []
+            size = 0
+    if batch:
+        yield np.concatenate(batch)
+
+
+def _mergeCounts(keysList, countsList):
+    '''
+    keysList, countsList: lists of arrays of sorted distinct keys and their counts.
+    returns: the (keys, counts) of the union of the sets of keys, adding the counts of keys in more than one.
+    '''
+    keys = np.concatenate(keysList)
+    counts = np.concatenate(countsList)
+    if len(keysList) == 1 or not len(keys):
+        return keys, counts
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], np.add.reduceat(counts[order], starts)
+
+
+def _table(alphabet):
+    if alphabet not in _tables:
+        table = np.full(256, -1, dtype=np.int64)
+        for code, residue in enumerate(alphabet):
+            table[ord(residue.upper())] = table[ord(residue.lower())] = code
+        _tables[alphabet] = table
+    return _tables[alphabet]
+
+
+def _bits(alphabet):
+    '''
+    returns: the number of bits needed to pack a residue code of alphabet.
+    '''
+    return max(1, (len(alphabet) - 1).bit_length())
+
+
+def _checkK(k, alphabet):
+    # one spare bit keeps keys below 2**63.
+    if not 0 < k <= 63 // _bits(alphabet):
+        raise Exception('kmer error: k is out of range for the alphabet.', k, 63 // _bits(alphabet))
+
+
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+
+'''
+A compact in-memory store for all the sequences of a fasta database.
+
+Loading a database with list(fasta.readFasta(path)) costs two string objects
+and a tuple per sequence, which adds up to far more than the sequences
+themselves for a proteome with millions of short sequences.  A SequenceStore
+keeps all the sequence characters in one string and all the namelines in
+another, with arrays of offsets into them, so the per-sequence overhead is a
+few machine words plus an interned id.
+
+Since the store is a handful of large objects, it pickles quickly, and worker
+processes forked after it is built share its memory read-only.  save() writes
+it to a file that load() can mmap, so several processes can share one copy
+through the page cache.
+
+Usage:
+
+    store = SequenceStore.fromFasta('proteome.fa')
+    seq = store.seq('P12345')
+    nameline, seq = store[0]
+    store.save('proteome.store')
+    store = SequenceStore.load('proteome.store')
+'''
+
+import array
+import cStringIO
+import mmap
+import struct
+
+import fasta
+
+
+# file format: magic, number of sequences, then the sizes of the ids, namelines and residues strings.
+_HEADER = struct.Struct('<8sQQQQ')
+_MAGIC = 'SEQSTOR1'
+
+
+class SequenceStore(object):
+    '''
+    An immutable, indexable collection of (nameline, seq) tuples.
+    '''
+    def __init__(self, ids, namelines, nameOffsets, residues, seqOffsets, residuesStart=0):
+        '''
+        Use fromFasta(), fromSeqs() or load() to make a SequenceStore.
+        ids: a list of the id of each sequence.
+        namelines: a string of all the namelines concatenated together.
+        nameOffsets: an array of len(ids) + 1 offsets.  nameline i is namelines[nameOffsets[i]:nameOffsets[i+1]].
+        residues: a string, or mmap, containing all the sequences concatenated together.
+        seqOffsets: an array of len(ids) + 1 offsets.  sequence i is residues[seqOffsets[i]:seqOffsets[i+1]],
+          relative to residuesStart.
+        residuesStart: the position of the first sequence in residues.
+        '''
+        self.ids = ids
+        self.namelines = namelines
+        self.nameOffsets = nameOffsets
+        self.residues = residues
+        self.seqOffsets = seqOffsets
+        self.residuesStart = residuesStart
+        self.idToIndex = dict((id, i) for i, id in enumerate(ids))
+        if len(self.idToIndex) != len(ids):
+            raise Exception('SequenceStore error: duplicate ids.')
+
+    @classmethod
+    def fromFasta(cls, fastaFile, strict=True):
+        '''
+        fastaFile: a file-like object or a path to a fasta file.
+        Ids are parsed from namelines with fasta.idFromName().
+        '''
+        return cls.fromSeqs(fasta.readFasta(fastaFile, strict))
+
+    @classmethod
+    def fromSeqs(cls, seqs):
+        '''
+        seqs: an iterable of (nameline, seq) tuples, like fasta.readFasta() yields.
+        '''
+        # write the namelines and sequences into growing buffers as they are read, so each sequence string can be
+        # freed as soon as it is copied, instead of holding all of them until a final join.
+        ids = []
+        namelines = cStringIO.StringIO()
+        residues = cStringIO.StringIO()
+        nameOffsets = array.array('l', [0])
+        seqOffsets = array.array('l', [0])
+        for nameline, seq in seqs:
+            ids.append(intern(fasta.idFromName(nameline)))
+            namelines.write(nameline)
+            residues.write(seq)
+            nameOffsets.append(namelines.tell())
+            seqOffsets.append(residues.tell())
+        return cls(ids, namelines.getvalue(), nameOffsets, residues.getvalue(), seqOffsets)
+
+    @classmethod
+    def load(cls, path, useMmap=True):
+        '''
+        path: a file written by save().
+        useMmap: if True, the sequences are not read into memory, but mmapped, so the operating system pages them in
+          as they are used and shares them between processes.
+        '''
+        with open(path, 'rb') as fh:
+            magic, n, idsSize, namelinesSize, residuesSize = _HEADER.unpack(fh.read(_HEADER.size))
+            if magic != _MAGIC:
+                raise Exception('SequenceStore error: not a sequence store file.', path)
+            nameOffsets = array.array('l')
+            nameOffsets.fromfile(fh, n + 1)
+            seqOffsets = array.array('l')
+            seqOffsets.fromfile(fh, n + 1)
+            ids = [intern(id) for id in fh.read(idsSize).split('\n')] if n else []
+            namelines = fh.read(namelinesSize)
+            if useMmap and residuesSize:
+                residuesStart = fh.tell()
+                residues = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                residuesStart = 0
+                residues = fh.read(residuesSize)
+        return cls(ids, namelines, nameOffsets, residues, seqOffsets, residuesStart)
+
+    def save(self, path):
+        '''
+        Write the store to a file at path, which can be read with load().
+        '''
+        ids = '\n'.join(self.ids)
+        residuesSize = self.seqOffsets[-1]
+        with open(path, 'wb') as fh:
+            fh.write(_HEADER.pack(_MAGIC, len(self), len(ids), len(self.namelines), residuesSize))
+            self.nameOffsets.tofile(fh)
+            self.seqOffsets.tofile(fh)
+            fh.write(ids)
+            fh.write(self.namelines)
+            fh.write(self.residues[self.residuesStart:self.residuesStart + residuesSize])
+
+    def __getstate__(self):
+        # the id lookup is rebuilt when unpickled, and an mmap is pickled as a string.
+        state = self.__dict__.copy()
+        del state['idToIndex']
+        state['residues'] = self.residues[self.residuesStart:self.residuesStart + self.seqOffsets[-1]]
+        state['residuesStart'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.idToIndex = dict((id, i) for i, id in enumerate(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.idToIndex
+
+    def __iter__(self):
+        '''
+        yields: a (nameline, seq) tuple for each sequence, in order.
+        '''
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __getitem__(self, i):
+        '''
+        i: the index of a sequence, or a slice.
+        returns: the (nameline, seq) tuple of sequence i, or a list of them for a slice.
+        '''
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('SequenceStore index out of range', i)
+        return self.namelines[self.nameOffsets[i]:self.nameOffsets[i+1]], self._slice(i, 0, None)
+
+    def index(self, id):
+        '''
+        returns: the index of the sequence with the given id.  Raises a KeyError if there is none.
+        '''
+        return self.idToIndex[id]
+
+    def nameline(self, id):
+        i = self.idToIndex[id]
+        return self.namelines[self.nameOffsets[i]:self.nameOffsets[i+1]]
+
+    def length(self, id):
+        i = self.idToIndex[id]
+        return self.seqOffsets[i+1] - self.seqOffsets[i]
+
+    def seq(self, id, start=None, end=None):
+        '''
+        id: the id of a sequence.
+        start, end: slice indices, so seq(id, start, end) == seq(id)[start:end], but only the subsequence is copied.
+        returns: the sequence with the given id, or a subsequence of it.
+        '''
+        return self._slice(self.idToIndex[id], start, end)
+
+    def _slice(self, i, start, end):
+        seqStart = self.seqOffsets[i]
+        start, end, step = slice(start, end).indices(self.seqOffsets[i+1] - seqStart)
+        offset = self.residuesStart + seqStart
+        return self.residues[offset + start:offset + max(start, end)]
+
+
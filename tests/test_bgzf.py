@@ -0,0 +1,54 @@
+
+import os
+
+import bgzf
+import temps
+
+
+def writeBgzf(path, data, blockSize=bgzf.MAX_BLOCK_DATA):
+    with open(path, 'wb') as fh:
+        for i in range(0, len(data), blockSize):
+            fh.write(bgzf.compressBlock(data[i:i + blockSize]))
+        fh.write(bgzf.compressBlock(''))
+
+
+def test_BgzfReader():
+    data = ''.join('line %s\n' % i for i in range(20000))
+    with temps.tmpfile() as path:
+        writeBgzf(path, data, 1000)
+        with open(path, 'rb') as fh:
+            assert bgzf.isBgzf(fh.read(18))
+        for numThreads in (1, 4):
+            with bgzf.BgzfReader(path, numThreads) as fh:
+                assert fh.read() == data
+                fh.seek(12345)
+                assert fh.read(100) == data[12345:12445]
+                assert fh.tell() == 12445
+                fh.seek(10, os.SEEK_CUR)
+                assert fh.read(5) == data[12455:12460]
+        with bgzf.BgzfReader(path) as fh:
+            assert list(fh) == data.splitlines(True)
+
+
+def test_gzi():
+    with temps.tmpfile() as path:
+        writeBgzf(path, 'x' * 2500, 1000)
+        index = bgzf.buildGzi(path)
+        assert [u for c, u in index] == [0, 1000, 2000, 2500]
+        with temps.tmpfile() as gziPath:
+            bgzf.writeGzi(index, gziPath)
+            assert bgzf.readGzi(gziPath) == index
+
+
+def test_BgzfWriter():
+    data = os.urandom(500000)
+    with temps.tmpfile() as path:
+        with temps.tmpfile() as gziPath:
+            with bgzf.BgzfWriter(path, numThreads=2, gziPath=gziPath) as fh:
+                for i in range(0, len(data), 7777):
+                    fh.write(data[i:i + 7777])
+            assert bgzf.readGzi(gziPath) == bgzf.buildGzi(path)
+        with bgzf.BgzfReader(path) as fh:
+            assert fh.read() == data
+
+
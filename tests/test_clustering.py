@@ -0,0 +1,196 @@
+
+import os
+import random
+
+import numpy as np
+
+import clustering
+import temps
+
+
+def canonical(clusterIdToNodes):
+    return sorted(sorted(nodes) for nodes in clusterIdToNodes.values())
+
+
+def randomEdges(seed, numNodes, numEdges):
+    rand = random.Random(seed)
+    return [('n%s' % rand.randrange(numNodes), 'n%s' % rand.randrange(numNodes), rand.random())
+            for i in range(numEdges)]
+
+
+def test_UnionFindClusterer():
+    for seed in range(50):
+        edges = randomEdges(seed, 40, 50)
+        expected = clustering.EdgeClusterer()
+        for edge in edges:
+            expected.cluster(edge)
+
+        clusterer = clustering.UnionFindClusterer(capacity=1)
+        for edge in edges:
+            clusterer.cluster(edge)
+        clusterIdToNodes, nodeIdToClusterId = clusterer.components()
+        assert canonical(clusterIdToNodes) == canonical(expected.clusterIdToNodes)
+        assert all(nodeId in clusterIdToNodes[clusterId] for nodeId, clusterId in nodeIdToClusterId.items())
+
+        # the bulk path, in two batches, with a distance column.
+        clusterer = clustering.UnionFindClusterer()
+        indices = clusterer.internMany(nodeId for edge in edges for nodeId in edge[:2]).reshape(-1, 2)
+        clusterer.clusterMany(indices[:20])
+        clusterer.clusterMany(np.column_stack((indices[20:], [edge[2] for edge in edges[20:]])))
+        assert canonical(clusterer.components()[0]) == canonical(expected.clusterIdToNodes)
+        roots = clusterer.roots()
+        assert (np.bincount(roots, minlength=len(roots))[roots] == clusterer.size[roots]).all()
+
+
+def test_UnionFindClusterer_labels():
+    clusterer = clustering.UnionFindClusterer(nodeIds=['a', 'b', 'c', 'd', 'e'])
+    clusterer.clusterMany(np.array([[4, 3], [1, 4]]))
+    numClusters, labels = clusterer.labels()
+    assert numClusters == 3
+    assert list(labels) == [1, 2, 3, 2, 2]
+    clusterer.cluster(('c', 'f'))
+    assert clusterer.components() == ({1: set(['a']), 2: set(['b', 'd', 'e']), 3: set(['c', 'f'])},
+                                      {'a': 1, 'b': 2, 'c': 3, 'd': 2, 'e': 2, 'f': 3})
+
+
+def clusterStats(clusterer):
+    return sorted((sorted(nodes), clusterer.clusterIdToNumEdges[clusterId],
+                   round(clusterer.clusterIdToSumDistances[clusterId], 6),
+                   sorted(clusterer.clusterIdToNodeClasses[clusterId]))
+                  for clusterId, nodes in clusterer.clusterIdToNodes.items())
+
+
+def test_EdgeClusterer_clusterMany():
+    classify = lambda nodeId: int(nodeId[1:]) % 3
+    for seed in range(50):
+        edges = randomEdges(seed, 40, 60)
+        expected = clustering.EdgeClusterer(classify)
+        for edge in edges:
+            expected.cluster(edge)
+
+        # a batch on top of incrementally clustered edges, then a batch of indices into a node id dictionary.
+        clusterer = clustering.EdgeClusterer(classify, storeEdges=True)
+        for edge in edges[:10]:
+            clusterer.cluster(edge)
+        fromNodes, toNodes, distances = zip(*edges[10:40])
+        clusterer.clusterMany(fromNodes, toNodes, distances)
+        nodeIds = sorted(set(nodeId for edge in edges[40:50] for nodeId in edge[:2]))
+        clusterer.clusterMany([nodeIds.index(edge[0]) for edge in edges[40:50]],
+                              [nodeIds.index(edge[1]) for edge in edges[40:50]],
+                              np.array([edge[2] for edge in edges[40:50]]), nodeIds=nodeIds)
+        # edges clustered one at a time between batches are seen by the next batch.
+        for edge in edges[50:55]:
+            clusterer.cluster(edge)
+        fromNodes, toNodes, distances = zip(*edges[55:])
+        clusterer.clusterMany(fromNodes, toNodes, distances)
+        assert clusterStats(clusterer) == clusterStats(expected)
+        assert all(clusterer.nodeIdToClusterId[nodeId] == clusterId
+                   for clusterId, nodes in clusterer.clusterIdToNodes.items() for nodeId in nodes)
+
+        clusterer = clustering.EdgeClusterer(classify, storeEdges=True)
+        clusterer.clusterMany(*zip(*edges))
+        assert clusterStats(clusterer) == clusterStats(expected)
+        assert sorted(edge for clusterEdges in clusterer.clusterIdToEdges.values() for edge in clusterEdges) == \
+            sorted(edges)
+
+
+def test_edgeFiles():
+    text = '# node1 node2 distance\nb a 1\na c 0.5\n\nd  e\t2e-3\nc b 1.25'
+    expected = list(clustering.linesEdgeGen(text.splitlines()))
+    with temps.tmpdir() as dirpath:
+        textPath = os.path.join(dirpath, 'edges.txt')
+        with open(textPath, 'w') as fh:
+            fh.write(text)
+        for blockSize in (1, 7, 1000):
+            nodeIds, fromIndices, toIndices, distances = clustering.loadEdges(textPath, blockSize)
+            assert [(nodeIds[i], nodeIds[j]) for i, j in zip(fromIndices, toIndices)] == [e[:2] for e in expected]
+            assert np.allclose(distances, [e[2] for e in expected])
+            assert fromIndices.dtype == np.int32 and distances.dtype == np.float32
+        assert nodeIds == ['a', 'b', 'c', 'd', 'e']
+
+        # ragged lines whose tokens add up to whole edges must not be regrouped into the wrong edges.
+        raggedPath = os.path.join(dirpath, 'ragged.txt')
+        with open(raggedPath, 'w') as fh:
+            fh.write('a b 1 2\nc 3\n')
+        for blockSize in (1, 1000):
+            try:
+                clustering.loadEdges(raggedPath, blockSize)
+            except ValueError:
+                pass
+            else:
+                assert False, blockSize
+
+        path = os.path.join(dirpath, 'edges.bin')
+        assert clustering.convertEdgeFile(textPath, path, blockSize=7) == 4
+        nodeIds2, fromIndices2, toIndices2, distances2 = clustering.readEdgeFile(path)
+        assert [(nodeIds2[i], nodeIds2[j], d) for i, j, d in zip(fromIndices2, toIndices2, distances2)] == \
+            [(nodeIds[i], nodeIds[j], d) for i, j, d in zip(fromIndices, toIndices, distances)]
+
+        clustering.writeEdgeFile(path, nodeIds, fromIndices, toIndices, distances, np.int64)
+        nodeIds2, fromIndices2, toIndices2, distances2 = clustering.readEdgeFile(path)
+        assert nodeIds2 == nodeIds and fromIndices2.dtype == np.int64
+        assert (fromIndices2 == fromIndices).all() and (toIndices2 == toIndices).all()
+        assert (distances2 == distances).all()
+        clusterer = clustering.EdgeClusterer()
+        clusterer.clusterMany(fromIndices2, toIndices2, distances2, nodeIds2)
+        assert sorted(clusterer.clusterIdToNodes.values()) == [set(['a', 'b', 'c']), set(['d', 'e'])]
+
+
+def test_clusterEdgeFiles():
+    rand = random.Random(0)
+    expected = clustering.EdgeClusterer()
+    with temps.tmpdir() as dirpath:
+        paths = []
+        for i in range(6):
+            edges = randomEdges(i, 100, rand.randint(0, 30))
+            for edge in edges:
+                expected.cluster(edge)
+            path = os.path.join(dirpath, 'shard%s.txt' % i)
+            with open(path, 'w') as fh:
+                fh.write(''.join('%s\t%s\t%s\n' % edge for edge in edges))
+            if i % 2:
+                clustering.convertEdgeFile(path, path + '.bin')
+                path += '.bin'
+            paths.append(path)
+        clusterIdToNodes, nodeIdToClusterId = clustering.clusterEdgeFiles(paths, numProcs=2)
+    assert canonical(clusterIdToNodes) == canonical(expected.clusterIdToNodes)
+    assert sorted(nodeIdToClusterId) == sorted(expected.nodeIdToClusterId)
+    assert all(nodeId in clusterIdToNodes[clusterId] for nodeId, clusterId in nodeIdToClusterId.items())
+
+
+def test_clusterEdgeFilesOutOfCore():
+    expected = clustering.EdgeClusterer()
+    with temps.tmpdir() as dirpath:
+        paths = []
+        for i in range(4):
+            edges = randomEdges(i, 80, 25)
+            for edge in edges:
+                expected.cluster(edge)
+            path = os.path.join(dirpath, 'shard%s.txt' % i)
+            with open(path, 'w') as fh:
+                fh.write(''.join('%s %s %s\n' % edge for edge in edges))
+            if i % 2:
+                clustering.convertEdgeFile(path, path + '.bin')
+                path += '.bin'
+            paths.append(path)
+        out = os.path.join(dirpath, 'clusters.txt')
+        numNodes, numClusters = clustering.clusterEdgeFilesOutOfCore(paths, out, numBuckets=3, batchSize=7,
+                                                                     tmpDir=dirpath)
+        clusterIdToNodes = {}
+        for nodeId, clusterId in clustering.readAssignments(out):
+            clusterIdToNodes.setdefault(clusterId, set()).add(nodeId)
+    assert numNodes == len(expected.nodeIdToClusterId)
+    assert numClusters == len(expected.clusterIdToNodes)
+    assert canonical(clusterIdToNodes) == canonical(expected.clusterIdToNodes)
+
+    # node ids of binary edge files can contain whitespace.
+    with temps.tmpdir() as dirpath:
+        path = os.path.join(dirpath, 'edges.bin')
+        clustering.writeEdgeFile(path, ['a b', 'a\tb', 'c', 'd e'], np.array([0, 1]), np.array([2, 3]),
+                                 np.array([1.0, 1.0]))
+        out = os.path.join(dirpath, 'clusters.txt')
+        assert clustering.clusterEdgeFilesOutOfCore([path], out, numBuckets=2, tmpDir=dirpath) == (4, 2)
+        clusterIdToNodes = {}
+        for nodeId, clusterId in clustering.readAssignments(out):
+            clusterIdToNodes.setdefault(clusterId, set()).add(nodeId)
+    assert canonical(clusterIdToNodes) == canonical({1: set(['a b', 'c']), 2: set(['a\tb', 'd e'])})
@@ -0,0 +1,43 @@
+
+import os
+import StringIO
+
+import dedupe
+import fasta
+import temps
+
+
+def test_dedupe():
+    seqs1 = [('>a', 'ACGT'), ('>b', 'GGGG'), ('>c', 'ACGT'), ('>d', 'TT')]
+    seqs2 = [('>e', 'GGGG'), ('>f', 'CC'), ('>g', 'ACGT')]
+    with temps.tmpdir() as dirpath:
+        paths = [os.path.join(dirpath, 'db1.fa'), os.path.join(dirpath, 'db2.fa')]
+        fasta.writeFasta(seqs1, paths[0])
+        fasta.writeFasta(seqs2, paths[1])
+        for memoryLimit in (1, 64, dedupe.MEMORY_LIMIT):
+            groups = dedupe.duplicateGroups(paths, memoryLimit, tmpDir=dirpath)
+            assert sorted(groups) == [[(0, 0), (0, 2), (1, 2)],
+                                      [(0, 1), (1, 0)]]
+            out = StringIO.StringIO()
+            mapping = StringIO.StringIO()
+            counts = dedupe.dedupe(paths, out, mapping, memoryLimit=memoryLimit,
+                                   tmpDir=dirpath)
+            assert counts == (7, 4)
+            assert list(fasta.readFasta(StringIO.StringIO(out.getvalue()))) == [
+                ('>a', 'ACGT'), ('>b', 'GGGG'), ('>d', 'TT'), ('>f', 'CC')]
+            assert mapping.getvalue() == 'c\ta\ne\tb\ng\ta\n'
+        assert sorted(os.listdir(dirpath)) == ['db1.fa', 'db2.fa']
+
+
+def test_RunSorter_fanIn():
+    entries = ['%04d' % ((i * 37) % 101) for i in range(101)]
+    with temps.tmpdir() as dirpath:
+        for fanIn in (2, 3, 64):
+            sorter = dedupe._RunSorter(4, 8, dirpath, fanIn=fanIn)
+            for entry in entries:
+                sorter.add(entry)
+            assert list(sorter) == sorted(entries)
+            assert len(sorter.runs) <= fanIn
+            for path in sorter.runs:
+                os.remove(path)
+        assert os.listdir(dirpath) == []
@@ -0,0 +1,427 @@
+
+import bz2
+import gzip
+import os
+import StringIO
+
+import bgzf
+import fasta
+import temps
+
+
+def test_readFasta_good():
+    text = fasta.TEST_FASTA['LONG_TEST']
+    seq = 'CTGA' * 26
+    expected = [('>ns|id|a long description', seq),
+                ('>ns|id2|a long description', seq)]
+    assert list(fasta.readFasta(StringIO.StringIO(text))) == expected
+
+
+def test_readFasta_strict():
+    for name in ('BLANK_IN_TEST', 'BLANK_START_TEST', 'DATA_START_TEST',
+                 'TWO_NAMELINES_TEST', 'TRAILING_NAMELINE_TEST'):
+        text = fasta.TEST_FASTA[name]
+        try:
+            list(fasta.readFasta(StringIO.StringIO(text)))
+        except Exception:
+            pass
+        else:
+            assert False, name
+
+
+def test_readFasta_matches_readFastaLines():
+    '''
+    readFasta parses whole records in bulk.  Check that it agrees with the
+    line-oriented readFastaLines on malformed input and odd whitespace.
+    '''
+    texts = fasta.TEST_FASTA.values() + [
+        '>a\r\nAC GT\r\nGG\r\n>b\nA\tC\n',
+        '>a\nACGT\n\n>b\nAC',
+        '>a\nACGT\n  \n>b\n>c\nAA\n',
+        '',
+    ]
+    for text in texts:
+        expected = []
+        for lines in fasta.readFastaLines(StringIO.StringIO(text), strict=False):
+            expected.append((lines[0].strip(),
+                             ''.join(l.strip() for l in lines[1:])))
+        actual = list(fasta.readFasta(StringIO.StringIO(text), strict=False))
+        assert actual == expected
+
+
+def test_readRecords_block_sizes():
+    '''
+    Records split across block boundaries are reassembled.
+    '''
+    text = ''.join(fasta.TEST_FASTA.values())
+    expected = list(fasta._readRecords(StringIO.StringIO(text)))
+    assert ''.join(expected) == text
+    for blockSize in (1, 2, 3, 7, 64):
+        records = fasta._readRecords(StringIO.StringIO(text), blockSize)
+        assert list(records) == expected
+    # iterables of lines work too.
+    lines = StringIO.StringIO(text).readlines()
+    assert list(fasta._readRecords(lines)) == expected
+
+
+def test_FastaIndex():
+    text = '>ns|id1|desc\nACGTA\nCGTAC\nGT\n>id2 desc\nTTTT\n>ns|id3\nGGG'
+    with temps.tmpfile() as path:
+        with open(path, 'w') as fh:
+            fh.write(text)
+        faiPath = fasta.buildIndex(path)
+        try:
+            with open(faiPath) as fh:
+                assert fh.read() == ('id1\t12\t13\t5\t6\n'
+                                     'id2\t4\t38\t4\t5\n'
+                                     'id3\t3\t51\t3\t4\n')
+            with fasta.FastaIndex(path) as index:
+                assert len(index) == 3
+                assert index.fetch('id1') == 'ACGTACGTACGT'
+                assert index.fetch('id1', 3, 11) == 'TACGTACG'
+                assert index.fetch('id1', -2) == 'GT'
+                assert index.fetch('id3') == 'GGG'
+                assert index.fetchMany(['id3', 'id1']) == [
+                    ('id3', 'GGG'), ('id1', 'ACGTACGTACGT')]
+        finally:
+            os.remove(faiPath)
+
+
+def test_buildIndex_ragged_lines():
+    with temps.tmpfile() as path:
+        with open(path, 'w') as fh:
+            fh.write('>id1\nACG\nACGT\nA\n')
+        try:
+            fasta.buildIndex(path, path + '.fai')
+        except Exception:
+            pass
+        else:
+            assert False
+        finally:
+            os.remove(path + '.fai')
+
+
+def test_readFasta_mmap():
+    text = '>id1 desc\nACGTACGT\n>id2\nAC\nGT\n>id3\nTT'
+    with temps.tmpfile() as path:
+        with open(path, 'w') as fh:
+            fh.write(text)
+        records = [(n, str(s)) for n, s in fasta.readFasta(path, useMmap=True)]
+        assert records == list(fasta.readFasta(path))
+        records = fasta.readFasta(path, useMmap=True)
+        nameline, seq = records.next()
+        assert isinstance(seq, buffer) # single line, not copied
+        assert str(seq) == 'ACGTACGT'
+        records.close() # closes the mmap
+        try:
+            str(seq)
+        except TypeError:
+            pass
+        else:
+            assert False
+        assert fasta.numSeqsInFastaDb(path) == 3
+        assert fasta.dbSizeInPath(path) == fasta.dbSize(text) == 14
+        with open(path, 'w') as fh:
+            pass
+        assert list(fasta.readFasta(path, useMmap=True)) == []
+        assert fasta.numSeqsInFastaDb(path) == 0
+
+
+def seqLength(nameline, seq):
+    return len(seq)
+
+
+def test_parallel():
+    text = ''.join('>ns|id%s|desc\n%s\n' % (i, 'ACGT' * i) for i in range(1, 50))
+    with temps.tmpfile() as path:
+        with open(path, 'w') as fh:
+            fh.write(text)
+        ranges = fasta.splitRanges(path, 7)
+        assert len(ranges) == 7
+        assert ''.join(text[start:end] for start, end in ranges) == text
+        assert all(text[start] == '>' for start, end in ranges)
+        assert fasta.parallelNumSeqs(path, 2) == 49
+        assert fasta.parallelDbSize(path, 2) == fasta.dbSize(text)
+        assert fasta.parallelIds(path, 2) == list(fasta.readIds(path))
+        lengths = [4 * i for i in range(1, 50)]
+        assert list(fasta.mapFasta(seqLength, path, 2)) == lengths
+        unordered = fasta.mapFasta(seqLength, path, 2, ordered=False)
+        assert sorted(unordered) == lengths
+    # compressed files can not be split into byte ranges.
+    with temps.tmpfile(suffix='.gz') as path:
+        with gzip.open(path, 'wb') as fh:
+            fh.write(text)
+        for func in (lambda: fasta.splitRanges(path, 7), lambda: list(fasta.mapFasta(seqLength, path, 2))):
+            try:
+                func()
+            except Exception as e:
+                assert e.args == ('splitRanges error: compressed input not supported', path)
+            else:
+                assert False
+
+
+def test_compressed():
+    text = ''.join('>id%s\n%s' % (i, fasta.prettySeq('ACGT' * i, 7))
+                   for i in range(1, 200))
+    expected = list(fasta.readFasta(StringIO.StringIO(text)))
+    with temps.tmpdir() as dirpath:
+        gzPath = os.path.join(dirpath, 'db.fa.gz')
+        with gzip.open(gzPath, 'wb') as fh:
+            fh.write(text)
+        bz2Path = os.path.join(dirpath, 'db.fa.bz2')
+        with open(bz2Path, 'wb') as fh:
+            fh.write(bz2.compress(text))
+        bgzfPath = os.path.join(dirpath, 'db.fa.bgz')
+        with open(bgzfPath, 'wb') as fh:
+            for i in range(0, len(text), 1000):
+                fh.write(bgzf.compressBlock(text[i:i + 1000]))
+            fh.write(bgzf.compressBlock(''))
+        for path in (gzPath, bz2Path, bgzfPath):
+            assert list(fasta.readFasta(path)) == expected
+            assert fasta.numSeqsInFastaDb(path) == 199
+            assert fasta.dbSizeInPath(path) == fasta.dbSize(text)
+        with fasta.FastaIndex(bgzfPath) as index:
+            assert os.path.exists(bgzfPath + '.gzi')
+            assert index.fetch('id150', 10, 20) == ('ACGT' * 150)[10:20]
+        try:
+            fasta.buildIndex(gzPath)
+        except Exception:
+            pass
+        else:
+            assert False
+
+
+def test_prettySeq():
+    assert fasta.prettySeq('ACGTACGTAC', 4) == 'ACGT\nACGT\nAC\n'
+    assert fasta.prettySeq(' ACGT\nACGT ', 4) == 'ACGT\nACGT\n'
+
+
+def test_FastaWriter():
+    seqs = [('>id1 desc', 'ACGT' * 20), ('id2', 'AC')]
+    out = StringIO.StringIO()
+    with fasta.FastaWriter(out, width=30) as writer:
+        writer.writeAll(seqs)
+    assert out.getvalue() == ('>id1 desc\n' + fasta.prettySeq('ACGT' * 20, 30) +
+                              '>id2\nAC\n')
+    with temps.tmpdir() as dirpath:
+        for compression in (None, 'gzip', 'bgzf', 'bz2'):
+            path = os.path.join(dirpath, 'db.fa')
+            fasta.writeFasta(seqs, path, compression=compression)
+            assert list(fasta.readFasta(path)) == [('>id1 desc', 'ACGT' * 20),
+                                                   ('>id2', 'AC')]
+
+
+def test_idRules():
+    assert fasta.ID_RULES['ncbi']('>ns|id1|desc') == 'id1'
+    assert fasta.ID_RULES['first']('>ns|id1|desc more') == 'ns|id1|desc'
+    jgi = fasta.getIdRule('jgi')
+    assert jgi('>jgi|Nemve1|248885|estExt_fgenesh1_pg.C_76820001') == '248885'
+    assert fasta.getIdRule(len) is len
+    text = '>ns|id1|desc\nACGT\n>id2 desc\nAC\nGT\n>ns|id3\nGGG'
+    assert list(fasta.readIds(StringIO.StringIO(text), idRule='first')) == [
+        'ns|id1|desc', 'id2', 'ns|id3']
+
+
+def test_readIdOffsets():
+    text = '>ns|id1|desc\nACGT\n>id2 desc\nAC\nGT\n>ns|id3\nGGG'
+    expected = [('id1', 0), ('id2', 18), ('id3', 34)]
+    assert list(fasta.readIdOffsets(StringIO.StringIO(text))) == expected
+    for blockSize in (1, 2, 5):
+        offsets = fasta._scanNamelines(StringIO.StringIO(text), blockSize)
+        assert [offset for offset, nameline in offsets] == [0, 18, 34]
+    assert fasta.idOffsetTable(StringIO.StringIO(text)) == dict(expected)
+    try:
+        fasta.idOffsetTable(StringIO.StringIO(text + '\n>id2\nA\n'))
+    except Exception:
+        pass
+    else:
+        assert False
+
+
+def test_extract():
+    text = '>ns|id1|desc\nACGT\nAC\n>id2 desc\nAC\n>ns|id3\nGGG\nG\n>id4\nT'
+    with temps.tmpfile() as path:
+        with open(path, 'w') as fh:
+            fh.write(text)
+        out = StringIO.StringIO()
+        assert fasta.extract(path, ['id4', 'id1', 'missing'], out) == 2
+        assert out.getvalue() == '>ns|id1|desc\nACGT\nAC\n>id4\nT\n'
+        out = StringIO.StringIO()
+        assert fasta.extract(StringIO.StringIO(text), ['ns|id3'], out,
+                             idRule='first') == 1
+        assert out.getvalue() == '>ns|id3\nGGG\nG\n'
+        faiPath = fasta.buildIndex(path)
+        try:
+            out = StringIO.StringIO()
+            assert fasta.extract(path, ['id4', 'id3'], out) == 2
+            assert out.getvalue() == '>ns|id3\nGGG\nG\n>id4\nT\n'
+            # both ways of extracting copy the same text.
+            for ids in (['id4'], ['id1', 'id2'], ['id2', 'id4'], ['missing']):
+                indexed = StringIO.StringIO()
+                scanned = StringIO.StringIO()
+                assert fasta.extract(path, ids, indexed, useIndex=True) == \
+                    fasta.extract(path, ids, scanned, useIndex=False)
+                assert indexed.getvalue() == scanned.getvalue()
+            # the index only has idFromName ids, so another id rule scans the file, or raises if the index is required.
+            out = StringIO.StringIO()
+            assert fasta.extract(path, ['ns|id3'], out, idRule='first') == 1
+            assert out.getvalue() == '>ns|id3\nGGG\nG\n'
+            try:
+                fasta.extract(path, ['ns|id3'], StringIO.StringIO(), idRule='first', useIndex=True)
+            except Exception:
+                pass
+            else:
+                assert False
+        finally:
+            os.remove(faiPath)
+
+
+def test_FastaReader_resume():
+    text = ''.join('>id%s\n%s' % (i, fasta.prettySeq('ACGT' * i, 5))
+                   for i in range(1, 30))
+    expected = list(fasta.readFasta(StringIO.StringIO(text)))
+    with temps.tmpdir() as dirpath:
+        for name, opener in (('db.fa', open), ('db.fa.gz', gzip.open)):
+            path = os.path.join(dirpath, name)
+            with opener(path, 'wb') as fh:
+                fh.write(text)
+            with fasta.FastaReader(path) as reader:
+                first = [reader.next() for i in range(10)]
+                checkpoint = reader.checkpoint()
+            assert checkpoint == (text.index('>id11\n'), 10)
+            with fasta.FastaReader(path, checkpoint=checkpoint) as reader:
+                assert first + list(reader) == expected
+                assert reader.checkpoint() == (len(text), 29)
+            ckptPath = os.path.join(dirpath, 'ckpt')
+            seqs = []
+            for i, nameline_seq in enumerate(
+                    fasta.readFastaCheckpointed(path, ckptPath, every=4)):
+                if i == 9: # crash while processing the 10th sequence
+                    break
+                seqs.append(nameline_seq)
+            assert fasta.loadCheckpoint(ckptPath) == (text.index('>id9\n'), 8)
+            seqs = seqs[:8] + list(fasta.readFastaCheckpointed(path, ckptPath))
+            assert seqs == expected
+            assert list(fasta.readFastaCheckpointed(path, ckptPath)) == []
+            os.remove(ckptPath)
+
+
+def test_sort():
+    seqs = [('>id%s' % i, 'ACGT'[i % 4] * (i * 7 % 11 + 1)) for i in range(40)]
+    text = ''.join('%s\n%s\n' % nameline_seq for nameline_seq in seqs)
+    with temps.tmpdir() as dirpath:
+        for memoryLimit in (1, 100, fasta.SORT_MEMORY_LIMIT):
+            out = StringIO.StringIO()
+            assert fasta.sort(StringIO.StringIO(text), out, memoryLimit=memoryLimit,
+                              tmpDir=dirpath) == 40
+            assert list(fasta.readFasta(StringIO.StringIO(out.getvalue()))) == \
+                sorted(seqs, key=lambda s: s[0][1:])
+            out = StringIO.StringIO()
+            fasta.sort(StringIO.StringIO(text), out, key='length',
+                       memoryLimit=memoryLimit, tmpDir=dirpath)
+            # sorting is stable.
+            assert list(fasta.readFasta(StringIO.StringIO(out.getvalue()))) == \
+                sorted(seqs, key=lambda s: len(s[1]))
+            assert os.listdir(dirpath) == []
+        out = StringIO.StringIO()
+        fasta.sort(StringIO.StringIO(text), out, key=lambda n, s: s[::-1],
+                   tmpDir=dirpath)
+        assert list(fasta.readFasta(StringIO.StringIO(out.getvalue()))) == \
+            sorted(seqs, key=lambda s: s[1][::-1])
+        assert fasta.sort(StringIO.StringIO(''), out, tmpDir=dirpath) == 0
+        # merge the runs of one record each a few at a time.
+        for fanIn in (2, 3, 5):
+            out = StringIO.StringIO()
+            assert fasta.sort(StringIO.StringIO(text), out, key='length', memoryLimit=1, tmpDir=dirpath,
+                              fanIn=fanIn) == 40
+            assert list(fasta.readFasta(StringIO.StringIO(out.getvalue()))) == \
+                sorted(seqs, key=lambda s: len(s[1]))
+            assert os.listdir(dirpath) == []
+
+
+def test_shard():
+    seqs = [('>id%s' % i, 'ACGT' * (i % 7 + 1)) for i in range(30)] + [('>big', 'A' * 200)]
+    text = ''.join('>%s\n%s' % (nameline[1:], fasta.prettySeq(seq, 10))
+                   for nameline, seq in seqs)
+    with temps.tmpdir() as dirpath:
+        path = os.path.join(dirpath, 'db.fa')
+        with open(path, 'w') as fh:
+            fh.write(text)
+        paths = [os.path.join(dirpath, 'shard%s.fa' % i) for i in range(3)]
+        for by, total in (('residues', 660), ('records', 31), ('bytes', len(text))):
+            for useIndex in (False, True):
+                loads = fasta.shard(path, paths, by, useIndex)
+                assert sum(loads) == total
+                sharded = []
+                for shardPath in paths:
+                    sharded.extend(fasta.readFasta(shardPath))
+                assert sorted(sharded) == sorted(seqs)
+            if by == 'records':
+                assert loads == [11, 10, 10]
+        # assigning the big sequence first balances the shards better.
+        assert fasta.shard(path, paths, 'residues', useIndex=True) == [220, 220, 220]
+        assert max(fasta.shard(path, paths, 'residues', useIndex=False)) > 220
+
+
+def test_AsyncFastaIndex():
+    seqs = [('>id%s' % i, 'ACGT'[i % 4] * (i + 1)) for i in range(100)]
+    with temps.tmpdir() as dirpath:
+        path = os.path.join(dirpath, 'db.fa')
+        fasta.writeFasta(seqs, path, width=7)
+        ids = ['id%s' % i for i in range(99, -1, -3)]
+        expected = [(id, dict((n[1:], s) for n, s in seqs)[id]) for id in ids]
+        with fasta.AsyncFastaIndex(path, numThreads=4) as index:
+            assert index.fetchAsync('id10', 2, 5).get() == 'GGG'
+            assert index.fetchMany(ids) == expected
+            results = []
+            index.fetchManyAsync(ids, callback=results.append).wait()
+            assert index.fetchManyAsync([]).get() == []
+        assert results == [expected]
+        # the readers of the pool threads decompress bgzipped files in their own thread.
+        bgzPath = os.path.join(dirpath, 'db.fa.gz')
+        with bgzf.BgzfWriter(bgzPath) as fh:
+            fh.write(open(path).read())
+        with fasta.AsyncFastaIndex(bgzPath, numThreads=4) as index:
+            assert index.fetchMany(ids) == expected
+            assert all(threadIndex.fh.numThreads == 1 for threadIndex in index.threadIndexes)
+        assert list(fasta.readFastaInBackground(path, batchSize=7)) == seqs
+        # stopping early does not leave the reader blocked.
+        records = fasta.readFastaInBackground(path, batchSize=1, maxBatches=1)
+        assert records.next() == seqs[0]
+        records.close()
+
+
+def test_readFastaRecords():
+    text = '>ns|id1|desc\r\nAC GT\r\nGG\r\n>id2\nACGT\nA\n>id3\nT\n\nA\n'
+    records = list(fasta.readFastaRecords(StringIO.StringIO(text)))
+    assert [r.id for r in records] == ['id1', 'id2', 'id3']
+    assert [r.nameline for r in records] == ['>ns|id1|desc', '>id2', '>id3']
+    assert [r.offset for r in records] == [0, 25, 37]
+    assert [r.length for r in records] == [7, 5, 2]
+    assert not hasattr(records[0], '__dict__')
+    assert records[0].seq == 'AC GTGG'
+    nameline, seq = records[1]
+    assert (nameline, seq) == ('>id2', 'ACGTA')
+    assert records[1].seq is seq
+    try:
+        records[2].seq # blank line in the sequence
+    except Exception:
+        pass
+    else:
+        assert False
+    for name in ('DATA_START_TEST', 'TRAILING_NAMELINE_TEST'):
+        try:
+            list(fasta.readFastaRecords(StringIO.StringIO(fasta.TEST_FASTA[name])))
+        except Exception:
+            pass
+        else:
+            assert False, name
+    text = fasta.TEST_FASTA['LONG_TEST']
+    assert [tuple(r) for r in fasta.readFastaRecords(StringIO.StringIO(text))] == \
+        list(fasta.readFasta(StringIO.StringIO(text)))
+    # non-strict mode skips the same malformed records readFasta() does
+    text = '>a\nAC\n\nGT\n>b\nAA\n>c\nA \n \nT\n'
+    assert [tuple(r) for r in fasta.readFastaRecords(StringIO.StringIO(text), strict=False)] == \
+        list(fasta.readFasta(StringIO.StringIO(text), strict=False)) == [('>b', 'AA')]
+
+
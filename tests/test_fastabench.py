@@ -0,0 +1,45 @@
+
+import os
+
+import fasta
+import fastabench
+import temps
+
+
+def test_generateFasta():
+    with temps.tmpdir() as dirpath:
+        path = os.path.join(dirpath, 'bench.fa')
+        stats = fastabench.generateFasta(path, 50000, width=50, meanLength=100, distribution='uniform', seed=1)
+        assert stats['bytes'] == os.path.getsize(path) >= 50000
+        assert stats['malformed'] == 0
+        seqs = list(fasta.readFasta(path))
+        assert len(seqs) == stats['records']
+        assert all(1 <= len(seq) <= 199 and set(seq) <= set('ACGT') for nameline, seq in seqs)
+        with open(path) as fh:
+            assert max(len(line) for line in fh if line[0] != '>') == 51
+        # the same seed makes the same file.
+        path2 = os.path.join(dirpath, 'bench2.fa')
+        fastabench.generateFasta(path2, 50000, width=50, meanLength=100, distribution='uniform', seed=1)
+        assert open(path).read() == open(path2).read()
+
+        stats = fastabench.generateFasta(path, 50000, distribution='fixed', malformedRate=0.2, seed=2)
+        assert stats['malformed'] > 0
+        assert len(list(fasta.readFasta(path, strict=False))) == stats['records']
+        # variants are well-formed.
+        stats = fastabench.generateFasta(path, 50000, distribution='fixed', seed=3, variantRate=0.2)
+        assert stats['malformed'] == 0 and stats['variants'] > 0
+        assert len(list(fasta.readFasta(path))) == stats['records']
+
+
+def test_runBenchmarks():
+    with temps.tmpdir() as dirpath:
+        path = os.path.join(dirpath, 'bench.fa')
+        stats = fastabench.generateFasta(path, 20000)
+        results = fastabench.runBenchmarks(path, stats['records'], names=['readFasta', 'readIds'], repeat=1)
+        assert sorted(results) == ['readFasta', 'readIds']
+        assert results['readFasta']['mbPerSec'] > 0
+        assert results['readFasta']['recordsPerSec'] > 0
+
+    baseline = {'readFasta': {'mbPerSec': 100.0}, 'readIds': {'mbPerSec': 100.0}, 'dbSizeInPath': {'mbPerSec': 1.0}}
+    results = {'readFasta': {'mbPerSec': 95.0}, 'readIds': {'mbPerSec': 80.0}}
+    assert fastabench.compareToBaseline(results, baseline, tolerance=0.1) == [('readIds', 100.0, 80.0)]
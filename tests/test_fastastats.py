@@ -0,0 +1,55 @@
+
+import StringIO
+
+import numpy as np
+
+import fastastats
+import temps
+
+
+TEXT = '>s1\nACGTACGTNN\n>s2\nGGGCCC\n>s3\nAATTRY\nacgt\n>s4\nNNNN\n'
+
+
+def test_recordStats():
+    stats = fastastats.recordStats(StringIO.StringIO(TEXT))
+    assert list(stats['lengths']) == [10, 6, 10, 4]
+    assert list(stats['ambiguous']) == [2, 0, 2, 4]
+    assert np.allclose(stats['gc'][:3], [0.5, 1.0, 0.25])
+    assert np.isnan(stats['gc'][3])
+    assert stats['composition'][ord('N')] == 6
+    assert stats['composition'].sum() == 30
+    small = fastastats.recordStats(StringIO.StringIO(TEXT))
+    with temps.tmpfile() as path:
+        with open(path, 'w') as fh:
+            fh.write(TEXT * 20)
+        parallel = fastastats.recordStats(path, numProcs=2)
+    assert list(parallel['lengths']) == list(small['lengths']) * 20
+    assert list(parallel['composition']) == list(small['composition'] * 20)
+
+
+def test_residueCounts_batches():
+    seqs = ['ACGT', 'AAAA', 'TT', 'GGGGGGGG']
+    for batchSize in (1, 5, 100):
+        counts = np.concatenate(list(fastastats.residueCounts(seqs, batchSize)))
+        assert counts.shape == (4, 256)
+        assert counts[3, ord('G')] == 8
+        assert list(counts.sum(axis=1)) == [4, 4, 2, 8]
+
+
+def test_nx():
+    assert fastastats.nx([2, 3, 4, 5, 6, 7, 8, 9, 10]) == (8, 3)
+    assert fastastats.nx([10]) == (10, 1)
+    assert fastastats.nx([]) == (0, 0)
+    assert fastastats.nx([1, 1, 1, 1], 90) == (1, 4)
+
+
+def test_summarize():
+    summary = fastastats.summarize(StringIO.StringIO(TEXT))
+    assert summary['numSeqs'] == 4
+    assert summary['totalLength'] == 30
+    assert summary['n50'] == 10 and summary['l50'] == 2
+    assert summary['ambiguous'] == 8
+    assert summary['composition']['N'] == 6
+    assert abs(summary['gc'] - 12 / 22.0) < 1e-9
+
+
@@ -0,0 +1,60 @@
+
+import os
+import StringIO
+
+import numpy as np
+
+import fastq
+import temps
+
+
+TEXT = '@r1 desc\nACGT\n+\nIIII\n@r2\nAC\n+r2\n#5\n@r3\nTTTGA\n+\n!!!!I\n'
+READS = [('@r1 desc', 'ACGT', 'IIII'), ('@r2', 'AC', '#5'),
+         ('@r3', 'TTTGA', '!!!!I')]
+
+
+def test_readFastq():
+    assert list(fastq.readFastq(StringIO.StringIO(TEXT))) == READS
+    for blockSize in (1, 2, 3, 7, 64):
+        records = fastq._fastqRecordIter(StringIO.StringIO(TEXT), blockSize=blockSize)
+        assert list(records) == READS
+    crlf = TEXT.replace('\n', '\r\n') + '\r\n'
+    for blockSize in (1, 5, 64):
+        records = fastq._fastqRecordIter(StringIO.StringIO(crlf), blockSize=blockSize)
+        assert list(records) == READS
+    reads = list(fastq.readFastq(StringIO.StringIO(TEXT), qualityArrays=True))
+    assert reads[2][2].dtype == np.uint8
+    assert list(reads[2][2]) == [0, 0, 0, 0, 40]
+    assert fastq.encodeQuality(reads[1][2]) == '#5'
+    assert list(fastq.readFastqAsFasta(StringIO.StringIO(TEXT)))[1] == ('>r2', 'AC')
+
+
+def test_readFastq_strict():
+    for text in (TEXT[:-3], TEXT.replace('+r2', 'r2'), TEXT.replace('#5', '#')):
+        try:
+            list(fastq.readFastq(StringIO.StringIO(text)))
+        except Exception:
+            pass
+        else:
+            assert False, text
+    reads = fastq.readFastq(StringIO.StringIO(TEXT.replace('#5', '#')), strict=False)
+    assert list(reads) == [READS[0], READS[2]]
+
+
+def test_FastqWriter():
+    with temps.tmpdir() as dirpath:
+        path = os.path.join(dirpath, 'reads.fq')
+        for compression in (None, 'gzip', 'bgzf'):
+            with fastq.FastqWriter(path, compression=compression) as writer:
+                writer.write('r1 desc', 'ACGT', np.array([40, 40, 40, 40]))
+                writer.write('@r2', 'AC', '#5')
+            assert list(fastq.readFastq(path))[:2] == READS[:2]
+        fastq.writeFastq(READS, path)
+        with open(path) as fh:
+            assert fh.read() == TEXT.replace('+r2', '+')
+    out = StringIO.StringIO()
+    with fastq.FastqWriter(out) as writer:
+        writer.writeAll(READS)
+    assert out.getvalue() == TEXT.replace('+r2', '+')
+
+
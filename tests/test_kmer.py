@@ -0,0 +1,75 @@
+
+import collections
+import random
+
+import numpy as np
+
+import kmer
+
+
+def naiveCounts(seqs, k, alphabet):
+    counts = collections.Counter()
+    for seq in seqs:
+        for i in range(len(seq) - k + 1):
+            word = seq[i:i + k].upper()
+            if all(c in alphabet for c in word):
+                counts[word] += 1
+    return counts
+
+
+def test_kmerKeys():
+    assert kmer.encodeKmer('ACGT') == 0b00011011
+    assert kmer.decodeKmer(0b00011011, 4) == 'ACGT'
+    assert list(kmer.kmerKeys('ACGTNAC', 2)) == [0b0001, 0b0110, 0b1011, 0b0001]
+    word = 'ACGTTGCAACGGTACGATCGATCGGGCTAGC'
+    assert kmer.decodeKmer(kmer.encodeKmer(word.lower()), 31) == word
+    # a k-mer and its reverse complement have the same canonical key.
+    assert (kmer.kmerKeys('AACG', 4, canonical=True) ==
+            kmer.kmerKeys('CGTT', 4, canonical=True)).all()
+    # case is ignored, in alphabets too.
+    assert (kmer.kmerKeys('aacg', 4, 'acgt', canonical=True) ==
+            kmer.kmerKeys('CGTT', 4, canonical=True)).all()
+    assert kmer.decodeKmer(kmer.encodeKmer('MKV*', kmer.AMINO_ACIDS[:-1] + '*'), 4,
+                           kmer.AMINO_ACIDS[:-1] + '*') == 'MKV*'
+    assert len(kmer.kmerKeys('AC', 3)) == 0
+    for k in (0, 32):
+        try:
+            kmer.kmerKeys('ACGT', k)
+        except Exception:
+            pass
+        else:
+            assert False, k
+
+
+def test_countKmers():
+    random.seed(17)
+    seqs = [''.join(random.choice('ACGTN') for i in range(random.randint(0, 300)))
+            for j in range(50)]
+    for k in (3, 13):
+        expected = naiveCounts(seqs, k, 'ACGT')
+        for batchSize in (100, kmer.BATCH_SIZE):
+            keys, counts = kmer.countKmers(seqs, k, batchSize=batchSize)
+            assert dict((kmer.decodeKmer(key, k), count)
+                        for key, count in zip(keys, counts)) == expected
+    proteins = [''.join(random.choice(kmer.AMINO_ACIDS + 'X') for i in range(100))
+                for j in range(10)]
+    keys, counts = kmer.countKmers(proteins, 5, kmer.AMINO_ACIDS)
+    assert dict((kmer.decodeKmer(key, 5, kmer.AMINO_ACIDS), count)
+                for key, count in zip(keys, counts)) == naiveCounts(proteins, 5, kmer.AMINO_ACIDS)
+
+
+def test_sketches():
+    random.seed(18)
+    seq = ''.join(random.choice('ACGT') for i in range(2000))
+    mutant = seq[:1000] + ''.join(random.choice('ACGT') for i in range(1000))
+    sketch = kmer.minHash(seq, 15, size=200)
+    assert len(sketch) == 200 and (np.diff(sketch.astype(np.float64)) > 0).all()
+    assert kmer.jaccard(sketch, sketch) == 1.0
+    similarity = kmer.jaccard(sketch, kmer.minHash(mutant, 15, size=200))
+    assert 0.2 < similarity < 0.5 # about 1/3
+    positions, hashes = kmer.minimizers(seq, 15, 10)
+    keys = kmer.hashKeys(kmer.kmerKeys(seq, 15))
+    assert (keys[positions] == hashes).all()
+    assert (np.diff(positions) <= 10).all()
+    for start in range(len(keys) - 10 + 1):
+        assert start + keys[start:start + 10].argmin() in positions
@@ -0,0 +1,42 @@
+
+import pickle
+import StringIO
+
+import fasta
+import seqstore
+import temps
+
+
+TEXT = '>ns|id1|desc\nACGTACGT\nAC\n>id2 desc\nMKLV\n>ns|id3\nGGGG\nGG\n'
+
+
+def test_SequenceStore():
+    store = seqstore.SequenceStore.fromFasta(StringIO.StringIO(TEXT))
+    expected = list(fasta.readFasta(StringIO.StringIO(TEXT)))
+    assert len(store) == 3
+    assert list(store) == expected
+    assert store[-1] == expected[-1]
+    assert store[1:] == expected[1:]
+    assert store.ids == ['id1', 'id2', 'id3']
+    assert 'id2' in store and 'id4' not in store
+    assert store.seq('id1') == 'ACGTACGTAC'
+    assert store.seq('id1', 2, -2) == 'GTACGT'
+    assert store.length('id3') == 6
+    assert store.nameline('id2') == '>id2 desc'
+    assert list(pickle.loads(pickle.dumps(store, 2))) == expected
+
+
+def test_SequenceStore_save_load():
+    store = seqstore.SequenceStore.fromFasta(StringIO.StringIO(TEXT))
+    with temps.tmpfile() as path:
+        store.save(path)
+        for useMmap in (True, False):
+            loaded = seqstore.SequenceStore.load(path, useMmap)
+            assert list(loaded) == list(store)
+            assert loaded.seq('id3', 1, 3) == 'GG'
+            assert list(pickle.loads(pickle.dumps(loaded))) == list(store)
+        empty = seqstore.SequenceStore.fromSeqs([])
+        empty.save(path)
+        assert len(seqstore.SequenceStore.load(path)) == 0
+
+
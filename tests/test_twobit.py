@@ -0,0 +1,40 @@
+
+import twobit
+import temps
+
+
+def test_pack():
+    seq = 'ACGTTGCAACG'
+    assert len(twobit.pack2(seq)) == 3
+    assert twobit.unpack2(twobit.pack2(seq), len(seq)) == seq
+    assert twobit.unpack2(twobit.pack2('acgN')) == 'ACGT'
+    seq = 'ACGTRYKMSWBDHVN='
+    assert twobit.unpack4(twobit.pack4(seq)) == seq
+    assert twobit.unpack4(twobit.pack4('acgtX'), 5) == 'ACGTN'
+
+
+def test_encode_decode():
+    seq = 'NNACGTacgtNNnnACGTRacgtA'
+    size, nBlocks, maskBlocks, packed = twobit.encode(seq)
+    assert nBlocks == [(0, 2), (10, 4), (18, 1)]
+    assert maskBlocks == [(6, 4), (12, 2), (19, 4)]
+    expected = 'NNACGTacgtNNnnACGTNacgtA'
+    assert twobit.decode(size, nBlocks, maskBlocks, packed) == expected
+    assert twobit.decode(size, nBlocks, maskBlocks, packed, 5, 13) == expected[5:13]
+
+
+def test_TwoBitFile():
+    seqs = [('>chr1 desc', 'ACGTNNNNacgtACGT' * 10), ('>chr2', 'A'),
+            ('>chr3', 'nnnnACGTA')]
+    with temps.tmpfile() as path:
+        twobit.writeTwoBit(seqs, path)
+        with twobit.TwoBitFile(path) as genome:
+            assert genome.ids == ['chr1', 'chr2', 'chr3']
+            assert genome.length('chr1') == 160
+            assert genome.fetch('chr1') == seqs[0][1]
+            assert genome.fetch('chr1', 6, 30) == seqs[0][1][6:30]
+            assert genome.fetch('chr3', -5) == 'ACGTA'
+            assert list(genome) == [('chr1', seqs[0][1]), ('chr2', 'A'),
+                                    ('chr3', 'nnnnACGTA')]
+
+
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+'''
+Packed nucleotide encodings and the UCSC .2bit file format.
+
+2-bit encoding packs the bases T, C, A and G into 2 bits each, 4 bases per
+byte, with the first base in the high bits, as in .2bit files.  Other
+characters can not be represented, so .2bit files record runs of them as N
+blocks, and runs of lowercase (soft-masked) bases as mask blocks.  A .2bit file
+is about a quarter of the size of the fasta file it was made from.  Any
+character other than ACGT (e.g. the IUPAC ambiguity codes) comes back as N.
+http://genome.ucsc.edu/FAQ/FAQformat.html#format7
+
+4-bit encoding packs the 16 IUPAC nucleotide codes '=ACMGRSVTWYHKDBN' into 4
+bits each, 2 per byte, as in BAM files.  It is lossless for IUPAC codes but
+does not preserve case.
+
+Usage:
+
+    fastaToTwoBit('genome.fa', 'genome.2bit')
+    with TwoBitFile('genome.2bit') as genome:
+        seq = genome.fetch('chr1', 1000000, 1000100)
+'''
+
+import array
+import binascii
+import bisect
+import os
+import re
+import shutil
+import struct
+
+import fasta
+import temps
+
+
+SIGNATURE = 0x1A412743
+
+# 2-bit codes of bases, as base-4 digits.  Characters other than ACGT are encoded as T, like in faToTwoBit, and
+# recorded in N blocks.
+_PACK2_TABLE = ''.join({'T': '0', 'C': '1', 'A': '2', 'G': '3',
+                        't': '0', 'c': '1', 'a': '2', 'g': '3'}.get(chr(i), '0') for i in range(256))
+# the 4 bases packed into each possible byte.
+_UNPACK2 = dict((chr(i), ''.join('TCAG'[(i >> shift) & 3] for shift in (6, 4, 2, 0))) for i in range(256))
+
+# 4-bit codes are the positions of IUPAC codes in this alphabet, written as hex digits.
+IUPAC = '=ACMGRSVTWYHKDBN'
+_PACK4_TABLE = ''.join('%x' % IUPAC.find(chr(i).upper()) if chr(i).upper() in IUPAC else 'f' for i in range(256))
+_UNPACK4_TABLE = ''.join(IUPAC[int(chr(i), 16)] if chr(i) in '0123456789abcdef' else chr(i) for i in range(256))
+
+_N_BLOCK_RE = re.compile('[^ACGTacgt]+')
+_MASK_BLOCK_RE = re.compile('[a-z]+')
+
+
+def pack2(seq):
+    '''
+    seq: a nucleotide sequence.
+    returns: seq packed 4 bases to a byte.  The last byte is padded with T.  Characters other than ACGT are packed
+    as T and case is ignored.
+    '''
+    codes = seq.translate(_PACK2_TABLE)
+    codes += '0' * (-len(codes) % 4)
+    if not codes:
+        return ''
+    # a power-of-two base conversion through a long is linear and avoids a python loop over the bases.
+    return binascii.unhexlify(('%x' % int(codes, 4)).zfill(len(codes) // 2))
+
+
+def unpack2(packed, size=None):
+    '''
+    packed: bases packed by pack2().
+    size: the number of bases to unpack.  Defaults to 4 * len(packed).
+    returns: the uppercase sequence of TCAG bases.
+    '''
+    seq = ''.join(map(_UNPACK2.__getitem__, packed))
+    return seq if size is None else seq[:size]
+
+
+def pack4(seq):
+    '''
+    seq: a nucleotide sequence of IUPAC codes.
+    returns: seq packed 2 bases to a byte.  Case is ignored and characters other than IUPAC codes are packed as N.  If
+    seq has an odd length, the last byte is padded with '='.
+    '''
+    codes = seq.translate(_PACK4_TABLE)
+    return binascii.unhexlify(codes + '0' * (len(codes) % 2))
+
+
+def unpack4(packed, size=None):
+    '''
+    packed: bases packed by pack4().
+    size: the number of bases to unpack.  Defaults to 2 * len(packed).
+    returns: the uppercase sequence.
+    '''
+    seq = binascii.hexlify(packed).translate(_UNPACK4_TABLE)
+    return seq if size is None else seq[:size]
+
+
+def encode(seq):
+    '''
+    seq: a nucleotide sequence.
+    returns: a tuple of (size, nBlocks, maskBlocks, packed), where nBlocks and maskBlocks are lists of (start, size)
+    runs of non-ACGT and of lowercase characters in seq, and packed is pack2(seq).
+    '''
+    nBlocks = [(m.start(), m.end() - m.start()) for m in _N_BLOCK_RE.finditer(seq)]
+    maskBlocks = [(m.start(), m.end() - m.start()) for m in _MASK_BLOCK_RE.finditer(seq)]
+    return len(seq), nBlocks, maskBlocks, pack2(seq)
+
+
+def decode(size, nBlocks, maskBlocks, packed, start=0, end=None):
+    '''
+    size, nBlocks, maskBlocks, packed: a sequence as returned by encode().
+    start, end: slice indices of a subsequence to decode, as in seq[start:end].
+    returns: the sequence, or subsequence, with N runs and soft-masking restored.
+    '''
+    start, end, step = slice(start, end).indices(size)
+    end = max(start, end)
+    return _decode(packed[start // 4:(end + 3) // 4], nBlocks, maskBlocks, start, end)
+
+
+def _decode(packed, nBlocks, maskBlocks, start, end):
+    '''
+    packed: the packed bytes covering a subsequence, starting with the byte containing base start.
+    returns: the subsequence from start to end.
+    '''
+    offset = start - 4 * (start // 4)
+    seq = bytearray(unpack2(packed)[offset:offset + end - start])
+    for blockStart, blockEnd in _overlaps(nBlocks, start, end):
+        seq[blockStart:blockEnd] = 'N' * (blockEnd - blockStart)
+    for blockStart, blockEnd in _overlaps(maskBlocks, start, end):
+        seq[blockStart:blockEnd] = seq[blockStart:blockEnd].lower()
+    return str(seq)
+
+
+def _overlaps(blocks, start, end):
+    '''
+    blocks: a list of (start, size) blocks, sorted by start and not overlapping.
+    yields: (start, end) of the part of each block that overlaps start to end, relative to start.
+    '''
+    i = max(bisect.bisect_right(blocks, (start, float('inf'))) - 1, 0)
+    while i < len(blocks) and blocks[i][0] < end:
+        blockStart, blockEnd = max(blocks[i][0], start), min(blocks[i][0] + blocks[i][1], end)
+        if blockStart < blockEnd:
+            yield blockStart - start, blockEnd - start
+        i += 1
+
+
+def writeTwoBit(seqs, path):
+    '''
+    seqs: an iterable of (nameline, seq) tuples, like fasta.readFasta() yields.  Sequence names are parsed from the
+      namelines with fasta.idFromName().
+    path: where to write the .2bit file.
+    Sequences are packed into a temp file next to path as they are read, so only the names are kept in memory.
+    '''
+    names = []
+    recordSizes = []
+    with temps.tmpfile(root=os.path.dirname(os.path.abspath(path))) as recordsPath:
+        with open(recordsPath, 'wb') as fh:
+            for nameline, seq in seqs:
+                record = _packRecord(str(seq))
+                names.append(fasta.idFromName(nameline))
+                recordSizes.append(len(record))
+                fh.write(record)
+        indexSize = sum(len(name) + 5 for name in names)
+        # version 1 files use 64-bit offsets, for files over 4GB.
+        version = int(16 + indexSize + 4 * len(names) + sum(recordSizes) >= 2**32)
+        offsetFormat = '=Q' if version else '=I'
+        offset = 16 + indexSize + len(names) * (struct.calcsize(offsetFormat) - 4)
+        with open(path, 'wb') as out:
+            out.write(struct.pack('=4I', SIGNATURE, version, len(names), 0))
+            for name, recordSize in zip(names, recordSizes):
+                out.write(struct.pack('=B', len(name)) + name + struct.pack(offsetFormat, offset))
+                offset += recordSize
+            with open(recordsPath, 'rb') as fh:
+                shutil.copyfileobj(fh, out, fasta.BLOCK_SIZE)
+
+
+def fastaToTwoBit(fastaPath, twoBitPath):
+    '''
+    Convert the fasta file at fastaPath, which may be compressed, to a .2bit file.
+    '''
+    writeTwoBit(fasta.readFasta(fastaPath), twoBitPath)
+
+
+def _packRecord(seq):
+    size, nBlocks, maskBlocks, packed = encode(seq)
+    parts = [struct.pack('=II', size, len(nBlocks))]
+    parts.append(array.array('I', [start for start, n in nBlocks]).tostring())
+    parts.append(array.array('I', [n for start, n in nBlocks]).tostring())
+    parts.append(struct.pack('=I', len(maskBlocks)))
+    parts.append(array.array('I', [start for start, n in maskBlocks]).tostring())
+    parts.append(array.array('I', [n for start, n in maskBlocks]).tostring())
+    parts.append(struct.pack('=I', 0))
+    parts.append(packed)
+    return ''.join(parts)
+
+
+class TwoBitFile(object):
+    '''
+    Random access to the sequences in a .2bit file.  Fetching a subsequence
+    reads only the packed bytes that cover it.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.fh = open(path, 'rb')
+        header = self.fh.read(16)
+        for byteOrder in '<>':
+            signature, version, count, reserved = struct.unpack(byteOrder + '4I', header)
+            if signature == SIGNATURE:
+                break
+        else:
+            raise Exception('2bit error: bad signature.', path)
+        self.byteOrder = byteOrder
+        offsetFormat = byteOrder + ('Q' if version == 1 else 'I')
+        offsetSize = struct.calcsize(offsetFormat)
+        self.ids = []
+        self.idToOffset = {}
+        for i in xrange(count):
+            nameSize = ord(self.fh.read(1))
+            name = self.fh.read(nameSize)
+            self.ids.append(name)
+            self.idToOffset[name] = struct.unpack(offsetFormat, self.fh.read(offsetSize))[0]
+        self.idToRecord = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.idToOffset
+
+    def __iter__(self):
+        '''
+        yields: (id, seq) for every sequence in the file.
+        '''
+        for id in self.ids:
+            yield id, self.fetch(id)
+
+    def close(self):
+        self.fh.close()
+
+    def length(self, id):
+        return self._record(id)[0]
+
+    def fetch(self, id, start=None, end=None):
+        '''
+        id: the name of a sequence.  Raises a KeyError if there is no sequence with that name.
+        start, end: slice indices, so fetch(id, start, end) == fetch(id)[start:end].
+        returns: the sequence, or subsequence.
+        '''
+        size, nBlocks, maskBlocks, packedOffset = self._record(id)
+        start, end, step = slice(start, end).indices(size)
+        end = max(start, end)
+        self.fh.seek(packedOffset + start // 4)
+        packed = self.fh.read((end + 3) // 4 - start // 4)
+        return _decode(packed, nBlocks, maskBlocks, start, end)
+
+    def _record(self, id):
+        '''
+        returns: (size, nBlocks, maskBlocks, packedOffset) of the sequence with the given id, reading the header of its
+        record the first time.
+        '''
+        if id not in self.idToRecord:
+            self.fh.seek(self.idToOffset[id])
+            size, nBlocks = self._readInts(2)
+            nBlocks = zip(self._readInts(nBlocks), self._readInts(nBlocks))
+            maskBlocks = self._readInts(1)[0]
+            maskBlocks = zip(self._readInts(maskBlocks), self._readInts(maskBlocks))
+            self._readInts(1) # reserved
+            self.idToRecord[id] = (size, nBlocks, maskBlocks, self.fh.tell())
+        return self.idToRecord[id]
+
+    def _readInts(self, n):
+        return struct.unpack('%s%sI' % (self.byteOrder, n), self.fh.read(4 * n))
+
+
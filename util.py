@@ -6,10 +6,12 @@ General, widely applicable utilities.
 ONLY DEPENDENCIES ON STANDARD LIBRARY MODULES ALLOWED IN THIS FILE.
 '''
 
+import contextlib
 import datetime
 import hashlib # sha
 import itertools
 import math
+import multiprocessing
 import os
 import subprocess
 import sys
@@ -540,6 +542,39 @@ def differentFiles(filename1, filename2):
     return isDifferent
 
 
+@contextlib.contextmanager
+def openOut(out, mode='w'):
+    '''
+    yields: a file opened with mode if out is a path, which is closed afterwards, or out itself otherwise.
+    '''
+    if isinstance(out, basestring):
+        with open(out, mode) as fh:
+            yield fh
+    else:
+        yield out
+
+
+def poolMap(func, tasks, numProcs=None, ordered=True):
+    '''
+    Map func over tasks in a pool of numProcs processes, yielding the results in order if ordered is True or as they
+    finish otherwise.  func must be picklable, i.e. defined at the top level of a module.  The pool is terminated when
+    the results are exhausted or the generator is closed.
+    numProcs: the number of worker processes.  Defaults to the number of cpus.
+    '''
+    pool = multiprocessing.Pool(numProcs)
+    try:
+        if ordered:
+            results = pool.imap(func, tasks)
+        else:
+            results = pool.imap_unordered(func, tasks)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
 if __name__ == '__main__':
     pass
 